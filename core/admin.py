@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from core import models
+from django.db.models import F, OuterRef, Prefetch, Subquery
+from core import models, outliers
 from django.utils.translation import gettext as _
+from parler import appsettings
 from parler.admin import TranslatableAdmin
 # App models
 from .models import Activity, ActivityLog, Area, Category, HouseType, HousePriceSource, PriceType
@@ -10,6 +12,25 @@ from .models import UnitConv, UnitType, Unit, UnitType, UnitConv
 # Register your models here.
 
 
+class TranslationPrefetchAdmin(TranslatableAdmin):
+    """TranslatableAdmin loading the translations of the listed rows in one
+    query instead of one per row"""
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        meta = self.model._parler_meta
+        languages = appsettings.PARLER_LANGUAGES.get_active_choices(self.get_queryset_language(request))
+        return qs.prefetch_related(Prefetch(
+            meta.root_rel_name,
+            queryset=meta.root_model.objects.filter(language_code__in=languages)))
+
+    def translated_name(self, model, outer_ref, request):
+        """Subquery with the name of a related translatable row in the active language"""
+        translations = model._parler_meta.root_model.objects.filter(
+            master=OuterRef(outer_ref), language_code=self.get_queryset_language(request))
+        return Subquery(translations.values('name')[:1])
+
+
 class UserAdmin(BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'username']
@@ -40,78 +61,114 @@ class LanguageAdmin(admin.ModelAdmin):
     list_filter = ['iso_code', 'name_en']
 
 
-class ActivityAdmin(TranslatableAdmin):
+class ActivityAdmin(TranslationPrefetchAdmin):
     model = Activity
     ordering = ['code']
     list_display = ['code', 'points']
     search_fields = ['code', ]
 
 
-class AreaAdmin(TranslatableAdmin):
+class AreaAdmin(TranslationPrefetchAdmin):
     model = Area
     list_display = ['code']
     search_fields = ['code', ]
 
 
-class CategoryAdmin(TranslatableAdmin):
+class CategoryAdmin(TranslationPrefetchAdmin):
     model = Category
 
     list_display = ['get_area_code', 'code', ]
-    search_fields = ['get_area_code', 'code', ]
+    search_fields = ['area__code', 'code', ]
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(area_code=F('area__code'))
 
+    @admin.display(description='area', ordering='area_code')
     def get_area_code(self, obj):
-        return obj.area.code
+        return obj.area_code
 
 
-class HousePriceSourceAdmin(TranslatableAdmin):
+class HousePriceSourceAdmin(TranslationPrefetchAdmin):
     model = HousePriceSource
     list_display = ['code', ]
     search_fields = ['code', ]
 
 
-class HouseTypeAdmin(TranslatableAdmin):
+class HouseTypeAdmin(TranslationPrefetchAdmin):
     model = HouseType
     list_display = ['code', ]
     search_fields = ['code', ]
 
 
-class PriceTypeAdmin(TranslatableAdmin):
+class PriceTypeAdmin(TranslationPrefetchAdmin):
     model = PriceType
     list_display = ['code', ]
     search_fields = ['code', ]
 
 
-class UnitTypeAdmin(TranslatableAdmin):
+class UnitTypeAdmin(TranslationPrefetchAdmin):
     model = UnitType
     list_display = ['code', ]
     search_fields = ['code', ]
 
 
-class ResourceUsageAdmin(TranslatableAdmin):
+class ResourceUsageAdmin(TranslationPrefetchAdmin):
     model = models.ResourceUsage
     list_display = ['code', ]
     search_fields = ['code', ]
 
 
-class UnitAdmin(TranslatableAdmin):
+class UnitAdmin(TranslationPrefetchAdmin):
     model = Unit
     list_display = ['iso_code', 'name_en', 'get_unit_type', 'is_metric']
     search_fields = ['iso_code', 'name_en']
 
+    def get_queryset(self, request):
+        # UnitType has no name_en, show its name in the active language
+        return super().get_queryset(request).annotate(
+            unit_type_name=self.translated_name(UnitType, 'unit_type', request))
+
+    @admin.display(description='unit type', ordering='unit_type_name')
     def get_unit_type(self, obj):
-        return obj.unit_type.name_en
+        return obj.unit_type_name
 
 
 class UnitConvAdmin(admin.ModelAdmin):
     model = UnitConv
     list_display = ['get_unit_name', 'get_to_unit_name', 'conv_factor']
-    search_fields = ['get_unit_name', 'get_to_unit_name', ]
+    search_fields = ['unit__name_en', 'to_unit__name_en', ]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            unit_name=F('unit__name_en'), to_unit_name=F('to_unit__name_en'))
+
+    @admin.display(description='unit', ordering='unit_name')
     def get_unit_name(self, obj):
-        return obj.unit.name_en
+        return obj.unit_name
 
+    @admin.display(description='to unit', ordering='to_unit_name')
     def get_to_unit_name(self, obj):
-        return obj.to_unit.name_en
+        return obj.to_unit_name
+
+
+class PriceFlagAdmin(admin.ModelAdmin):
+    model = models.PriceFlag
+    list_display = ['price_model', 'price_id', 'city', 'item_id', 'value', 'score', 'status', 'created_on']
+    list_filter = ['status', 'price_model']
+    list_select_related = ['city']
+    readonly_fields = ['price_model', 'price_id', 'city', 'item_id', 'value', 'score', 'median', 'mad',
+                       'created_on', 'reviewed_by', 'reviewed_on']
+    actions = ['accept', 'reject']
+
+    @admin.action(description='Accept the selected prices')
+    def accept(self, request, queryset):
+        for flag in queryset:
+            outliers.review(flag, models.PriceFlag.ACCEPTED, request.user)
+
+    @admin.action(description='Reject and delete the selected prices')
+    def reject(self, request, queryset):
+        for flag in queryset:
+            outliers.review(flag, models.PriceFlag.REJECTED, request.user)
 
 
 # The model.User class is displayed using the UserAdmin class
@@ -128,3 +185,4 @@ admin.site.register(models.UnitType, UnitTypeAdmin)
 admin.site.register(models.ResourceUsage, ResourceUsageAdmin)
 admin.site.register(models.Unit, UnitAdmin)
 admin.site.register(models.UnitConv, UnitConvAdmin)
+admin.site.register(models.PriceFlag, PriceFlagAdmin)
@@ -0,0 +1,117 @@
+"""Maintenance of the monthly PriceAggregate buckets.
+
+A bucket is (price model, city, item, month). New price rows are folded into
+their bucket with an INSERT ... ON CONFLICT DO UPDATE, so inserts never rescan
+the raw table. Updates and deletes can not be undone from count/sum/min/max,
+so the touched buckets are recomputed from the raw rows of that city, item
+and month, which is an index range scan. Recomputing takes a transaction
+advisory lock per bucket, so two transactions refreshing a bucket run one
+after the other and the second sees the rows of the first. rebuild()
+recomputes everything.
+
+The signal receivers in core.signals call these functions for ORM writes,
+bulk loaders call add_rows() with the rows they inserted. Duplicates and rows
+quarantined by core.outliers are left out.
+"""
+from django.db import connection, transaction
+
+from core import hierarchy
+from core.models import City, PriceAggregate
+from core.outliers import quarantined_sql
+
+AGGREGATE_TABLE = PriceAggregate._meta.db_table
+CITY_TABLE = City._meta.db_table
+
+
+def _select(spec, source, where='true'):
+    """SELECT producing aggregate rows from source, a relation with the
+    columns of the price table. Its parameters are spec.key, the ones of
+    source, spec.key again and the ones of where"""
+    item = spec.item_sql('p')
+    value = spec.value_sql('p')
+    item_path = 'min(p.item_path)' if hierarchy.has_item_path(spec) else "''"
+    return (
+        f"SELECT %s AS price_model, p.country_id, p.city_id, {item} AS item_id, "
+        f"date_trunc('month', p.date)::date AS month, count({value}), "
+        f"coalesce(sum({value}), 0), min({value}), max({value}), avg({value}), now(), "
+        f"min(c.path), {item_path} "
+        f"FROM {source} p JOIN {CITY_TABLE} c ON c.id = p.city_id "
+        f"WHERE {value} IS NOT NULL AND NOT p.is_duplicate "
+        f"AND NOT {quarantined_sql(spec)} AND {where} "
+        f"GROUP BY 2, 3, 4, 5")
+
+
+COLUMNS = ('price_model, country_id, city_id, item_id, month, count, total, minimum, maximum, mean, updated_on, '
+           'city_path, item_path')
+# a bucket inserted meanwhile by add_rows() is replaced by the recomputed one
+ON_CONFLICT_REPLACE = (
+    "ON CONFLICT (price_model, city_id, item_id, month) DO UPDATE SET country_id = EXCLUDED.country_id, "
+    "count = EXCLUDED.count, total = EXCLUDED.total, minimum = EXCLUDED.minimum, "
+    "maximum = EXCLUDED.maximum, mean = EXCLUDED.mean, updated_on = EXCLUDED.updated_on, "
+    "city_path = EXCLUDED.city_path, item_path = EXCLUDED.item_path")
+
+
+def add_rows(spec, source, where='true', params=()):
+    """Folds the rows of source matching where into their buckets"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {AGGREGATE_TABLE} AS a ({COLUMNS}) {_select(spec, source, where)} "
+            f"ON CONFLICT (price_model, city_id, item_id, month) DO UPDATE SET "
+            f"count = a.count + EXCLUDED.count, total = a.total + EXCLUDED.total, "
+            f"minimum = LEAST(a.minimum, EXCLUDED.minimum), "
+            f"maximum = GREATEST(a.maximum, EXCLUDED.maximum), "
+            f"mean = (a.total + EXCLUDED.total) / NULLIF(a.count + EXCLUDED.count, 0), "
+            f"updated_on = EXCLUDED.updated_on, city_path = EXCLUDED.city_path, "
+            f"item_path = EXCLUDED.item_path",
+            [spec.key, spec.key, *params])
+
+
+def add(spec, obj):
+    """Folds one saved price row into its bucket"""
+    add_rows(spec, spec.table, 'p.id = %s', [obj.pk])
+
+
+def bucket(spec, obj):
+    """Returns the (city_id, item_id, month) bucket of a price row"""
+    item_id = getattr(obj, spec.item_column) if spec.item_column else 0
+    return obj.city_id, item_id, obj.date.replace(day=1)
+
+
+def _lock(cursor, spec, buckets):
+    """Waits for the other transactions refreshing the buckets. The locks are
+    taken in one order, so two refreshes never deadlock"""
+    names = sorted(f'{spec.key}:{city}:{item}:{month}' for city, item, month in buckets)
+    cursor.execute("SELECT count(pg_advisory_xact_lock(hashtextextended(name, 0))) "
+                   "FROM unnest(%s::text[]) AS name", [names])
+
+
+def refresh(spec, buckets):
+    """Recomputes the given (city_id, item_id, month) buckets from the raw rows"""
+    buckets = list(set(buckets))
+    if not buckets:
+        return
+    cities, items, months = (list(column) for column in zip(*buckets))
+    item = spec.item_sql('p')
+    keys = "unnest(%s::bigint[], %s::bigint[], %s::date[]) AS b (city_id, item_id, month)"
+    with transaction.atomic(), connection.cursor() as cursor:
+        _lock(cursor, spec, buckets)
+        # read committed: the statements below see the rows committed while waiting
+        cursor.execute(
+            f"DELETE FROM {AGGREGATE_TABLE} a USING {keys} WHERE a.price_model = %s "
+            f"AND a.city_id = b.city_id AND a.item_id = b.item_id AND a.month = b.month",
+            [cities, items, months, spec.key])
+        source = (f"(SELECT p.* FROM {spec.table} p JOIN {keys} ON p.city_id = b.city_id "
+                  f"AND {item} = b.item_id AND p.date >= b.month "
+                  f"AND p.date < b.month + interval '1 month')")
+        cursor.execute(f"INSERT INTO {AGGREGATE_TABLE} ({COLUMNS}) {_select(spec, source)} "
+                       f"{ON_CONFLICT_REPLACE}",
+                       [spec.key, cities, items, months, spec.key])
+
+
+def rebuild(spec):
+    """Recomputes every bucket of a price model. Returns the number of buckets"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {AGGREGATE_TABLE} WHERE price_model = %s", [spec.key])
+        cursor.execute(f"INSERT INTO {AGGREGATE_TABLE} ({COLUMNS}) {_select(spec, spec.table)}",
+                       [spec.key, spec.key])
+        return cursor.rowcount
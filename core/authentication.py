@@ -0,0 +1,256 @@
+"""API authentication: cached DRF tokens, or stateless JSON web tokens.
+
+DRF's TokenAuthentication reads the token and its user on every API
+request. CachedTokenAuthentication keeps (user, token) in the Django cache
+for AUTH_TOKEN_CACHE_TTL seconds (default 60), so a client making a burst of
+requests authenticates with one query. Deleting a token (logout) or saving a
+user drops the entries of their tokens, see core.signals. Counters updated
+with QuerySet.update(), e.g. User.points, can be stale on request.user for
+up to the TTL.
+
+Entries are keyed by a sha256 of the token, the cache never holds a usable
+credential. The signals drop entries from the cache of the process saving
+the token or user, so tokens are only cached when the cache is shared by
+the workers, see shared_cache(). With a per process cache (LocMemCache, the
+default without REDIS_URL) every request reads the token.
+
+With AUTH_MODE = 'jwt' clients can also log in at /auth/jwt/create/ and send
+"Authorization: Bearer <access token>". Access tokens live 5 minutes and
+carry the user id, so JWTAuthentication checks them without a query: the
+request user is a JWTUser, which loads the User row only when a view reads
+a field the token does not carry. /auth/jwt/refresh/ rotates the refresh
+token, /auth/jwt/logout/ revokes it. Revoked tokens are listed in the cache
+until they expire, and saving a new password or deactivating a user revokes
+every token issued to them until then: tokens carry a generation number
+that revoke_user() moves past. Signing uses SECRET_KEY, which
+must be the same for all the workers (DJANGO_SECRET_KEY), and the
+revocations must be seen by all the workers too: the 'jwt' mode needs a
+shared cache, see check_settings().
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.functional import cached_property
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework_simplejwt.authentication import JWTTokenUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+TOKEN = 'token'
+JWT = 'jwt'
+DEFAULT_TTL = 60
+# claim of the generation of the tokens of the user, see revoke_user()
+GENERATION_CLAIM = 'gen'
+# backends whose entries are not seen by the other workers
+LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+def mode():
+    return getattr(settings, 'AUTH_MODE', TOKEN)
+
+
+def ttl():
+    return getattr(settings, 'AUTH_TOKEN_CACHE_TTL', DEFAULT_TTL)
+
+
+def shared_cache():
+    """Whether the default cache is shared by the workers. AUTH_SHARED_CACHE
+    overrides the guess made from the backend, e.g. True for a single
+    process server"""
+    shared = getattr(settings, 'AUTH_SHARED_CACHE', None)
+    if shared is None:
+        return not isinstance(caches[DEFAULT_CACHE_ALIAS], LOCAL_CACHES)
+    return shared
+
+
+def check_settings():
+    """Raises ImproperlyConfigured for AUTH_MODE 'jwt' without a shared cache:
+    a token revoked by one worker would still be accepted by the others, and
+    a refresh token could be rotated once per worker"""
+    if mode() == JWT and not shared_cache():
+        raise ImproperlyConfigured(
+            "AUTH_MODE 'jwt' needs a cache shared by the workers to revoke tokens, set REDIS_URL "
+            "(or AUTH_SHARED_CACHE = True when a single process serves the API).")
+
+
+def cache_key(key):
+    return f'auth:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    def authenticate_credentials(self, key):
+        if not shared_cache():
+            return super().authenticate_credentials(key)
+        entry = cache_key(key)
+        cached = cache.get(entry)
+        if cached is None:
+            # inactive users and unknown tokens raise and are not cached
+            cached = super().authenticate_credentials(key)
+            cache.set(entry, cached, ttl())
+        return cached
+
+
+def invalidate_token(sender, instance, **kwargs):
+    """Drops the cached user of a deleted or changed token"""
+    cache.delete(cache_key(instance.key))
+
+
+def invalidate_user(sender, instance, raw=False, **kwargs):
+    """Drops the cached entries of the tokens of a saved user"""
+    if raw:
+        return
+    keys = Token.objects.filter(user_id=instance.pk).values_list('key', flat=True)
+    cache.delete_many([cache_key(key) for key in keys])
+
+
+def _jti_key(jti):
+    return f'auth:jwt:jti:{jti}'
+
+
+def _user_key(user_id):
+    return f'auth:jwt:user:{user_id}'
+
+
+def revoke(token):
+    """Revokes a token until it expires. Returns False when it already was"""
+    timeout = max(1, token['exp'] - int(time.time()))
+    return cache.add(_jti_key(token[jwt_settings.JTI_CLAIM]), 1, timeout)
+
+
+def generation(user_id):
+    """The generation of the tokens of a user, 0 until revoke_user()"""
+    return cache.get(_user_key(user_id), 0)
+
+
+def tokens_for(user):
+    """A refresh token for user, carrying the generation of their tokens.
+    The access tokens made from it copy the claim"""
+    refresh = RefreshToken.for_user(user)
+    refresh[GENERATION_CLAIM] = generation(user.pk)
+    return refresh
+
+
+def revoke_user(user_id):
+    """Revokes the tokens issued to a user so far, tokens issued from now on
+    carry the next generation. The generation does not expire: an older
+    number coming back would revive revoked tokens"""
+    key = _user_key(user_id)
+    cache.add(key, 0, None)
+    cache.incr(key)
+
+
+def is_revoked(token):
+    """Whether a validated token was revoked, one cache read"""
+    jti_key = _jti_key(token[jwt_settings.JTI_CLAIM])
+    user_key = _user_key(token[jwt_settings.USER_ID_CLAIM])
+    found = cache.get_many([jti_key, user_key])
+    if jti_key in found:
+        return True
+    return token.get(GENERATION_CLAIM, 0) < found.get(user_key, 0)
+
+
+class JWTUser(TokenUser):
+    """The user of an access token. The id comes from the token, other
+    attributes load the User row on first use. TokenUser reads the flags and
+    permissions from claims our tokens do not carry, they are the user's"""
+
+    @cached_property
+    def user(self):
+        return get_user_model()._default_manager.get(pk=self.pk)
+
+    @property
+    def username(self):
+        return self.user.get_username()
+
+    @property
+    def is_staff(self):
+        return self.user.is_staff
+
+    @property
+    def is_superuser(self):
+        return self.user.is_superuser
+
+    @property
+    def groups(self):
+        return self.user.groups
+
+    @property
+    def user_permissions(self):
+        return self.user.user_permissions
+
+    def get_group_permissions(self, obj=None):
+        return self.user.get_group_permissions(obj)
+
+    def get_all_permissions(self, obj=None):
+        return self.user.get_all_permissions(obj)
+
+    def has_perm(self, perm, obj=None):
+        return self.user.has_perm(perm, obj)
+
+    def has_perms(self, perm_list, obj=None):
+        return self.user.has_perms(perm_list, obj)
+
+    def has_module_perms(self, module):
+        return self.user.has_module_perms(module)
+
+    def __getattr__(self, name):
+        if name.startswith('_') or name == 'token':
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def save(self, *args, **kwargs):
+        self.user.save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self.user.delete(*args, **kwargs)
+
+    def set_password(self, raw_password):
+        self.user.set_password(raw_password)
+
+    def check_password(self, raw_password):
+        return self.user.check_password(raw_password)
+
+
+class JWTAuthentication(JWTTokenUserAuthentication):
+    """Bearer access tokens, when AUTH_MODE is 'jwt'"""
+
+    def authenticate(self, request):
+        if mode() != JWT:
+            return None
+        return super().authenticate(request)
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if is_revoked(token):
+            raise InvalidToken({'detail': 'Token is revoked.', 'code': 'token_not_valid'})
+        return token
+
+    def get_user(self, validated_token):
+        if jwt_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('Token contained no recognizable user identification')
+        return JWTUser(validated_token)
+
+
+def check_not_revoked(token):
+    """Raises TokenError for a revoked token"""
+    if is_revoked(token):
+        raise TokenError('Token is revoked')
+
+
+def credentials_changed(sender, instance, raw=False, **kwargs):
+    """Revokes the tokens of a user whose password is being changed or who is
+    deactivated. Connected to pre_save, where a new password is still known"""
+    if raw or instance.pk is None:
+        return
+    if instance._password is not None or not instance.is_active:
+        revoke_user(instance.pk)
@@ -0,0 +1,120 @@
+"""Awarding activity points within the Activity limits.
+
+Activity.max_per_day and max_per_week (0 means no limit) are enforced with
+ActivityCounter rows per user, activity and fixed window (the UTC day, the
+ISO week), so deciding an award reads the two counter rows instead of
+counting ActivityLog rows. A missing counter (first award of the window, or a window
+started before the counters existed) is counted from ActivityLog for that
+window only, through the (user, activity, created_at) index. Counters of
+ended windows are deleted when the next window starts.
+
+Awards of a user are serialized by locking the user row, which is also the
+row whose points are incremented. The counters are read and incremented
+under that lock in the same transaction as the log, so concurrent
+submissions can not both pass the limit check, whichever worker or process
+serves them, and a rolled back award leaves no count behind:
+
+    log = awards.award(request.user, 'price_submission')
+    if log is None:
+        # limit reached
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core import leaderboard
+from core.models import Activity, ActivityCounter, ActivityLog, User
+
+
+class Window:
+    """One limit: the logs of a user and activity between start and end"""
+
+    def __init__(self, name, user_id, activity, start, end, limit):
+        self.name = name
+        self.user_id = user_id
+        self.activity = activity
+        self.start = start
+        self.end = end
+        self.limit = limit
+
+    def recount(self):
+        # both bounds, so only the partitions of the window are scanned
+        return ActivityLog.objects.filter(user_id=self.user_id, activity=self.activity,
+                                          created_at__gte=self.start, created_at__lt=self.end).count()
+
+
+def windows(user_id, activity, now=None):
+    """The day and week windows of an activity for a user"""
+    now = now or timezone.now()
+    day = datetime.combine(now.date(), time(), tzinfo=timezone.utc)
+    week = day - timedelta(days=day.weekday())
+    return [
+        Window('day', user_id, activity.code, day, day + timedelta(days=1), activity.max_per_day),
+        Window('week', user_id, activity.code, week, week + timedelta(weeks=1), activity.max_per_week),
+    ]
+
+
+def _stored(counters):
+    """The ActivityCounter rows of the windows"""
+    current = Q()
+    for window in counters:
+        current |= Q(window=window.name, start=window.start)
+    window = counters[0]
+    return ActivityCounter.objects.filter(current, user_id=window.user_id, activity=window.activity)
+
+
+def counts(counters, create=False):
+    """{window name: logs in the window}. Missing counters are recounted from
+    the logs, and stored when create is true, which needs the lock of the
+    user row"""
+    stored = dict(_stored(counters).values_list('window', 'count'))
+    missing = [window for window in counters if window.name not in stored]
+    for window in missing:
+        stored[window.name] = window.recount()
+    if create and missing:
+        # the window started: the counter of the previous one is done with
+        ended = Q()
+        for window in missing:
+            ended |= Q(window=window.name, start__lt=window.start)
+        ActivityCounter.objects.filter(ended, user_id=window.user_id, activity=window.activity).delete()
+        ActivityCounter.objects.bulk_create([
+            ActivityCounter(user_id=window.user_id, activity=window.activity, window=window.name,
+                            start=window.start, count=stored[window.name]) for window in missing])
+    return stored
+
+
+def award(user, activity):
+    """Logs activity (an Activity or its code) for user and adds its points,
+    unless a limit is reached. Returns the ActivityLog or None when refused.
+    The counters of every window are kept, limited or not, so a limit set
+    during a window counts the awards made before it"""
+    if not isinstance(activity, Activity):
+        activity = Activity.objects.get(code=activity)
+    counters = windows(user.pk, activity, timezone.now())
+    with transaction.atomic():
+        country = User.objects.select_for_update().filter(pk=user.pk).values_list(
+            'country_id', flat=True).get()
+        stored = counts(counters, create=True)
+        if any(window.limit and stored[window.name] >= window.limit for window in counters):
+            return None
+        log = ActivityLog.objects.create(user_id=user.pk, activity=activity.code,
+                                         points=activity.points)
+        User.objects.filter(pk=user.pk).update(points=F('points') + activity.points)
+        _stored(counters).update(count=F('count') + 1)
+        if activity.points:
+            transaction.on_commit(
+                lambda: leaderboard.record(user.pk, country, activity.points))
+    return log
+
+
+def remaining(user, activity):
+    """Awards left for user today and this week, None when unlimited"""
+    if not isinstance(activity, Activity):
+        activity = Activity.objects.get(code=activity)
+    counters = windows(user.pk, activity)
+    limited = [window for window in counters if window.limit]
+    stored = counts(limited) if limited else {}
+    return {window.name: max(window.limit - stored[window.name], 0) if window.limit else None
+            for window in counters}
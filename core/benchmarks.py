@@ -0,0 +1,473 @@
+"""Benchmarks run by the runbenchmarks command against the configured database.
+
+A benchmark is a function registered with @benchmark(name). It receives the
+command options and returns a dict of measurements. Metrics named *_s, *_ms
+and *_us are timings and *_per_s throughputs, compare() reports the ones
+worse than in a baseline run saved with runbenchmarks --json.
+"""
+import csv
+import time
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def best_of(func, repeat=5):
+    """Returns (best wall time in seconds, queries of one run) of func()"""
+    best = None
+    with CaptureQueriesContext(connection) as context:
+        for run in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best, len(context.captured_queries) // repeat
+
+
+@benchmark('pagination')
+def pagination(options):
+    """Page 1 against a deep page of the price API, keyset against OFFSET"""
+    from rest_framework.test import APIRequestFactory
+    from core.pagination import KeysetPagination
+    from core.prices import PRICE_SPECS
+    from core.views import PRICE_VIEWSETS
+
+    key = options.get('model') or 'food'
+    model = PRICE_SPECS[key].model
+    size = KeysetPagination.page_size
+    total = model.objects.count()
+    deep_page = min(options.get('page') or 10000, max(1, total // size - 1))
+    view = PRICE_VIEWSETS[key].as_view({'get': 'list'})
+    factory = APIRequestFactory()
+
+    def get(query=''):
+        response = view(factory.get(f'/api/prices/{key}/{query}', HTTP_HOST='localhost'))
+        response.render()
+
+    # the cursor of the deep page is found once with OFFSET, outside the timing
+    cursor = ''
+    last = model.objects.order_by(*KeysetPagination.ordering)[deep_page * size - 1:deep_page * size]
+    if deep_page > 1 and last:
+        cursor = KeysetPagination.encode_cursor(last[0])
+    first_time, first_queries = best_of(get, options.get('repeat', 5))
+    deep_time, deep_queries = best_of(lambda: get(f'?cursor={cursor}'), options.get('repeat', 5))
+    offset_time, _ = best_of(lambda: list(
+        model.objects.order_by(*KeysetPagination.ordering)[deep_page * size:(deep_page + 1) * size]),
+        options.get('repeat', 5))
+    return {
+        'model': key,
+        'rows': total,
+        'deep_page': deep_page,
+        'page_1_ms': first_time * 1000,
+        'page_1_queries': first_queries,
+        'deep_page_ms': deep_time * 1000,
+        'deep_page_queries': deep_queries,
+        'deep_page_offset_ms': offset_time * 1000,
+    }
+
+
+@benchmark('leaderboard')
+def leaderboard_board(options):
+    """Rank, top N and award updates on an in memory board of synthetic users,
+    against a rank() window query over the user table"""
+    import random
+    from core.leaderboard import MemoryBoard
+    from core.models import User
+
+    users = options.get('users') or 1000000
+    operations = 10000
+    rng = random.Random(42)
+    scores = [(user_id, int(rng.paretovariate(1.2) * 10)) for user_id in range(1, users + 1)]
+    start = time.perf_counter()
+    board = MemoryBoard(scores)
+    build_time = time.perf_counter() - start
+    sample = [rng.randrange(1, users + 1) for _ in range(operations)]
+
+    def ranks():
+        for user_id in sample:
+            board.rank(user_id)
+
+    def awards():
+        for user_id in sample:
+            board.add(user_id, 5)
+
+    rank_time, _ = best_of(ranks, options.get('repeat', 5))
+    top_time, _ = best_of(lambda: board.top(100), options.get('repeat', 5))
+    award_time, _ = best_of(awards, 1)
+    user_id = User.objects.values_list('id', flat=True).first()
+    sql_time, _ = best_of(lambda: list(User.objects.raw(
+        f"SELECT id, rank FROM (SELECT id, rank() OVER (ORDER BY points DESC, id) AS rank "
+        f"FROM {User._meta.db_table}) ranked WHERE id = %s", [user_id])), options.get('repeat', 5))
+    return {
+        'users': users,
+        'build_s': build_time,
+        'rank_us': rank_time / operations * 1e6,
+        'top_100_us': top_time * 1e6,
+        'award_us': award_time / operations * 1e6,
+        'db_users': User.objects.count(),
+        'sql_rank_ms': sql_time * 1000,
+    }
+
+
+@benchmark('recent_window')
+def recent_window(options):
+    """Last 30 days of a price model: the table against the original kept as
+    <table>_unpartitioned by partition_prices, when there is one"""
+    from datetime import timedelta
+    from core import partitions
+    from core.prices import PRICE_SPECS
+
+    spec = PRICE_SPECS[options.get('model') or 'food']
+    tables = {'table': spec.table}
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [f'{spec.table}_unpartitioned'])
+        if cursor.fetchone()[0]:
+            tables['unpartitioned'] = f'{spec.table}_unpartitioned'
+        cursor.execute(f"SELECT max(date), count(*) FROM {spec.table}")
+        last, total = cursor.fetchone()
+    if last is None:
+        return {'model': spec.key, 'rows': 0}
+    since = last - timedelta(days=30)
+    result = {'model': spec.key, 'rows': total, 'partitioned': partitions.is_partitioned(spec.table)}
+    for name, table in tables.items():
+        def window():
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT count(*), avg({spec.value_sql()}) FROM {table} "
+                               f"WHERE date > %s", [since])
+                cursor.fetchall()
+
+        def city_window():
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT * FROM {table} WHERE city_id = (SELECT city_id FROM {table} "
+                               f"LIMIT 1) AND date > %s ORDER BY date DESC LIMIT 100", [since])
+                cursor.fetchall()
+
+        result[f'{name}_30_days_ms'] = best_of(window, options.get('repeat', 5))[0] * 1000
+        result[f'{name}_city_30_days_ms'] = best_of(city_window, options.get('repeat', 5))[0] * 1000
+    return result
+
+
+@benchmark('export')
+def export_stream(options):
+    """Rows per second and peak Python memory of a streamed export, against
+    loading the whole export in a list first"""
+    import tracemalloc
+    from core import export
+    from core.prices import PRICE_SPECS
+
+    spec = PRICE_SPECS[options.get('model') or 'food']
+    result = {'model': spec.key}
+    for output, compress in (('csv', False), ('ndjson', False), ('csv', True)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        size = sum(len(chunk) for chunk in export.stream(spec, output, compress=compress))
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        name = f"{output}{'_gz' if compress else ''}"
+        result[f'{name}_s'] = elapsed
+        result[f'{name}_mb'] = size / 2 ** 20
+        result[f'{name}_peak_mb'] = peak / 2 ** 20
+    rows = export.queryset(spec).count()
+    result['rows'] = rows
+    result['csv_rows_per_s'] = rows / result['csv_s'] if result['csv_s'] else 0.0
+    tracemalloc.start()
+    list(export.queryset(spec))
+    result['list_peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result
+
+
+@benchmark('outliers')
+def outlier_scoring(options):
+    """Scoring and folding synthetic submissions one at a time, as the ORM
+    path does, against scoring a whole load per key with numpy"""
+    import numpy as np
+    from core import outliers
+
+    rng = np.random.default_rng(42)
+    keys, per_key = 1000, 100
+    logs = rng.normal(3.0, 0.2, (keys, per_key))
+    logs[rng.random(logs.shape) < 0.01] += np.log(100)
+    stats = [outliers.estimate(0, 0.0, 0.0, rng.normal(3.0, 0.2, 20)) for _ in range(keys)]
+
+    def one_by_one():
+        for key in range(keys):
+            count, median, mad = stats[key]
+            for log in logs[key]:
+                if float(outliers.scores(log, median, mad)) <= outliers.DEFAULT_THRESHOLD:
+                    count, median, mad = outliers.estimate(count, median, mad, [log])
+
+    def batched():
+        for key in range(keys):
+            count, median, mad = stats[key]
+            inliers = outliers.scores(logs[key], median, mad) <= outliers.DEFAULT_THRESHOLD
+            outliers.estimate(count, median, mad, logs[key][inliers])
+
+    row_time, _ = best_of(one_by_one, 1)
+    batch_time, _ = best_of(batched, options.get('repeat', 5))
+    return {
+        'rows': keys * per_key,
+        'row_us': row_time / (keys * per_key) * 1e6,
+        'batch_us': batch_time / (keys * per_key) * 1e6,
+    }
+
+
+@benchmark('auth')
+def authentication(options):
+    """Authentication overhead per API request, DRF's token lookup against
+    the cached one and a JSON web token, and the cost of a failed login. Runs
+    on a temporary user rolled back at the end"""
+    from django.contrib.auth import authenticate
+    from django.core.cache import cache
+    from django.db import transaction
+    from django.test import override_settings
+    from rest_framework.authentication import TokenAuthentication
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIRequestFactory
+    from rest_framework_simplejwt.tokens import AccessToken
+    from core.authentication import JWT, CachedTokenAuthentication, JWTAuthentication, cache_key
+    from core.models import User
+    from core.serializers import CustomTokenCreateSerializer
+
+    requests = 1000
+    result = {}
+    with transaction.atomic():
+        user = User.objects.create_user(email='benchmark-auth@example.com', password='password1',
+                                        username='benchmark-auth', is_active=True)
+        token = Token.objects.create(user=user)
+        factory = APIRequestFactory()
+        requests_of = {
+            'token_db': (TokenAuthentication(), factory.get('/', HTTP_AUTHORIZATION=f'Token {token.key}')),
+            'token_cached': (CachedTokenAuthentication(),
+                             factory.get('/', HTTP_AUTHORIZATION=f'Token {token.key}')),
+            'jwt': (JWTAuthentication(),
+                    factory.get('/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')),
+        }
+        for name, (authenticator, request) in requests_of.items():
+            with override_settings(AUTH_MODE=JWT):
+                authenticator.authenticate(request)
+            with override_settings(AUTH_MODE=JWT):
+                elapsed, queries = best_of(
+                    lambda: [authenticator.authenticate(request) for _ in range(requests)],
+                    options.get('repeat', 5))
+            result[f'{name}_us'] = elapsed / requests * 1e6
+            result[f'{name}_queries'] = queries / requests
+        # the rollback does not send the signals dropping the entry
+        cache.delete(cache_key(token.key))
+
+        def login():
+            serializer = CustomTokenCreateSerializer(data={'email': user.email, 'password': 'wrong'})
+            serializer.is_valid()
+
+        def two_pass_login():
+            # the former path: authenticate(), then the user and its hash again
+            if authenticate(email=user.email, password='wrong') is None:
+                User.objects.filter(email=user.email).first().check_password('wrong')
+
+        result['failed_login_ms'], result['failed_login_queries'] = best_of(login, options.get('repeat', 5))
+        result['failed_login_ms'] *= 1000
+        result['two_pass_login_ms'], result['two_pass_login_queries'] = best_of(
+            two_pass_login, options.get('repeat', 5))
+        result['two_pass_login_ms'] *= 1000
+        transaction.set_rollback(True)
+    return result
+
+
+@benchmark('querystats')
+def query_stats(options):
+    """Cost of recording a query with the QueryStatsMiddleware execute
+    wrapper, and of deciding not to sample a request"""
+    from core import querystats
+    from core.models import Country
+
+    queries = 1000
+
+    def run():
+        for _ in range(queries):
+            Country.objects.filter(pk=1).exists()
+
+    def recorded():
+        with connection.execute_wrapper(querystats.QueryRecorder()):
+            run()
+
+    plain_time, _ = best_of(run, options.get('repeat', 5))
+    recorded_time, _ = best_of(recorded, options.get('repeat', 5))
+    start = time.perf_counter()
+    for _ in range(100000):
+        querystats.sampled()
+    return {
+        'query_us': plain_time / queries * 1e6,
+        'recorded_query_us': recorded_time / queries * 1e6,
+        'overhead_us': (recorded_time - plain_time) / queries * 1e6,
+        'sampling_decision_us': (time.perf_counter() - start) / 100000 * 1e6,
+    }
+
+
+@benchmark('ingest')
+def ingest(options):
+    """Rows per second of a synthetic load: COPY straight into the table,
+    and a csv file through PriceCopyLoader. Rolled back at the end"""
+    import os
+    import tempfile
+    from django.db import transaction
+    from core import synthetic
+    from core.pgcopy import PriceCopyLoader
+    from core.prices import PRICE_SPECS
+
+    spec = PRICE_SPECS[options.get('model') or 'food']
+    rows = options.get('rows') or 100000
+    result = {'model': spec.key, 'rows': rows}
+    with transaction.atomic():
+        reference = synthetic.create_reference()
+        inserted = synthetic.insert_rows(spec, reference, rows)
+        result['copy_rows_per_s'] = rows / inserted['seconds']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, f'{spec.key}.csv')
+            start = time.perf_counter()
+            synthetic.write_csv(spec, reference, path, rows, seed=43)
+            result['write_csv_s'] = time.perf_counter() - start
+            loader = PriceCopyLoader(spec)
+            with open(path, newline='', encoding='utf-8') as file:
+                loader.load(csv.reader(file))
+        result['loader_rows_per_s'] = loader.rows_per_sec
+        result['loader_rejected'] = len(loader.errors)
+        transaction.set_rollback(True)
+    return result
+
+
+@benchmark('reads')
+def reads(options):
+    """The key read paths of the API on the busiest city and item of a
+    price model: a page of prices of the city, the history of the item and
+    the monthly aggregates of its country"""
+    from rest_framework.test import APIRequestFactory
+    from core.models import Country
+    from core.prices import PRICE_SPECS
+    from core.views import AGGREGATE_VIEWSETS, PRICE_VIEWSETS
+
+    spec = PRICE_SPECS[options.get('model') or 'food']
+    item = spec.item_sql('p')
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT p.city_id, {item}, c.iso_code, count(*) FROM {spec.table} p "
+                       f"JOIN {Country._meta.db_table} c ON c.id = p.country_id "
+                       f"GROUP BY 1, 2, 3 ORDER BY 4 DESC LIMIT 1")
+        busiest = cursor.fetchone()
+    if busiest is None:
+        return {'model': spec.key, 'rows': 0}
+    city, item_id, country, _ = busiest
+    prices = PRICE_VIEWSETS[spec.key].as_view({'get': 'list'})
+    months = AGGREGATE_VIEWSETS[spec.key].as_view({'get': 'list'})
+    summary = AGGREGATE_VIEWSETS[spec.key].as_view({'get': 'summary'})
+    factory = APIRequestFactory()
+    paths = {
+        'city_page': (prices, f'/api/prices/{spec.key}/?city={city}'),
+        'city_month': (prices, f'/api/prices/{spec.key}/?city={city}&date_from=2022-01-01&date_to=2022-01-31'),
+        'country_months': (months, f'/api/analytics/{spec.key}/?country={country}'),
+        'country_summary': (summary, f'/api/analytics/{spec.key}/summary/?country={country}'),
+    }
+    if spec.item_field:
+        paths['item_history'] = (prices, f'/api/prices/{spec.key}/?item={item_id}&city={city}')
+    result = {'model': spec.key, 'rows': spec.model.objects.count()}
+    for name, (view, path) in paths.items():
+        def get():
+            view(factory.get(path, HTTP_HOST='localhost')).render()
+
+        elapsed, queries = best_of(get, options.get('repeat', 5))
+        result[f'{name}_ms'] = elapsed * 1000
+        result[f'{name}_queries'] = queries
+    return result
+
+
+@benchmark('aggregates')
+def aggregate_refresh(options):
+    """Rebuilding every aggregate of a price model, and refreshing the
+    buckets a load of 1000 rows touches. Rolled back at the end"""
+    from django.db import transaction
+    from core import aggregates
+    from core.prices import PRICE_SPECS
+
+    spec = PRICE_SPECS[options.get('model') or 'food']
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT p.city_id, {spec.item_sql('p')}, date_trunc('month', p.date)::date "
+                       f"FROM {spec.table} p ORDER BY p.id DESC LIMIT 1000")
+        buckets = cursor.fetchall()
+    result = {'model': spec.key, 'rows': spec.model.objects.count(), 'buckets': len(set(buckets))}
+    with transaction.atomic():
+        start = time.perf_counter()
+        result['total_buckets'] = aggregates.rebuild(spec)
+        result['rebuild_s'] = time.perf_counter() - start
+        elapsed, _ = best_of(lambda: aggregates.refresh(spec, buckets), options.get('repeat', 5))
+        result['refresh_ms'] = elapsed * 1000
+        transaction.set_rollback(True)
+    return result
+
+
+def lower_is_better(metric):
+    """Whether a smaller value of a metric is an improvement, None for the
+    metrics that are not timings or throughputs"""
+    if metric.endswith('_per_s'):
+        return False
+    if metric.endswith(('_s', '_ms', '_us')):
+        return True
+    return None
+
+
+def compare(results, baseline, tolerance=0.2):
+    """[(benchmark, metric, baseline value, value)] of the timings of results
+    more than tolerance worse than in baseline, both {benchmark: {metric: value}}"""
+    regressions = []
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            before = baseline.get(name, {}).get(metric)
+            lower = lower_is_better(metric)
+            if lower is None or not isinstance(before, (int, float)) or not before:
+                continue
+            if value > before * (1 + tolerance) if lower else value < before * (1 - tolerance):
+                regressions.append((name, metric, before, value))
+    return regressions
+
+
+@benchmark('rollups')
+def rollups(options):
+    """Food of the busiest area in its busiest state, from the aggregates
+    and from the raw rows: joins through the catalogs against the prefixes
+    of the core.hierarchy paths"""
+    from django.db.models import Avg, Count, Sum
+    from core import hierarchy
+    from core.models import Area, Food, FoodPrice, PriceAggregate, State
+    from core.prices import PRICE_SPECS
+
+    spec = PRICE_SPECS['food']
+    busiest = (FoodPrice.objects.values('state_id', 'food__category__area_id')
+               .annotate(rows=Count('id')).order_by('-rows').first())
+    if busiest is None:
+        return {'rows': 0}
+    state = State.objects.get(pk=busiest['state_id'])
+    area = Area.objects.get(pk=busiest['food__category__area_id'])
+    geography, items = hierarchy.state_prefix(state), hierarchy.area_prefix(area)
+    aggregates = PriceAggregate.objects.filter(price_model=spec.key)
+    queries = {
+        'aggregates_joins': lambda: aggregates.filter(
+            city__state=state, item_id__in=Food.objects.filter(category__area=area).values('id')).aggregate(
+            Sum('count'), Sum('total')),
+        'aggregates_paths': lambda: hierarchy.rollup(spec, geography, items),
+        'rows_joins': lambda: FoodPrice.objects.filter(
+            city__state=state, food__category__area=area).aggregate(Count('id'), Avg('price')),
+        'rows_paths': lambda: FoodPrice.objects.filter(
+            state=state, item_path__startswith=items).aggregate(Count('id'), Avg('price')),
+    }
+    result = {'rows': FoodPrice.objects.count(), 'state': state.iso_code, 'area': area.code}
+    for name, query in queries.items():
+        elapsed, _ = best_of(query, options.get('repeat', 5))
+        result[f'{name}_ms'] = elapsed * 1000
+    return result
@@ -0,0 +1,179 @@
+"""Cost of living index of every city.
+
+For each price model (category) the monthly aggregates of the last months
+are pulled into a city x item matrix of mean comparable prices. The index of
+a city in a category is the geometric mean of its price relatives to the
+median city, item by item (a Jevons index), so 100 is the median city and
+cities are compared on the items they have in common. The overall index is
+the weighted mean of the category indexes with COST_OF_LIVING_WEIGHTS.
+
+Cities of different countries are only comparable in one currency, so every
+monthly total is converted to COST_OF_LIVING_CURRENCY with the rate of the
+first day of its month (core.currency) before the matrix is built. Prices
+without a currency column are in the local currency of their country
+(Country.currency). Models with a currency column are summed per currency
+from the raw rows, their aggregates mix currencies. Totals without a
+currency or a rate are left out and counted in the summary. Comparable
+prices are already per kg, liter, m3 or km, converted with core.units when
+the rows are loaded.
+
+Run nightly with the compute_cost_of_living command.
+"""
+import time
+from datetime import date
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core import currency
+from core.models import CostOfLivingIndex, PriceAggregate
+from core.outliers import quarantined_sql
+from core.prices import PRICE_SPECS
+
+DEFAULT_WEIGHTS = {
+    'food': 0.30,
+    'housing': 0.30,
+    'transport': 0.08,
+    'gasoline': 0.05,
+    'electricity': 0.05,
+    'water': 0.03,
+    'gas': 0.03,
+    'internet': 0.04,
+    'medicine': 0.12,
+}
+
+
+def category_weights():
+    return getattr(settings, 'COST_OF_LIVING_WEIGHTS', DEFAULT_WEIGHTS)
+
+
+def reporting_currency():
+    return getattr(settings, 'COST_OF_LIVING_CURRENCY', 'USD')
+
+
+def months_ago(today, months):
+    """First day of the month months before today's month"""
+    month = today.year * 12 + today.month - 1 - months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def has_currency(spec):
+    return any(field.name == 'currency' for field in spec.model._meta.concrete_fields)
+
+
+def monthly_totals(spec, since):
+    """(city_id, country_id, item_id, currency_id, month, total, count) rows
+    since the given month, currency_id None when unknown"""
+    if not has_currency(spec):
+        return list(PriceAggregate.objects.filter(price_model=spec.key, month__gte=since, count__gt=0)
+                    .values_list('city_id', 'country_id', 'item_id', 'country__currency_id', 'month',
+                                 'total', 'count'))
+    value = spec.value_sql('p')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT p.city_id, p.country_id, {spec.item_sql('p')}, p.currency_id, "
+            f"date_trunc('month', p.date)::date, sum({value}), count({value}) "
+            f"FROM {spec.table} p WHERE p.date >= %s AND {value} IS NOT NULL AND NOT p.is_duplicate "
+            f"AND NOT {quarantined_sql(spec)} GROUP BY 1, 2, 3, 4, 5", [since, spec.key])
+        return cursor.fetchall()
+
+
+def price_matrix(spec, since, to_currency=None):
+    """Returns (city_ids, country_ids, prices, skipped): prices[c, i] is the
+    mean comparable price in to_currency (reporting_currency() by default) of
+    item i in city c since the given month, NaN when the city has no
+    observations of the item. skipped counts the prices left out for want
+    of a currency or rate"""
+    rows = monthly_totals(spec, since)
+    if rows:
+        city_ids, country_ids, item_ids, currencies, months, totals, counts = zip(*rows)
+        converted = currency.convert(
+            [float(total) for total in totals], [-1 if pk is None else pk for pk in currencies],
+            months, to_currency or reporting_currency())
+    else:
+        city_ids = country_ids = item_ids = counts = ()
+        converted = np.zeros(0)
+    counts = np.array(counts, dtype=np.float64)
+    known = np.isfinite(converted)
+    skipped = int(counts[~known].sum())
+    city_column = np.array(city_ids, dtype=np.int64)[known]
+    country_column = np.array(country_ids, dtype=np.int64)[known]
+    city_ids, city_index = np.unique(city_column, return_inverse=True)
+    item_ids, item_index = np.unique(np.array(item_ids, dtype=np.int64)[known], return_inverse=True)
+    totals = np.zeros((len(city_ids), len(item_ids)))
+    counted = np.zeros((len(city_ids), len(item_ids)))
+    np.add.at(totals, (city_index, item_index), converted[known])
+    np.add.at(counted, (city_index, item_index), counts[known])
+    country_ids = np.zeros(len(city_ids), dtype=np.int64)
+    country_ids[city_index] = country_column
+    with np.errstate(invalid='ignore', divide='ignore'):
+        prices = totals / counted
+    return city_ids, country_ids, prices, skipped
+
+
+def basket_index(prices, min_items=1):
+    """Returns (index, items) per row of a city x item price matrix"""
+    if prices.size == 0:
+        return np.full(prices.shape[0], np.nan), np.zeros(prices.shape[0], dtype=np.int64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        reference = np.nanmedian(prices, axis=0)
+        relatives = prices / reference
+    valid = np.isfinite(relatives) & (relatives > 0)
+    logs = np.log(np.where(valid, relatives, 1.0))
+    items = valid.sum(axis=1)
+    index = 100 * np.exp(logs.sum(axis=1) / np.maximum(items, 1))
+    index[items < min_items] = np.nan
+    return index, items
+
+
+def compute(months=12, min_items=1, today=None, to_currency=None):
+    """Computes and stores the index of every city, comparing prices in
+    to_currency (reporting_currency() by default). Returns a summary dict"""
+    start = time.perf_counter()
+    since = months_ago(today or date.today(), months)
+    weights = category_weights()
+    to_currency = to_currency or reporting_currency()
+    currency_id = currency.index().currency_id(to_currency)
+    computed_at = timezone.now()
+    categories = {}
+    countries = {}
+    skipped = 0
+    for spec in PRICE_SPECS.values():
+        city_ids, country_ids, prices, unconverted = price_matrix(spec, since, currency_id)
+        skipped += unconverted
+        index, items = basket_index(prices, min_items)
+        categories[spec.key] = (city_ids, index, items)
+        countries.update(zip(city_ids.tolist(), country_ids.tolist()))
+
+    # overall index: city x category matrix, weights renormalised per city
+    all_cities = np.array(sorted(countries), dtype=np.int64)
+    keys = [key for key in categories if weights.get(key)]
+    matrix = np.full((len(all_cities), len(keys)), np.nan)
+    for column, key in enumerate(keys):
+        city_ids, index, _ = categories[key]
+        matrix[np.searchsorted(all_cities, city_ids), column] = index
+    weight = np.array([weights[key] for key in keys])
+    available = np.isfinite(matrix)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        overall = (np.where(available, matrix, 0) @ weight) / (available @ weight)
+    categories['all'] = (all_cities, overall, available.sum(axis=1))
+
+    rows = [
+        CostOfLivingIndex(city_id=city_id, country_id=countries[city_id], category=category,
+                          currency_id=currency_id, index=value, items=count, computed_at=computed_at)
+        for category, (city_ids, index, items) in categories.items()
+        for city_id, value, count in zip(city_ids.tolist(), index.tolist(), items.tolist())
+        if np.isfinite(value)]
+    with transaction.atomic():
+        CostOfLivingIndex.objects.bulk_create(rows, batch_size=5000)
+    return {'cities': len(all_cities), 'rows': len(rows), 'skipped': skipped,
+            'computed_at': computed_at, 'seconds': time.perf_counter() - start}
+
+
+def latest():
+    """Queryset of the rows of the last computation"""
+    last = CostOfLivingIndex.objects.order_by('-computed_at').values_list(
+        'computed_at', flat=True).first()
+    return CostOfLivingIndex.objects.filter(computed_at=last)
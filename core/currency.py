@@ -0,0 +1,169 @@
+"""Currency conversion without a range query per price.
+
+CurrencyConv rows (1 currency_from = rate currency_to between date_from and
+date_to) are loaded once per process into one interval index per currency
+pair: sorted arrays of start days, end days and rates. Overlapping rows,
+e.g. a yearly rate and a monthly override, are split into disjoint
+intervals where the narrowest row wins. A rate lookup is a binary search, a batch of prices is converted with one searchsorted per
+currency. Every pair is also indexed in the inverse direction with 1 / rate.
+The index is rebuilt after Currency or CurrencyConv changes, in this process
+or another one: the change bumps the core.refdata version and every process
+drops its index with its reference tables.
+
+    currency.convert(prices, currency_ids, dates, 'USD')
+    currency.convert_queryset(gasolinePrice.objects.all(), 'price_per_liter', 'USD')
+
+Currencies are given by id, iso_code or Currency instance.
+"""
+import heapq
+
+import numpy as np
+
+from core import refdata
+from core.models import Currency, CurrencyConv
+
+
+class CurrencyConversionError(ValueError):
+    """The currency is unknown or there is no rate for the date"""
+
+
+def _days(dates):
+    """Dates as int64 days since the epoch"""
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+def _disjoint(intervals):
+    """Splits (start day, end day, rate) intervals into disjoint ones. Where
+    intervals overlap the narrowest wins, then the one starting last"""
+    intervals = sorted(interval for interval in intervals if interval[0] <= interval[1])
+    bounds = sorted({start for start, _, _ in intervals} | {end + 1 for _, end, _ in intervals})
+    covering, segments, added = [], [], 0
+    for low, high in zip(bounds, bounds[1:]):
+        while added < len(intervals) and intervals[added][0] <= low:
+            start, end, rate = intervals[added]
+            heapq.heappush(covering, (end - start, -start, added, end, rate))
+            added += 1
+        while covering and covering[0][3] < low:
+            heapq.heappop(covering)
+        if not covering:
+            continue
+        _, _, winner, _, rate = covering[0]
+        if segments and segments[-1][3] == winner and segments[-1][1] == low - 1:
+            segments[-1][1] = high - 1
+        else:
+            segments.append([low, high - 1, rate, winner])
+    return [(start, end, rate) for start, end, rate, _ in segments]
+
+
+class RateIndex:
+    """Interval index of the conversion rates of every currency pair"""
+
+    def __init__(self, currencies, conversions):
+        """currencies: (id, iso_code) rows
+        conversions: (currency_from_id, currency_to_id, date_from, date_to, rate) rows"""
+        self.iso_codes = dict((iso_code, pk) for pk, iso_code in currencies)
+        pairs = {}
+        for source, target, start, end, rate in conversions:
+            if not rate:
+                continue
+            pairs.setdefault((source, target), []).append((start, end, rate))
+            pairs.setdefault((target, source), []).append((start, end, 1.0 / rate))
+        self.pairs = {}
+        for pair, intervals in pairs.items():
+            starts, ends, rates = zip(*intervals)
+            intervals = _disjoint(zip(_days(starts).tolist(), _days(ends).tolist(), rates))
+            if not intervals:
+                continue
+            starts, ends, rates = zip(*intervals)
+            self.pairs[pair] = (np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64),
+                                np.array(rates, dtype=np.float64))
+
+    @classmethod
+    def load(cls):
+        return cls(list(Currency.objects.values_list('id', 'iso_code')),
+                   list(CurrencyConv.objects.values_list(
+                       'currency_from_id', 'currency_to_id', 'date_from', 'date_to', 'rate')))
+
+    def currency_id(self, currency):
+        if isinstance(currency, Currency):
+            return currency.pk
+        if isinstance(currency, str):
+            if currency not in self.iso_codes:
+                raise CurrencyConversionError(f'unknown currency {currency}')
+            return self.iso_codes[currency]
+        return currency
+
+    def rates(self, from_currency, to_currency, dates):
+        """Rates of a pair on each date, NaN where no interval covers the date"""
+        days = _days(dates)
+        source, target = self.currency_id(from_currency), self.currency_id(to_currency)
+        if source == target:
+            return np.ones(days.shape)
+        if (source, target) not in self.pairs:
+            return np.full(days.shape, np.nan)
+        starts, ends, rates = self.pairs[(source, target)]
+        # the interval starting last on or before each day
+        position = np.searchsorted(starts, days, side='right') - 1
+        clipped = np.maximum(position, 0)
+        covered = (position >= 0) & (days <= ends[clipped])
+        return np.where(covered, rates[clipped], np.nan)
+
+    def rate(self, from_currency, to_currency, day):
+        rate = self.rates(from_currency, to_currency, [day])[0]
+        if np.isnan(rate):
+            raise CurrencyConversionError(f'no rate from {from_currency} to {to_currency} on {day}')
+        return float(rate)
+
+    def convert(self, amounts, currencies, dates, to_currency):
+        """Converts amounts[k], in currencies[k] (ids) on dates[k], to to_currency.
+        Returns a float array, NaN where there is no rate"""
+        amounts = np.asarray(amounts, dtype=np.float64)
+        currencies = np.asarray(currencies, dtype=np.int64)
+        days = _days(dates)
+        result = np.full(amounts.shape, np.nan)
+        for currency in np.unique(currencies):
+            rows = currencies == currency
+            result[rows] = amounts[rows] * self.rates(int(currency), to_currency, days[rows])
+        return result
+
+
+_index = None
+
+
+def index():
+    """Returns the process wide RateIndex, loading it on first use"""
+    global _index
+    if _index is None:
+        _index = RateIndex.load()
+    return _index
+
+
+@refdata.on_change
+def _drop():
+    global _index
+    _index = None
+
+
+def invalidate(**kwargs):
+    """Drops the cached index here and, once the transaction commits, in the
+    other processes. Connected to Currency and CurrencyConv changes"""
+    refdata.invalidate()
+
+
+def rate(from_currency, to_currency, day):
+    return index().rate(from_currency, to_currency, day)
+
+
+def convert(amounts, currencies, dates, to_currency):
+    return index().convert(amounts, currencies, dates, to_currency)
+
+
+def convert_queryset(queryset, value_field, to_currency):
+    """Values of value_field of a price queryset (with currency and date
+    columns) in to_currency, in the queryset order"""
+    rows = list(queryset.values_list(value_field, 'currency_id', 'date'))
+    if not rows:
+        return np.zeros(0)
+    amounts, currencies, dates = zip(*rows)
+    return convert([np.nan if amount is None else amount for amount in amounts],
+                   currencies, dates, to_currency)
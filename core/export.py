@@ -0,0 +1,94 @@
+"""Streaming export of price rows in CSV or NDJSON.
+
+Rows are read as tuples from a server side cursor (QuerySet.iterator over
+values_list), formatted in chunks and optionally gzipped on the fly, so the
+memory used does not depend on the size of the export. The columns are the
+ones of the price API: catalog foreign keys by code, the others by id.
+Duplicate submissions are left out.
+
+    for chunk in export.stream(spec, 'csv', compress=True, country='MX'):
+        file.write(chunk)
+"""
+import csv
+import io
+import json
+import zlib
+
+from core.prices import CODE_FIELDS
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+EXCLUDED_FIELDS = ('created_by', 'updated_by', 'fingerprint', 'item_path')
+
+
+def columns(spec):
+    """[(column name, values_list lookup)] of a price model"""
+    result = []
+    for field in spec.model._meta.concrete_fields:
+        if field.name in EXCLUDED_FIELDS:
+            continue
+        if field.is_relation and field.related_model in CODE_FIELDS:
+            result.append((field.name, f'{field.name}__{CODE_FIELDS[field.related_model]}'))
+        else:
+            result.append((field.name, field.attname))
+    return result
+
+
+def queryset(spec, country=None, date_from=None, date_to=None):
+    """Price rows of a country (iso_code) between two dates, as tuples"""
+    filters = {'is_duplicate': False}
+    if country:
+        filters['country__iso_code'] = country
+    if date_from:
+        filters['date__gte'] = date_from
+    if date_to:
+        filters['date__lte'] = date_to
+    lookups = [lookup for _, lookup in columns(spec)]
+    return spec.model.objects.filter(**filters).order_by('date', 'id').values_list(*lookups)
+
+
+def csv_chunks(names, rows, rows_per_chunk):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(names, rows, rows_per_chunk):
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(names, row)), default=str))
+        if len(lines) == rows_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def gzipped(chunks):
+    """Compresses a stream of text chunks into a gzip stream"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream(spec, output='csv', compress=False, chunk_size=2000, **filters):
+    """Chunks of the export of a price model: text, or bytes when compressed.
+    chunk_size rows are fetched per round trip and formatted per chunk"""
+    if output not in FORMATS:
+        raise ValueError(f"unknown format {output}, use one of {', '.join(FORMATS)}")
+    names = [name for name, _ in columns(spec)]
+    rows = queryset(spec, **filters).iterator(chunk_size=chunk_size)
+    chunks = (csv_chunks if output == 'csv' else ndjson_chunks)(names, rows, chunk_size)
+    return gzipped(chunks) if compress else chunks
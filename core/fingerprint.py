@@ -0,0 +1,127 @@
+"""Content fingerprints of price rows, to detect duplicate submissions.
+
+The fingerprint of a row is the md5 of its normalized content: every field
+but the id and the audit fields, floats rounded to 4 decimals, text trimmed
+and lowercased, foreign keys by id. The same receipt submitted twice, by one
+user retrying or by two users, gets the same fingerprint whoever sent it.
+
+Price tables have a unique index on (fingerprint, date) for the fingerprinted
+rows that are not duplicates, so checking a new row is one index lookup and bulk
+inserts skip duplicates with ON CONFLICT DO NOTHING. A duplicate saved
+through the ORM is kept with is_duplicate set, and is left out of the
+aggregates and outlier statistics. compute() in python and sql() in SQL
+produce the same value, backfill() fingerprints and flags stored rows.
+"""
+import hashlib
+import math
+from decimal import ROUND_HALF_UP, Context, Decimal
+
+from django.db import connection, models
+
+from core import hierarchy
+from core.prices import AUDIT_FIELDS
+
+FIELDS = ('fingerprint', 'is_duplicate')
+SEPARATOR = '|'
+DECIMALS = Decimal('0.0001')
+# digits of the largest float with 4 decimals, quantize() fails beyond the precision
+CONTEXT = Context(prec=320)
+# as PostgreSQL prints the non finite numerics
+NON_FINITE = {math.inf: 'Infinity', -math.inf: '-Infinity'}
+
+
+def fields(spec):
+    """The fields a fingerprint is made of, in order"""
+    return [field for field in spec.model._meta.concrete_fields
+            if not field.primary_key and field.name not in AUDIT_FIELDS and field.name not in FIELDS
+            and field.name not in hierarchy.FIELDS]
+
+
+def _normalize(field, value):
+    if value is None:
+        return ''
+    if isinstance(field, (models.FloatField, models.DecimalField)):
+        value = float(value)
+        if not math.isfinite(value):
+            return NON_FINITE.get(value, 'NaN')
+        # + 0 turns -0.0000 into 0.0000, as in SQL
+        return str(CONTEXT.add(Decimal(repr(value)).quantize(DECIMALS, ROUND_HALF_UP, CONTEXT), 0))
+    if isinstance(field, models.BooleanField):
+        return '1' if value else '0'
+    if isinstance(field, models.DateField):
+        return value.isoformat()
+    if isinstance(field, models.CharField):
+        return value.strip().lower()
+    return str(value)
+
+
+def compute(spec, obj):
+    """Fingerprint of a price row instance"""
+    content = SEPARATOR.join(_normalize(field, getattr(obj, field.attname)) for field in fields(spec))
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def _normalize_sql(field, column):
+    if isinstance(field, (models.FloatField, models.DecimalField)):
+        # through the shortest text of the float, as repr() in python: the
+        # float8 to numeric cast keeps 15 digits and would round twice
+        return f"round({column}::float8::text::numeric, 4)::text"
+    if isinstance(field, models.BooleanField):
+        return f"CASE WHEN {column} THEN '1' ELSE '0' END"
+    if isinstance(field, models.DateField):
+        return f"to_char({column}, 'YYYY-MM-DD')"
+    if isinstance(field, models.CharField):
+        return f"lower(btrim({column}))"
+    return f"{column}::text"
+
+
+def sql(spec, alias='p'):
+    """SQL expression of the fingerprint of the rows of alias, a relation with
+    the columns of the price table"""
+    quote = connection.ops.quote_name
+    parts = [f"coalesce({_normalize_sql(field, f'{alias}.{quote(field.column)}')}, '')"
+             for field in fields(spec)]
+    return f"md5(concat_ws('{SEPARATOR}', {', '.join(parts)}))"
+
+
+def original(spec, obj):
+    """Id of the row obj duplicates, or None. One lookup of the unique index"""
+    rows = spec.model.objects.filter(fingerprint=obj.fingerprint, date=obj.date, is_duplicate=False)
+    if obj.pk is not None:
+        rows = rows.exclude(pk=obj.pk)
+    return rows.values_list('pk', flat=True).first()
+
+
+def mark(spec, obj):
+    """Sets the fingerprint of a row about to be saved, and is_duplicate when
+    another row has the same content"""
+    obj.fingerprint = compute(spec, obj)
+    obj.is_duplicate = original(spec, obj) is not None
+
+
+def backfill(spec, batch_size=50000):
+    """Fingerprints the rows without one, batch_size ids at a time, and flags
+    as duplicates the rows whose content is already in an older row.
+    Returns (rows fingerprinted, duplicates in the table)"""
+    table = connection.ops.quote_name(spec.table)
+    hashed = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT min(id), max(id) FROM {table} WHERE fingerprint IS NULL")
+        low, high = cursor.fetchone()
+        if low is not None:
+            for start in range(low, high + 1, batch_size):
+                # rows fingerprinted before, e.g. saved since the migration, stay the originals
+                cursor.execute(
+                    f"WITH hashed AS (SELECT p.id, p.date, {sql(spec)} AS fingerprint FROM {table} p "
+                    f"WHERE p.fingerprint IS NULL AND p.id >= %s AND p.id < %s), "
+                    f"ranked AS (SELECT h.*, row_number() OVER (PARTITION BY h.fingerprint, h.date "
+                    f"ORDER BY h.id) > 1 OR EXISTS (SELECT 1 FROM {table} o WHERE "
+                    f"o.fingerprint = h.fingerprint AND o.date = h.date AND NOT o.is_duplicate) "
+                    f"AS duplicate FROM hashed h) "
+                    f"UPDATE {table} p SET fingerprint = r.fingerprint, is_duplicate = r.duplicate, "
+                    f"updated_on = CASE WHEN r.duplicate THEN now() ELSE p.updated_on END "
+                    f"FROM ranked r WHERE p.id = r.id AND p.date = r.date",
+                    [start, start + batch_size])
+                hashed += cursor.rowcount
+        cursor.execute(f"SELECT count(*) FROM {table} WHERE is_duplicate")
+        return hashed, cursor.fetchone()[0]
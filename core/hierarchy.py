@@ -0,0 +1,197 @@
+"""Materialized paths of the geography and catalog trees, for rollups.
+
+Every node stores the ids of its ancestors and its own id as a path:
+
+    City.path      '<country id>/<state id>/<city id>/'
+    Category.path  '<area id>/<category id>/'
+    Food.path      '<area id>/<category id>/<food id>/'
+
+FoodPrice.item_path copies the path of its food, and PriceAggregate stores
+the path of its city and item. "All food of area 3 in state 12 of country
+1" is then a prefix match on two indexed columns instead of joins through
+Food, Category, City and State:
+
+    PriceAggregate.objects.filter(price_model='food', city_path__startswith='1/12/',
+                                  item_path__startswith='3/')
+
+The indexes use varchar_pattern_ops, so a prefix is an index range scan
+whatever the collation. The trailing separator keeps '1/' from matching
+'12/'.
+
+Paths follow the ORM writes (core.signals): saving a category, food or
+city whose parent changed rewrites its path and, for a category or food,
+the item paths of its foods' prices and aggregates. The price writers copy
+the path of the food when inserting, see mark(), mark_many(),
+item_path_sql() and copy_food_paths(). Rows loaded or catalogs edited
+another way are fixed by rebuild(), see the rebuild_hierarchy command.
+"""
+from django.db import connection
+from django.db.models import Max, Min, Sum
+
+from core import models
+
+FIELDS = ('item_path',)
+SEPARATOR = '/'
+# price models whose items belong to the area/category tree: model of the item
+ITEM_MODELS = {'food': models.Food}
+
+AGGREGATE_TABLE = models.PriceAggregate._meta.db_table
+CITY_TABLE = models.City._meta.db_table
+CATEGORY_TABLE = models.Category._meta.db_table
+FOOD_TABLE = models.Food._meta.db_table
+FOOD_PRICE_TABLE = models.FoodPrice._meta.db_table
+
+
+def path(*ids):
+    """The path of a node given the ids from the root down, path(1, 12) == '1/12/'"""
+    return ''.join(f'{pk}{SEPARATOR}' for pk in ids)
+
+
+def _path_sql(*columns):
+    return ' || '.join(f"{column}::text || '{SEPARATOR}'" for column in columns)
+
+
+def city_path(city):
+    return path(city.country_id, city.state_id, city.pk)
+
+
+def category_path(category):
+    return path(category.area_id, category.pk)
+
+
+def country_prefix(country):
+    return path(country.pk)
+
+
+def state_prefix(state):
+    return path(state.country_id, state.pk)
+
+
+def area_prefix(area):
+    return path(area.pk)
+
+
+def has_item_path(spec):
+    return spec.key in ITEM_MODELS
+
+
+def item_path_sql(spec, alias='p'):
+    """SQL expression of the item path of the rows of alias, a relation with
+    the columns of the price table, '' for models without item paths"""
+    if not has_item_path(spec):
+        return "''"
+    table = ITEM_MODELS[spec.key]._meta.db_table
+    column = connection.ops.quote_name(spec.item_column)
+    return f"coalesce((SELECT i.path FROM {table} i WHERE i.id = {alias}.{column}), '')"
+
+
+def mark(spec, obj):
+    """Sets the item path of a price row about to be saved"""
+    if has_item_path(spec):
+        item_id = getattr(obj, spec.item_column)
+        obj.item_path = ITEM_MODELS[spec.key].objects.filter(pk=item_id).values_list(
+            'path', flat=True).first() or ''
+
+
+def mark_many(spec, objs):
+    """mark() for rows about to be bulk inserted, one query"""
+    if not has_item_path(spec):
+        return
+    paths = dict(ITEM_MODELS[spec.key].objects.filter(
+        pk__in={getattr(obj, spec.item_column) for obj in objs}).values_list('pk', 'path'))
+    for obj in objs:
+        obj.item_path = paths.get(getattr(obj, spec.item_column), '')
+
+
+def copy_food_paths(where='true', params=()):
+    """Copies the paths of the foods matching where, on the alias f, to their
+    price rows and aggregates. Returns the number of price rows changed"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {FOOD_PRICE_TABLE} p SET item_path = f.path FROM {FOOD_TABLE} f "
+            f"WHERE p.food_id = f.id AND p.item_path <> f.path AND {where}", params)
+        changed = cursor.rowcount
+        cursor.execute(
+            f"UPDATE {AGGREGATE_TABLE} a SET item_path = f.path FROM {FOOD_TABLE} f "
+            f"WHERE a.price_model = 'food' AND a.item_id = f.id AND a.item_path <> f.path AND {where}",
+            params)
+    return changed
+
+
+def category_saved(sender, instance, raw=False, **kwargs):
+    """Rewrites the paths below a category saved with a new path"""
+    new = category_path(instance)
+    if raw or instance.path == new:
+        return
+    models.Category.objects.filter(pk=instance.pk).update(path=new)
+    instance.path = new
+    with connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {FOOD_TABLE} SET path = %s || {_path_sql('id')} WHERE category_id = %s",
+                       [new, instance.pk])
+    copy_food_paths('f.category_id = %s', [instance.pk])
+
+
+def food_saved(sender, instance, raw=False, **kwargs):
+    """Sets the path of a food and copies it to its prices when it changed"""
+    if raw:
+        return
+    area_id = models.Category.objects.filter(pk=instance.category_id).values_list('area_id', flat=True).first()
+    new = path(area_id, instance.category_id, instance.pk)
+    if instance.path == new:
+        return
+    models.Food.objects.filter(pk=instance.pk).update(path=new)
+    instance.path = new
+    copy_food_paths('f.id = %s', [instance.pk])
+
+
+def city_saved(sender, instance, raw=False, **kwargs):
+    """Sets the path of a city and of its aggregates when it changed"""
+    new = city_path(instance)
+    if raw or instance.path == new:
+        return
+    models.City.objects.filter(pk=instance.pk).update(path=new)
+    instance.path = new
+    models.PriceAggregate.objects.filter(city_id=instance.pk).update(city_path=new)
+
+
+def rebuild():
+    """Recomputes every path from the parent columns. Returns
+    {table: rows changed}"""
+    changed = {}
+    with connection.cursor() as cursor:
+        for table, sql in (
+                (CITY_TABLE, _path_sql('country_id', 'state_id', 'id')),
+                (CATEGORY_TABLE, _path_sql('area_id', 'id'))):
+            cursor.execute(f"UPDATE {table} SET path = {sql} WHERE path <> {sql}")
+            changed[table] = cursor.rowcount
+        cursor.execute(
+            f"UPDATE {FOOD_TABLE} f SET path = c.path || {_path_sql('f.id')} FROM {CATEGORY_TABLE} c "
+            f"WHERE c.id = f.category_id AND f.path <> c.path || {_path_sql('f.id')}")
+        changed[FOOD_TABLE] = cursor.rowcount
+        changed[FOOD_PRICE_TABLE] = copy_food_paths()
+        cursor.execute(
+            f"UPDATE {AGGREGATE_TABLE} a SET city_path = c.path FROM {CITY_TABLE} c "
+            f"WHERE c.id = a.city_id AND a.city_path <> c.path")
+        changed[AGGREGATE_TABLE] = cursor.rowcount
+    return changed
+
+
+def rollup(spec, geography='', items='', month_from=None, month_to=None):
+    """count/minimum/maximum/mean of the comparable price of a price model
+    over the cities under the geography prefix and the items under the items
+    prefix, e.g. rollup(spec, state_prefix(state), area_prefix(area)). One
+    query on PriceAggregate"""
+    rows = models.PriceAggregate.objects.filter(price_model=spec.key)
+    if geography:
+        rows = rows.filter(city_path__startswith=geography)
+    if items:
+        rows = rows.filter(item_path__startswith=items)
+    if month_from:
+        rows = rows.filter(month__gte=month_from.replace(day=1))
+    if month_to:
+        rows = rows.filter(month__lte=month_to)
+    result = rows.aggregate(count=Sum('count'), total=Sum('total'), minimum=Min('minimum'),
+                            maximum=Max('maximum'))
+    count = result['count'] or 0
+    return {'count': count, 'minimum': result['minimum'], 'maximum': result['maximum'],
+            'mean': result['total'] / count if count else None}
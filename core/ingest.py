@@ -0,0 +1,168 @@
+"""Bulk loaders for the geography catalogs (Language, Country, State, City).
+
+Rows are streamed from a csv reader, parents are resolved from maps that are
+loaded once per run and every batch is written with two bulk_create calls:
+one for the model rows and one for their parler translations.
+"""
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+
+from core.models import AppLanguage, City, Country, State
+
+
+def batched(iterable, size):
+    """Yields lists of at most size items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class RowError(ValueError):
+    """A csv row that can not be loaded"""
+
+
+class GeoLoader:
+    """Base loader. Subclasses define model, load_maps() and build()"""
+    model = None
+
+    def __init__(self, batch_size=1000, language=None):
+        self.batch_size = batch_size
+        self.language = language or settings.LANGUAGE_CODE
+        self.rows = 0
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+        self.elapsed = 0.0
+        self.load_maps()
+
+    def load_maps(self):
+        pass
+
+    def build(self, row):
+        """Returns (instance, translated name) or None when the row already exists"""
+        raise NotImplementedError
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def load(self, rows):
+        start = time.perf_counter()
+        for batch in batched(rows, self.batch_size):
+            self.write(batch)
+        self.elapsed += time.perf_counter() - start
+        return self
+
+    def write(self, batch):
+        objs = []
+        names = []
+        for row in batch:
+            self.rows += 1
+            try:
+                built = self.build([value.strip() for value in row])
+            except (RowError, IndexError) as error:
+                self.errors.append((self.rows, str(error) or 'missing column'))
+                continue
+            if built is None:
+                self.skipped += 1
+                continue
+            objs.append(built[0])
+            names.append(built[1])
+        if not objs:
+            return
+
+        translation_model = self.model._parler_meta.root_model
+        with transaction.atomic():
+            self.model.objects.bulk_create(objs)
+            translation_model.objects.bulk_create([
+                translation_model(master_id=obj.id,
+                                  language_code=self.language, name=name)
+                for obj, name in zip(objs, names)])
+        self.created += len(objs)
+
+
+class LanguageLoader(GeoLoader):
+    """iso_code, name"""
+    model = AppLanguage
+
+    def load_maps(self):
+        self.existing = set(AppLanguage.objects.values_list('iso_code', flat=True))
+
+    def build(self, row):
+        if row[0] in self.existing:
+            return None
+        self.existing.add(row[0])
+        return AppLanguage(iso_code=row[0], name_en=row[1]), row[1]
+
+
+class CountryLoader(GeoLoader):
+    """iso_code, name_en [, language iso_code]"""
+    model = Country
+
+    def load_maps(self):
+        self.existing = set(Country.objects.values_list('iso_code', flat=True))
+        self.languages = dict(AppLanguage.objects.values_list('iso_code', 'id'))
+
+    def build(self, row):
+        if row[0] in self.existing:
+            return None
+        language = row[2] if len(row) > 2 and row[2] else settings.LANGUAGE_CODE
+        if language not in self.languages:
+            raise RowError(f'unknown language {language}')
+        self.existing.add(row[0])
+        obj = Country(iso_code=row[0], name_en=row[1],
+                      language_id=self.languages[language])
+        return obj, row[1]
+
+
+class StateLoader(GeoLoader):
+    """country iso_code, iso_code, name"""
+    model = State
+
+    def load_maps(self):
+        self.existing = set(State.objects.values_list('iso_code', flat=True))
+        self.countries = dict(Country.objects.values_list('iso_code', 'id'))
+
+    def build(self, row):
+        if row[1] in self.existing:
+            return None
+        if row[0] not in self.countries:
+            raise RowError(f'unknown country {row[0]}')
+        self.existing.add(row[1])
+        return State(iso_code=row[1], country_id=self.countries[row[0]]), row[2]
+
+
+class CityLoader(GeoLoader):
+    """state iso_code, code, name
+    City has no code of its own, a city is identified by its name in the state"""
+    model = City
+
+    def load_maps(self):
+        self.states = {iso_code: (state_id, country_id) for iso_code, state_id, country_id
+                       in State.objects.values_list('iso_code', 'id', 'country_id')}
+        translation_model = City._parler_meta.root_model
+        self.existing = set(translation_model.objects.filter(
+            language_code=self.language).values_list('master__state_id', 'name'))
+
+    def build(self, row):
+        if row[0] not in self.states:
+            raise RowError(f'unknown state {row[0]}')
+        state_id, country_id = self.states[row[0]]
+        if (state_id, row[2]) in self.existing:
+            return None
+        self.existing.add((state_id, row[2]))
+        return City(state_id=state_id, country_id=country_id), row[2]
+
+
+LOADERS = {
+    'Language': LanguageLoader,
+    'Country': CountryLoader,
+    'State': StateLoader,
+    'City': CityLoader,
+}
@@ -0,0 +1,496 @@
+"""Leaderboards of contributors ranked by points.
+
+A board ranks users by points, highest first, ties by user id. There is a
+global board and one per country on User.points, and weekly boards on the
+points awarded during the current ISO week. Boards are kept sorted and
+updated as points are awarded (core.awards) or users are edited
+(core.signals), so "top N" and "rank of a user" never sort the user table:
+
+    leaderboard.top(10, country=mx.pk)
+    leaderboard.rank(request.user.pk, weekly=True)
+
+With the Redis cache backend a board is a sorted set shared by all workers.
+With another cache shared by the workers it is a SortedKeys in process
+memory, loaded from the database on first use. Every update moves a
+version number in the cache and the other processes reload their boards
+on their next read, so prefer Redis when points are awarded often. With a
+per process cache (see authentication.shared_cache()) the other processes
+could not be told, boards are read from the database with a window query.
+Recover a board with the rebuild_leaderboard command.
+"""
+import uuid
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from django.core.cache import cache, caches
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from core.authentication import shared_cache
+from core.models import ActivityLog, User
+
+# memory boards sort one int per user: -points * ID_SPAN + user id
+ID_SPAN = 2 ** 32
+WEEK_SECONDS = 7 * 24 * 3600
+# keys per block of a SortedKeys, blocks are split at twice this size
+BLOCK = 1000
+# seconds a Redis board rebuild may take before its lock expires
+REBUILD_TIMEOUT = 600
+# moved by every update of the memory boards, see _sync() and _updated()
+VERSION_KEY = 'leaderboard:version'
+
+
+def _key(user_id, points):
+    return -points * ID_SPAN + user_id
+
+
+def _unkey(key):
+    points, user_id = divmod(key, ID_SPAN)
+    return user_id, -points
+
+
+class SortedKeys:
+    """Sorted ints kept in blocks of BLOCK to 2 * BLOCK keys, with the last
+    key of every block in maxes. Adding or removing a key is a binary search
+    over maxes and an insert or delete in one block, O(log n + BLOCK) instead
+    of O(n) for one sorted list. The block sizes are kept in a Fenwick tree,
+    so the position of a key is O(log n) too. The tree is rebuilt when a
+    block is split or dropped, once every BLOCK updates at most"""
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self.blocks = [keys[start:start + BLOCK] for start in range(0, len(keys), BLOCK)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(keys)
+        self._index()
+
+    def _index(self):
+        """Builds the Fenwick tree of the block sizes"""
+        self.tree = [0] * (len(self.blocks) + 1)
+        for position, block in enumerate(self.blocks, start=1):
+            self.tree[position] += len(block)
+            parent = position + (position & -position)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[position]
+
+    def _resized(self, position, delta):
+        position += 1
+        while position < len(self.tree):
+            self.tree[position] += delta
+            position += position & -position
+
+    def _before(self, position):
+        """Number of keys in the blocks before position"""
+        total = 0
+        while position:
+            total += self.tree[position]
+            position -= position & -position
+        return total
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for block in self.blocks:
+            yield from block
+
+    def _block(self, key):
+        """Index of the block key belongs in"""
+        return min(bisect_left(self.maxes, key), len(self.maxes) - 1)
+
+    def add(self, key):
+        self.size += 1
+        if not self.blocks:
+            self.blocks, self.maxes = [[key]], [key]
+            self._index()
+            return
+        position = self._block(key)
+        block = self.blocks[position]
+        insort(block, key)
+        self.maxes[position] = block[-1]
+        if len(block) > 2 * BLOCK:
+            self.blocks[position:position + 1] = [block[:BLOCK], block[BLOCK:]]
+            self.maxes[position:position + 1] = [block[BLOCK - 1], block[-1]]
+            self._index()
+        else:
+            self._resized(position, 1)
+
+    def remove(self, key):
+        """Removes a key that is present"""
+        position = self._block(key)
+        block = self.blocks[position]
+        del block[bisect_left(block, key)]
+        self.size -= 1
+        if block:
+            self.maxes[position] = block[-1]
+            self._resized(position, -1)
+        else:
+            del self.blocks[position], self.maxes[position]
+            self._index()
+
+    def index(self, key):
+        """Number of keys lower than key"""
+        position = bisect_left(self.maxes, key)
+        if position == len(self.blocks):
+            return self.size
+        return self._before(position) + bisect_left(self.blocks[position], key)
+
+    def slice(self, start, stop):
+        """The keys of positions start to stop - 1"""
+        found = []
+        for block in self.blocks:
+            if start >= len(block):
+                start -= len(block)
+                stop -= len(block)
+                continue
+            found.extend(block[start:stop])
+            stop -= len(block)
+            start = 0
+            if stop <= 0:
+                break
+        return found
+
+
+class MemoryBoard:
+    """A board in process memory: rank and updates are binary searches in a
+    SortedKeys"""
+
+    def __init__(self, scores=()):
+        """scores: (user_id, points) rows"""
+        self.points = dict(scores)
+        self.keys = SortedKeys(_key(user_id, points) for user_id, points in self.points.items())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def remove(self, user_id):
+        if user_id in self.points:
+            self.keys.remove(_key(user_id, self.points.pop(user_id)))
+
+    def set(self, user_id, points):
+        self.remove(user_id)
+        self.points[user_id] = points
+        self.keys.add(_key(user_id, points))
+
+    def add(self, user_id, points):
+        self.set(user_id, self.points.get(user_id, 0) + points)
+
+    def top(self, n=10, offset=0):
+        """[(user_id, points)] of the ranks offset + 1 to offset + n"""
+        return [_unkey(key) for key in self.keys.slice(offset, offset + n)]
+
+    def rank(self, user_id):
+        """(rank, points) of a user, None when not on the board"""
+        if user_id not in self.points:
+            return None
+        points = self.points[user_id]
+        return self.keys.index(_key(user_id, points)) + 1, points
+
+
+class QueryBoard:
+    """A board read from the database, when the boards in memory of the
+    processes could not be kept in sync. Ranks with a window query over
+    scores(), updates are already in the database"""
+
+    def __init__(self, country=None, weekly=False):
+        self.sql, self.params = scores(country, weekly).query.sql_with_params()
+
+    def _query(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(scores=f'({self.sql}) AS s(user_id, points)'),
+                           [*self.params, *params])
+            return cursor.fetchall()
+
+    def __len__(self):
+        return self._query('SELECT count(*) FROM {scores}')[0][0]
+
+    def top(self, n=10, offset=0):
+        return [(user_id, int(points)) for user_id, points in self._query(
+            'SELECT user_id, points FROM {scores} ORDER BY points DESC, user_id LIMIT %s OFFSET %s',
+            [n, offset])]
+
+    def rank(self, user_id):
+        found = self._query(
+            'SELECT position, points FROM (SELECT user_id, points, '
+            'row_number() OVER (ORDER BY points DESC, user_id) AS position FROM {scores}) r '
+            'WHERE user_id = %s', [user_id])
+        return (found[0][0], int(found[0][1])) if found else None
+
+
+# applies one update to a board and, while the board is rebuilt, journals it
+# for the new copy. KEYS: board, rebuild lock. ARGV: operation, user, points
+UPDATE_SCRIPT = """
+local function apply(key, operation, user, points)
+    if operation == 'add' then
+        redis.call('ZINCRBY', key, points, user)
+    elseif operation == 'set' then
+        redis.call('ZADD', key, points, user)
+    else
+        redis.call('ZREM', key, user)
+    end
+end
+apply(KEYS[1], ARGV[1], ARGV[2], ARGV[3])
+local building = redis.call('GET', KEYS[2])
+if building then
+    redis.call('RPUSH', building .. ':journal', ARGV[1] .. ':' .. ARGV[2] .. ':' .. ARGV[3])
+end
+"""
+
+# replays the journal of the updates made during a rebuild on the new copy
+# and swaps it in, if the rebuild still holds the lock.
+# KEYS: board, rebuild lock, new copy. ARGV: timeout of the board or 0
+SWAP_SCRIPT = """
+if redis.call('GET', KEYS[2]) ~= KEYS[3] then
+    redis.call('DEL', KEYS[3], KEYS[3] .. ':journal')
+    return 0
+end
+for _, entry in ipairs(redis.call('LRANGE', KEYS[3] .. ':journal', 0, -1)) do
+    local operation, user, points = string.match(entry, '([^:]*):([^:]*):(.*)')
+    if operation == 'add' then
+        redis.call('ZINCRBY', KEYS[3], points, user)
+    elseif operation == 'set' then
+        redis.call('ZADD', KEYS[3], points, user)
+    else
+        redis.call('ZREM', KEYS[3], user)
+    end
+end
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('RENAME', KEYS[3], KEYS[1])
+    if tonumber(ARGV[1]) > 0 then
+        redis.call('EXPIRE', KEYS[1], ARGV[1])
+    end
+else
+    redis.call('DEL', KEYS[1])
+end
+redis.call('DEL', KEYS[2], KEYS[3] .. ':journal')
+return 1
+"""
+
+
+class RedisBoard:
+    """A board in a Redis sorted set.
+
+    replace() loads a new copy under a unique key while holding a SET NX
+    lock, so two workers never rebuild a board at once. Updates made
+    meanwhile go to the live board and to a journal that is replayed on the
+    new copy right before it is renamed over the live one, in one script,
+    so they are not lost. An update whose transaction committed before the
+    scores were read but which was recorded after the lock was taken is
+    counted twice, the window is the time between a commit and its
+    on_commit callback"""
+
+    def __init__(self, client, key, timeout=None):
+        self.client = client
+        self.key = key
+        self.lock = f'{key}:rebuild'
+        self.timeout = timeout
+
+    def __len__(self):
+        return self.client.zcard(self.key)
+
+    def exists(self):
+        return self.client.exists(self.key)
+
+    def _update(self, operation, user_id, points=0):
+        self.client.eval(UPDATE_SCRIPT, 2, self.key, self.lock, operation, user_id, points)
+
+    def remove(self, user_id):
+        self._update('remove', user_id)
+
+    def set(self, user_id, points):
+        self._update('set', user_id, points)
+
+    def add(self, user_id, points):
+        self._update('add', user_id, points)
+
+    def top(self, n=10, offset=0):
+        return [(int(user_id), int(points)) for user_id, points in
+                self.client.zrevrange(self.key, offset, offset + n - 1, withscores=True)]
+
+    def rank(self, user_id):
+        pipe = self.client.pipeline()
+        pipe.zrevrank(self.key, user_id)
+        pipe.zscore(self.key, user_id)
+        rank, points = pipe.execute()
+        return None if rank is None else (rank + 1, int(points))
+
+    def replace(self, scores, chunk=10000):
+        """Loads a whole board and swaps it in atomically. Returns False,
+        without reading scores, when another process is rebuilding it"""
+        building = f'{self.key}:building:{uuid.uuid4().hex}'
+        if not self.client.set(self.lock, building, nx=True, ex=REBUILD_TIMEOUT):
+            return False
+        try:
+            scores = list(scores)
+            for start in range(0, len(scores), chunk):
+                self.client.zadd(building, dict(scores[start:start + chunk]))
+            return bool(self.client.eval(SWAP_SCRIPT, 3, self.key, self.lock, building, self.timeout or 0))
+        except Exception:
+            self.client.delete(building, f'{building}:journal')
+            if self.client.get(self.lock) in (building, building.encode()):
+                self.client.delete(self.lock)
+            raise
+
+
+def redis_client():
+    """Redis client of the default cache, None with other backends"""
+    from django.core.cache.backends.redis import RedisCache
+    backend = caches['default']
+    if isinstance(backend, RedisCache):
+        return backend._cache.get_client(write=True)
+    return None
+
+
+def week_start(now=None):
+    now = now or timezone.now()
+    return (now - timedelta(days=now.weekday())).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+
+
+def board_name(country=None, weekly=False):
+    parts = []
+    if weekly:
+        parts.append(f"week:{week_start():%G-%V}")
+    if country:
+        parts.append(f'country:{country}')
+    return ':'.join(parts) or 'global'
+
+
+def scores(country=None, weekly=False):
+    """(user_id, points) of a board, read from the database"""
+    if weekly:
+        start = week_start()
+        rows = ActivityLog.objects.filter(created_at__gte=start,
+                                          created_at__lt=start + timedelta(weeks=1))
+        if country:
+            rows = rows.filter(user__country_id=country)
+        return rows.values_list('user_id').annotate(total=Sum('points')).filter(total__gt=0)
+    rows = User.objects.filter(points__gt=0)
+    if country:
+        rows = rows.filter(country_id=country)
+    return rows.values_list('id', 'points')
+
+
+_boards = {}
+# VERSION_KEY when the memory boards were loaded
+_version = None
+
+
+def _redis_board(client, name, weekly):
+    return RedisBoard(client, cache.make_key(f'leaderboard:{name}'),
+                      timeout=2 * WEEK_SECONDS if weekly else None)
+
+
+def _in_memory():
+    return redis_client() is None and shared_cache()
+
+
+def _sync():
+    """Drops the memory boards when another process updated a board"""
+    global _version
+    version = cache.get(VERSION_KEY, 0)
+    if version != _version:
+        _boards.clear()
+        _version = version
+
+
+def _updated():
+    """Moves the version after this process updated the boards, so the other
+    processes reload theirs. The boards of this one are kept when no other
+    process moved the version since they were loaded"""
+    global _version
+    cache.add(VERSION_KEY, 0, None)
+    version = cache.incr(VERSION_KEY)
+    if version != (_version or 0) + 1:
+        _boards.clear()
+    _version = version
+
+
+def board(country=None, weekly=False, load=True):
+    """The board of a country (id) or global, of this week or all time.
+    With load=False returns None instead of loading a board not in use"""
+    name = board_name(country, weekly)
+    client = redis_client()
+    if client is not None:
+        found = _redis_board(client, name, weekly)
+        if not found.exists():
+            if not load:
+                return None
+            found.replace(scores(country, weekly))
+        return found
+    if not shared_cache():
+        return QueryBoard(country, weekly) if load else None
+    _sync()
+    if name not in _boards:
+        if not load:
+            return None
+        if weekly:
+            # boards of previous weeks are not ranked anymore
+            week = board_name(weekly=True)
+            for old in [old for old in _boards if old.startswith('week:') and not old.startswith(week)]:
+                del _boards[old]
+        _boards[name] = MemoryBoard(scores(country, weekly))
+    return _boards[name]
+
+
+def top(n=10, offset=0, country=None, weekly=False):
+    return board(country, weekly).top(n, offset)
+
+
+def rank(user_id, country=None, weekly=False):
+    return board(country, weekly).rank(user_id)
+
+
+def _boards_of(country):
+    """Boards in use a user of country is ranked in"""
+    found = [board(ranked_in, weekly, load=False)
+             for ranked_in in ([None, country] if country else [None]) for weekly in (False, True)]
+    return [found_board for found_board in found if found_board is not None]
+
+
+def record(user_id, country, points):
+    """Adds awarded points to the boards in use. Boards not in use are loaded
+    from the database, which already has them, when they are needed"""
+    for found in _boards_of(country):
+        found.add(user_id, points)
+    if _in_memory():
+        _updated()
+
+
+def move(user_id, old_points, old_country, points, country):
+    """Updates the all time boards after an edit of a user's points or country"""
+    if old_country and old_country != country:
+        found = board(old_country, load=False)
+        if found is not None:
+            found.remove(user_id)
+    for found in (board(load=False), board(country, load=False) if country else None):
+        if found is None:
+            continue
+        if points > 0:
+            found.set(user_id, points)
+        else:
+            found.remove(user_id)
+    if _in_memory():
+        _updated()
+
+
+def rebuild():
+    """Reloads every board from the database. Returns {board name: users}"""
+    _boards.clear()
+    if _in_memory():
+        _updated()
+    countries = User.objects.filter(country__isnull=False).values_list(
+        'country_id', flat=True).distinct()
+    client = redis_client()
+    sizes = {}
+    for country in [None, *countries]:
+        for weekly in (False, True):
+            name = board_name(country, weekly)
+            if client is not None:
+                found = _redis_board(client, name, weekly)
+                found.replace(scores(country, weekly))
+            else:
+                found = board(country, weekly)
+            sizes[name] = len(found)
+    return sizes
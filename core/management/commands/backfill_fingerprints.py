@@ -0,0 +1,33 @@
+import time
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from core import aggregates, fingerprint
+from core.prices import PRICE_SPECS
+
+
+class Command(BaseCommand):
+    """Fingerprint the stored price rows and flag the duplicates among them.
+    Run it once after adding the fingerprint columns. The aggregates of the
+    models with new duplicates are rebuilt without them"""
+    help = "backfill_fingerprints [model ...] [--batch-size N]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*',
+                            help=f"default: every price model of {', '.join(PRICE_SPECS)}")
+        parser.add_argument('--batch-size', type=int, default=50000, help="rows updated per statement")
+
+    def handle(self, *args, **options):
+        unknown = set(options['models']) - set(PRICE_SPECS)
+        if unknown:
+            raise CommandError(f"unknown price models {', '.join(sorted(unknown))}")
+        for key in options['models'] or PRICE_SPECS:
+            spec = PRICE_SPECS[key]
+            start = time.perf_counter()
+            with transaction.atomic():
+                before = spec.model.objects.filter(is_duplicate=True).count()
+                hashed, duplicates = fingerprint.backfill(spec, options['batch_size'])
+                if duplicates != before:
+                    aggregates.rebuild(spec)
+            self.stdout.write(f"{key}: {hashed} rows fingerprinted, {duplicates - before} new duplicates "
+                              f"in {time.perf_counter() - start:.2f}s")
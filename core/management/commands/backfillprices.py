@@ -0,0 +1,127 @@
+import csv
+import glob
+import os
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+
+from core.pgcopy import load_file, partition_by_country
+from core.prices import PRICE_SPECS
+
+
+def _init_worker():
+    # no-op when the worker is forked from this process, sets Django up
+    # when it is spawned. Every worker opens its own connection on first use.
+    django.setup()
+
+
+class Command(BaseCommand):
+    """Load many price files in parallel, e.g. one file per country per month.
+
+    Files are grouped by country and a country is never loaded by two workers
+    at the same time, so workers do not contend on the same parent rows.
+    Files with rows of several countries are split first.
+    """
+    help = "backfillprices model path|directory|glob [...] [--workers N]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=list(PRICE_SPECS))
+        parser.add_argument('paths', nargs='+', help="files, directories or glob patterns")
+        parser.add_argument('--workers', type=int, default=os.cpu_count())
+        parser.add_argument('--dialect', default='excel', choices=csv.list_dialects())
+        parser.add_argument('--batch-size', type=int, default=50000)
+        parser.add_argument('--language', default=settings.LANGUAGE_CODE)
+        parser.add_argument('--user', help="email of the user recorded as created_by")
+
+    def expand(self, paths):
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend(sorted(glob.glob(os.path.join(path, '*.csv'))))
+            elif os.path.isfile(path):
+                files.append(path)
+            else:
+                files.extend(sorted(glob.glob(path)))
+        if not files:
+            raise CommandError("no files found")
+        return files
+
+    def progress(self, done, total, rows, start):
+        width = 30
+        filled = width * done // total
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"\r[{'#' * filled}{'.' * (width - filled)}] {done}/{total} files "
+            f"{rows:,} rows {rows / elapsed if elapsed else 0:,.0f} rows/sec", ending='')
+        self.stdout.flush()
+
+    def handle(self, *args, **options):
+        user_id = None
+        if options['user']:
+            user_id = get_user_model().objects.filter(
+                email=options['user']).values_list('id', flat=True).first()
+            if user_id is None:
+                raise CommandError(f"user {options['user']} does not exist")
+
+        files = self.expand(options['paths'])
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                pending = partition_by_country(files, directory, options['dialect'])
+            except (OSError, ValueError) as error:
+                raise CommandError(error)
+            total = sum(len(paths) for paths in pending.values())
+            workers = max(1, min(options['workers'], len(pending)))
+            results = self.run(pending, total, workers, user_id, options)
+
+        failed = [result for result in results if result['error']]
+        for result in failed:
+            self.stderr.write(f"{result['path']}: {result['error']}")
+        rows = sum(result['rows'] for result in results)
+        busy = sum(result['elapsed'] for result in results)
+        self.stdout.write(
+            f"{len(results)} files, {len(failed)} failed, {rows:,} rows: "
+            f"{sum(result['loaded'] for result in results):,} loaded, "
+            f"{sum(result['rejected'] for result in results):,} rejected in {self.wall:.2f}s "
+            f"({rows / self.wall if self.wall else 0:,.0f} rows/sec, {workers} workers, "
+            f"{busy / self.wall / workers if self.wall else 0:.0%} utilisation)")
+
+    def run(self, pending, total, workers, user_id, options):
+        """Keeps up to workers files loading, never two of the same country"""
+        # forked workers must not share the parent's connections
+        connections.close_all()
+        results = []
+        running = {}
+        start = time.perf_counter()
+        rows = 0
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            while pending or running:
+                busy = set(running.values())
+                # countries with the most files left go first
+                for country in sorted(pending, key=lambda c: -len(pending[c])):
+                    if len(running) >= workers:
+                        break
+                    if country in busy:
+                        continue
+                    path = pending[country].pop(0)
+                    if not pending[country]:
+                        del pending[country]
+                    future = pool.submit(load_file, options['model'], path,
+                                         options['batch_size'], options['language'],
+                                         user_id, options['dialect'])
+                    running[future] = country
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    result = future.result()
+                    results.append(result)
+                    rows += result['rows']
+                    self.progress(len(results), total, rows, start)
+        self.wall = time.perf_counter() - start
+        self.stdout.write("")
+        return results
@@ -0,0 +1,30 @@
+from django.core.management import BaseCommand, CommandError
+
+from core import costofliving, currency
+
+
+class Command(BaseCommand):
+    """Compute the cost of living index of every city from the monthly
+    aggregates. Meant to run nightly, e.g. from cron:
+        0 3 * * * python manage.py compute_cost_of_living
+    """
+    help = "compute_cost_of_living [--months 12] [--min-items 1] [--currency USD]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=12,
+                            help="months of aggregates the prices are averaged over")
+        parser.add_argument('--min-items', type=int, default=1,
+                            help="items a city needs in a category to get an index")
+        parser.add_argument('--currency', default=None,
+                            help="iso code prices are compared in, COST_OF_LIVING_CURRENCY by default")
+
+    def handle(self, *args, **options):
+        try:
+            result = costofliving.compute(options['months'], options['min_items'],
+                                          to_currency=options['currency'])
+        except currency.CurrencyConversionError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"{result['cities']} cities, {result['rows']} index rows "
+                          f"in {result['seconds']:.2f}s")
+        if result['skipped']:
+            self.stdout.write(f"{result['skipped']} prices without a currency or rate left out")
@@ -0,0 +1,48 @@
+import sys
+from datetime import date
+
+from django.core.management import BaseCommand, CommandError
+
+from core import export
+from core.prices import PRICE_SPECS
+
+
+def iso_date(value):
+    return date.fromisoformat(value)
+
+
+class Command(BaseCommand):
+    """Export the rows of a price model as csv or ndjson.
+
+    Rows are streamed from a server side cursor, so the memory used does not
+    depend on the size of the export. See core.export for the columns.
+    """
+    help = "exportprices model [--output FILE] [--format csv|ndjson] [--gzip] " \
+           "[--country ISO] [--date-from] [--date-to]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=list(PRICE_SPECS))
+        parser.add_argument('--output', help="file to write, default standard output")
+        parser.add_argument('--format', dest='output_format', default='csv', choices=list(export.FORMATS))
+        parser.add_argument('--gzip', action='store_true', help="compress the output with gzip")
+        parser.add_argument('--country', help="iso_code of the country")
+        parser.add_argument('--date-from', type=iso_date, help="YYYY-MM-DD")
+        parser.add_argument('--date-to', type=iso_date, help="YYYY-MM-DD")
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help="rows fetched from the cursor at a time")
+
+    def handle(self, *args, **options):
+        if options['gzip'] and not options['output']:
+            raise CommandError("--gzip needs --output")
+        chunks = export.stream(PRICE_SPECS[options['model']], options['output_format'],
+                               compress=options['gzip'], chunk_size=options['chunk_size'],
+                               country=options['country'], date_from=options['date_from'],
+                               date_to=options['date_to'])
+        if not options['output']:
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            return
+        mode = 'wb' if options['gzip'] else 'w'
+        with open(options['output'], mode, **({} if options['gzip'] else {'newline': ''})) as file:
+            for chunk in chunks:
+                file.write(chunk)
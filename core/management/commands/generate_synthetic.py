@@ -0,0 +1,58 @@
+from django.core.management import BaseCommand, CommandError
+
+from core import synthetic
+from core.prices import PRICE_SPECS
+
+
+class Command(BaseCommand):
+    """Generate synthetic countries, catalogs and price rows, see core.synthetic.
+
+    The reference data is created once, later runs add price rows to it:
+
+        generate_synthetic --countries 10 --states 8 --cities 10 --rows 1000000
+    """
+    help = "generate_synthetic [model ...] [--rows N] [--countries N] [--clear]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help=f"default: all of {', '.join(PRICE_SPECS)}")
+        parser.add_argument('--rows', type=int, default=100000, help="price rows per model")
+        parser.add_argument('--countries', type=int, default=3)
+        parser.add_argument('--states', type=int, default=4, help="states per country")
+        parser.add_argument('--cities', type=int, default=5, help="cities per state")
+        parser.add_argument('--vendors', type=int, default=10, help="vendors per country")
+        parser.add_argument('--foods', type=int, default=50)
+        parser.add_argument('--medicines', type=int, default=20)
+        parser.add_argument('--duplicates', type=float, default=0.0,
+                            help="fraction of rows resubmitting another row")
+        parser.add_argument('--wild', type=float, default=0.0,
+                            help="fraction of prices off by a factor 100")
+        parser.add_argument('--seed', type=int,
+                            help="seed of the price rows, default a new one per run so runs add different rows")
+        parser.add_argument('--batch-size', type=int, default=100000)
+        parser.add_argument('--clear', action='store_true',
+                            help="delete the synthetic data first, --rows 0 to only delete it")
+
+    def handle(self, *args, **options):
+        keys = options['models'] or list(PRICE_SPECS)
+        unknown = set(keys) - set(PRICE_SPECS)
+        if unknown:
+            raise CommandError(f"unknown price models {', '.join(sorted(unknown))}")
+        if options['clear']:
+            self.stdout.write(f"{synthetic.clear()} synthetic price rows deleted")
+            if not options['rows']:
+                return
+        try:
+            reference = synthetic.create_reference(
+                countries=options['countries'], states=options['states'], cities=options['cities'],
+                vendors=options['vendors'], foods=options['foods'], medicines=options['medicines'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"{len(reference.country_codes)} countries, {len(reference.cities)} cities, "
+                          f"{len(reference.vendors)} vendors")
+        for key in keys:
+            result = synthetic.insert_rows(PRICE_SPECS[key], reference, options['rows'],
+                                           batch_size=options['batch_size'], seed=options['seed'],
+                                           duplicates=options['duplicates'], wild=options['wild'])
+            rate = result['rows'] / result['seconds'] if result['seconds'] else 0
+            self.stdout.write(f"{key}: {result['rows']} rows in {result['seconds']:.1f} s "
+                              f"({rate:,.0f} rows/s), {result['duplicates']} duplicates in the table")
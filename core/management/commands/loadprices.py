@@ -0,0 +1,65 @@
+import csv
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+
+from core.pgcopy import PriceCopyLoader
+from core.prices import PRICE_SPECS
+
+
+class Command(BaseCommand):
+    """Load a csv file of price observations with PostgreSQL COPY.
+
+    The first row of the file names the model fields, see core.pgcopy for
+    how foreign keys are given.
+    """
+    help = "loadprices model filename [--batch-size] [--benchmark N]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=list(PRICE_SPECS))
+        parser.add_argument('filename')
+        parser.add_argument('--dialect', default='excel',
+                            choices=csv.list_dialects())
+        parser.add_argument('--batch-size', type=int, default=50000)
+        parser.add_argument('--language', default=settings.LANGUAGE_CODE,
+                            help="language of the city names in the file")
+        parser.add_argument('--user', help="email of the user recorded as created_by")
+        parser.add_argument('--errors', help="write every rejected row to this csv file")
+        parser.add_argument('--benchmark', type=int, default=0, metavar='N',
+                            help="also save N rows through the ORM (rolled back) "
+                                 "and compare the throughput")
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(email=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"user {options['user']} does not exist")
+
+        loader = PriceCopyLoader(PRICE_SPECS[options['model']], batch_size=options['batch_size'],
+                                 language=options['language'], user=user)
+        try:
+            with open(options['filename'], newline='', encoding='utf-8') as file:
+                loader.load(csv.reader(file, dialect=options['dialect']),
+                            benchmark=options['benchmark'])
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+
+        for report in loader.batches:
+            self.stdout.write(str(report))
+            for line, message in report.errors[:5]:
+                self.stdout.write(f"    line {line}: {message}")
+        if options['errors']:
+            with open(options['errors'], 'w', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                writer.writerow(['line', 'error'])
+                writer.writerows(loader.errors)
+
+        self.stdout.write(
+            f"{loader.rows} rows: {loader.loaded} loaded, {len(loader.errors)} rejected, "
+            f"{loader.flagged} flagged as outliers in {loader.elapsed:.2f}s ({loader.rows_per_sec:,.0f} rows/sec)")
+        if options['benchmark']:
+            orm = loader.orm_rows_per_sec
+            ratio = f"{loader.rows_per_sec / orm:,.1f}x" if orm else "n/a"
+            self.stdout.write(f"ORM save(): {orm:,.0f} rows/sec, COPY is {ratio} faster")
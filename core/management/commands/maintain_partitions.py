@@ -0,0 +1,52 @@
+import os
+from datetime import date
+from django.core.management import BaseCommand, CommandError
+
+from core import partitions
+
+
+class Command(BaseCommand):
+    """Create the partitions of the coming months or years and detach the ones
+    older than the retention window, archiving them to compressed CSV files
+    with --archive-dir. Run it daily from cron"""
+    help = "maintain_partitions [table ...] [--ahead N] [--retention MONTHS] [--archive-dir DIR]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('tables', nargs='*',
+                            help="activitylog or a price model in PARTITIONED_PRICES, default: all")
+        parser.add_argument('--ahead', type=int, default=3,
+                            help="partitions to create ahead, months or years")
+        parser.add_argument('--retention', type=int,
+                            help="months kept attached, 0 keeps all. Default: the table setting")
+        parser.add_argument('--archive-dir',
+                            help="write expired partitions to DIR/<partition>.csv.gz and drop them. "
+                                 "Without it they are only detached")
+        parser.add_argument('--dry-run', action='store_true', help="only list expired partitions")
+
+    def handle(self, *args, **options):
+        tables = partitions.partitioned_tables()
+        unknown = set(options['tables']) - set(tables)
+        if unknown:
+            raise CommandError(f"unknown partitioned tables {', '.join(sorted(unknown))}")
+        directory = options['archive_dir']
+        if directory and not os.path.isdir(directory):
+            raise CommandError(f"{directory} is not a directory")
+        today = date.today()
+
+        for key in options['tables'] or tables:
+            partitioned = tables[key]
+            if not partitions.is_partitioned(partitioned.table):
+                self.stdout.write(f"{key}: {partitioned.table} is not partitioned, skipped")
+                continue
+            if not options['dry_run']:
+                for name in partitions.ensure(partitioned, today, options['ahead']):
+                    self.stdout.write(f"{key}: created {name}")
+            for start, name in partitions.expired(partitioned, today, options['retention']).items():
+                if options['dry_run']:
+                    self.stdout.write(f"{key}: {name} expired")
+                elif directory:
+                    path, rows = partitions.archive(partitioned, name, directory)
+                    self.stdout.write(f"{key}: archived {name}, {rows} rows to {path}")
+                else:
+                    partitions.detach(partitioned, name)
+                    self.stdout.write(f"{key}: detached {name}")
@@ -0,0 +1,74 @@
+import time
+from datetime import date
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from core import partitions
+from core.prices import get_spec
+
+
+class Command(BaseCommand):
+    """Convert a price table to range partitions by date while it stays in use.
+
+    The model has to be opted in first with PARTITIONED_PRICES, e.g.
+    PARTITIONED_PRICES = {'food': 'month', 'housing': 'year', 'gasoline': 'month'}
+    The rows are copied in batches to a partitioned copy kept in sync by a
+    trigger, then the tables are swapped. The command can be interrupted and
+    run again, it resumes. The original table is kept as
+    <table>_unpartitioned; drop it once the partitioned table is checked"""
+    help = "partition_prices model [--batch-size N] [--ahead N] [--no-swap]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', help="price model in PARTITIONED_PRICES")
+        parser.add_argument('--batch-size', type=int, default=50000)
+        parser.add_argument('--ahead', type=int, default=3,
+                            help="partitions to create ahead, months or years")
+        parser.add_argument('--pause', type=float, default=0,
+                            help="seconds to wait between batches, to spare the database")
+        parser.add_argument('--no-swap', action='store_true',
+                            help="copy the rows but leave the original table in place")
+
+    def handle(self, *args, **options):
+        key = options['model']
+        try:
+            spec = get_spec(key)
+        except KeyError as e:
+            raise CommandError(e.args[0])
+        interval = getattr(settings, 'PARTITIONED_PRICES', {}).get(key)
+        if interval is None:
+            raise CommandError(f"{key} is not in PARTITIONED_PRICES, add it with 'month' or 'year'")
+        if partitions.is_partitioned(spec.table):
+            self.stdout.write(f"{spec.table} is already partitioned")
+            return
+
+        conversion = partitions.OnlinePartitioning(partitions.price_table(spec, interval))
+        start = time.perf_counter()
+        try:
+            if conversion.prepare(date.today(), options['ahead']):
+                self.stdout.write(f"created {conversion.shadow} by {interval} and its sync trigger")
+            else:
+                self.stdout.write(f"resuming the copy to {conversion.shadow} after id {conversion.copied_id()}")
+            last_id, copied = conversion.copied_id(), 0
+            while True:
+                last_id, rows = conversion.copy_batch(last_id, options['batch_size'])
+                if last_id is None:
+                    break
+                copied += rows
+                self.stdout.write(f"\rcopied {copied} rows, up to id {last_id}", ending='')
+                self.stdout.flush()
+                if options['pause']:
+                    time.sleep(options['pause'])
+            self.stdout.write(f"\rcopied {copied} rows in {time.perf_counter() - start:.1f}s")
+
+            rows, partitioned_rows = conversion.verify()
+            if rows != partitioned_rows:
+                raise CommandError(f"{spec.table} has {rows} rows, {conversion.shadow} "
+                                   f"{partitioned_rows}; run the command again")
+            if options['no_swap']:
+                self.stdout.write(f"{rows} rows in sync, not swapped")
+                return
+            conversion.swap()
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"{spec.table} is partitioned by {interval}, the original table is "
+                          f"{conversion.old}")
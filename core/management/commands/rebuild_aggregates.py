@@ -0,0 +1,26 @@
+import time
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from core import aggregates
+from core.prices import PRICE_SPECS
+
+
+class Command(BaseCommand):
+    """Recompute the monthly price aggregates from the raw price tables.
+    Use it after loading data outside the ORM and loaders, or to fix drift"""
+    help = "rebuild_aggregates [model ...]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*',
+                            help=f"default: every price model of {', '.join(PRICE_SPECS)}")
+
+    def handle(self, *args, **options):
+        unknown = set(options['models']) - set(PRICE_SPECS)
+        if unknown:
+            raise CommandError(f"unknown price models {', '.join(sorted(unknown))}")
+        for key in options['models'] or PRICE_SPECS:
+            start = time.perf_counter()
+            with transaction.atomic():
+                buckets = aggregates.rebuild(PRICE_SPECS[key])
+            self.stdout.write(f"{key}: {buckets} buckets in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,22 @@
+import time
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from core import hierarchy, refdata
+
+
+class Command(BaseCommand):
+    """Recompute the hierarchy paths of the cities, categories and foods and
+    copy them to the food prices and the aggregates, see core.hierarchy.
+    The migrations fill the paths of the existing rows, run it after editing
+    catalogs outside the ORM"""
+    help = "rebuild_hierarchy"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with transaction.atomic():
+            changed = hierarchy.rebuild()
+            refdata.invalidate()
+        for table, rows in changed.items():
+            self.stdout.write(f"{table}: {rows} rows updated")
+        self.stdout.write(f"done in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,21 @@
+import time
+from django.core.management import BaseCommand
+
+from core import leaderboard
+
+
+class Command(BaseCommand):
+    """Reload the leaderboards from User.points and this week's ActivityLog.
+    Use it after editing points outside the ORM, or when Redis lost data.
+    Without Redis the boards live in each process, the command makes them
+    reload on their next read"""
+    help = "rebuild_leaderboard"
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        if leaderboard.redis_client() is None:
+            self.stdout.write("no Redis cache configured, boards are per process or read from the database")
+        sizes = leaderboard.rebuild()
+        for name, users in sizes.items():
+            self.stdout.write(f"{name}: {users} users")
+        self.stdout.write(f"{len(sizes)} boards in {time.perf_counter() - start:.2f}s")
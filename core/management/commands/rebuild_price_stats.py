@@ -0,0 +1,27 @@
+import time
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from core import outliers
+from core.prices import PRICE_SPECS
+
+
+class Command(BaseCommand):
+    """Seed the outlier statistics of the price models from their stored rows.
+    Use it once before enabling screening on existing data, or to fix drift"""
+    help = "rebuild_price_stats [model ...]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*',
+                            help="default: the screened models of OUTLIER_MODELS")
+
+    def handle(self, *args, **options):
+        unknown = set(options['models']) - set(PRICE_SPECS)
+        if unknown:
+            raise CommandError(f"unknown price models {', '.join(sorted(unknown))}")
+        keys = options['models'] or [key for key in PRICE_SPECS if outliers.enabled(PRICE_SPECS[key])]
+        for key in keys:
+            start = time.perf_counter()
+            with transaction.atomic():
+                count = outliers.rebuild(PRICE_SPECS[key])
+            self.stdout.write(f"{key}: {count} keys in {time.perf_counter() - start:.2f}s")
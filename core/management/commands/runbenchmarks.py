@@ -0,0 +1,67 @@
+import json
+import platform
+
+from django.core.management import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.benchmarks import BENCHMARKS, compare
+
+
+class Command(BaseCommand):
+    """Run the benchmarks of core.benchmarks against the configured database.
+
+    --json saves the results, --baseline compares them with a saved run and
+    fails when a timing is more than --tolerance worse:
+
+        runbenchmarks --json baseline.json
+        runbenchmarks --baseline baseline.json --tolerance 0.2
+    """
+    help = "runbenchmarks [name ...] [--repeat N] [--json PATH] [--baseline PATH]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f"default: all of {', '.join(BENCHMARKS)}")
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--model', help="price model used by the price benchmarks")
+        parser.add_argument('--page', type=int, help="deep page of the pagination benchmark")
+        parser.add_argument('--users', type=int, help="synthetic users of the leaderboard benchmark")
+        parser.add_argument('--rows', type=int, help="synthetic rows of the ingest benchmark")
+        parser.add_argument('--json', metavar='PATH', help="write the results to this file")
+        parser.add_argument('--baseline', metavar='PATH', help="results of an earlier run to compare with")
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help="fraction a timing may be worse than the baseline")
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f"unknown benchmarks {', '.join(sorted(unknown))}")
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as file:
+                    baseline = json.load(file)['results']
+            except (OSError, ValueError, KeyError) as error:
+                raise CommandError(f"cannot read the baseline: {error}")
+
+        results = {}
+        for name in names:
+            result = results[name] = BENCHMARKS[name](options)
+            self.stdout.write(name)
+            for metric, value in result.items():
+                if isinstance(value, float):
+                    value = f"{value:,.3f}"
+                self.stdout.write(f"    {metric}: {value}")
+
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as file:
+                json.dump({'created': timezone.now().isoformat(), 'host': platform.node(),
+                           'options': {key: options[key] for key in ('repeat', 'model', 'page', 'users', 'rows')},
+                           'results': results}, file, indent=2)
+        if baseline is not None:
+            regressions = compare(results, baseline, options['tolerance'])
+            for name, metric, before, value in regressions:
+                self.stderr.write(f"{name} {metric}: {before:,.3f} -> {value:,.3f}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} metrics worse than the baseline "
+                                   f"by more than {options['tolerance']:.0%}")
+            self.stdout.write("no regression against the baseline")
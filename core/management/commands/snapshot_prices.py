@@ -0,0 +1,39 @@
+import os
+
+from django.core.management import BaseCommand, CommandError
+
+from core import snapshot
+from core.prices import PRICE_SPECS
+
+
+class Command(BaseCommand):
+    """Write Parquet snapshots of the price models, see core.snapshot.
+
+    Each run appends the rows updated since the previous run of the same
+    directory, so it can be scheduled as often as needed. Rows deleted with
+    SQL instead of the ORM stay in the snapshot until a --full run.
+    """
+    help = "snapshot_prices directory [model ...] [--currency ISO] [--full]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('models', nargs='*', help=f"default: all of {', '.join(PRICE_SPECS)}")
+        parser.add_argument('--currency', help="also convert the prices to this currency (iso_code)")
+        parser.add_argument('--batch-size', type=int, default=50000, help="rows per row group")
+        parser.add_argument('--full', action='store_true',
+                            help="rewrite the snapshot instead of appending the changes")
+
+    def handle(self, *args, **options):
+        keys = options['models'] or list(PRICE_SPECS)
+        unknown = set(keys) - set(PRICE_SPECS)
+        if unknown:
+            raise CommandError(f"unknown price models {', '.join(sorted(unknown))}")
+        os.makedirs(options['directory'], exist_ok=True)
+        for key in keys:
+            try:
+                rows = snapshot.write_model(PRICE_SPECS[key], options['directory'],
+                                            to_currency=options['currency'],
+                                            batch_size=options['batch_size'], full=options['full'])
+            except snapshot.currencies.CurrencyConversionError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f"{key}: {rows} rows")
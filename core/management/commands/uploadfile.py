@@ -1,73 +1,46 @@
-import time
-from django.db import connections
-from django.db.utils import OperationalError
-from django.core.management import BaseCommand
-from django.contrib.auth import get_user_model
+import csv
 from django.conf import settings
+from django.core.management import BaseCommand, CommandError
 
-# import models from parent directory
-from core.models import Country, State, City, AppLanguage
-import csv
+from core.ingest import LOADERS
 
 
 class Command(BaseCommand):
+    """Bulk load a csv file of Language, Country, State or City rows.
+
+    Columns per classname:
+        Language: iso_code, name
+        Country:  iso_code, name_en [, language iso_code]
+        State:    country iso_code, iso_code, name
+        City:     state iso_code, code, name
+    """
+    help = "uploadfile classname filename [--dialect] [--batch-size]"
+
+    def add_arguments(self, parser):
+        parser.add_argument('classname', choices=list(LOADERS))
+        parser.add_argument('filename')
+        parser.add_argument('--dialect', default='excel',
+                            choices=csv.list_dialects())
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--language', default=settings.LANGUAGE_CODE,
+                            help="language of the names in the file")
+        parser.add_argument('--skip-header', action='store_true')
 
-    # uploadfile classname filename
     def handle(self, *args, **options):
-        if args.count == 0:
-            classname = input("classname: ")
-            filename = input("filename: ")
-            dialect = input(f"dialect {csv.list_dialects()}: ")
-        elif args.count == 1:
-            classname = args[0]
-            filename = input("filename: ")
-            dialect = input(f"dialect {csv.list_dialects()}: ")
-        elif args.count == 2:
-            classname = args[0]
-            filename = args[1]
-            dialect = input(f"dialect {csv.list_dialects()}: ")
-        else:
-            classname = args[0]
-            filename = args[1]
-            dialect = args[2]
-
-        # create a set with the values Country,State,City,Language
-        set = {'Country', 'State', 'City', 'Language'}
-        if classname not in set:
-            print("classname must be one of the following: Country,State,City,Language")
-            return
-
-        # read file from operating system
-        with open(csv.reader(filename, dialect=dialect)) as reader:
-            for row in reader:
-                if classname == "Country":
-                    obj = Country.objects.create()
-                    obj.iso_code = row[0]
-                    obj.name_en = row[1]
-                    obj.name = row[0]
-                    obj.save()
-                elif classname == "State":
-
-                    country = Country.objects.get(iso_code=row[0])
-                    obj = State.objects.create()
-                    obj.iso_code = row[1]
-                    obj.name_en = row[2]
-                    obj.name = row[1]
-                    obj.country_id = country.id
-                    obj.save()
-
-                elif classname == "City":
-                    state = State.objects.get(iso_code=row[0])
-                    obj = City.objects.create()
-                    obj.iso_code = row[1]
-                    obj.name_en = row[2]
-                    obj.name = row[1]
-                    obj.state_id = state.id
-                    obj.save()
-
-                elif classname == "Language":
-                    obj = AppLanguage.objects.create()
-                    obj.iso_code = row[0]
-                    obj.name_en = row[1]
-                    obj.name = row[1]
-                    obj.save()
+        loader = LOADERS[options['classname']](
+            batch_size=options['batch_size'], language=options['language'])
+        try:
+            with open(options['filename'], newline='', encoding='utf-8') as file:
+                reader = csv.reader(file, dialect=options['dialect'])
+                if options['skip_header']:
+                    next(reader, None)
+                loader.load(row for row in reader if row)
+        except OSError as error:
+            raise CommandError(error)
+
+        for line, message in loader.errors[:10]:
+            self.stderr.write(f"row {line}: {message}")
+        self.stdout.write(
+            f"{loader.rows} rows: {loader.created} created, {loader.skipped} skipped, "
+            f"{len(loader.errors)} errors in {loader.elapsed:.2f}s "
+            f"({loader.rows_per_sec:,.0f} rows/sec)")
@@ -0,0 +1,59 @@
+"""Project middleware.
+
+The middleware of this module works in a sync and in an async chain. Under
+ASGI a sync only middleware makes Django run the rest of the chain and the
+view in a thread for the whole request, async views included.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+
+from core import querystats, refdata
+
+
+class HybridMiddleware:
+    """Calls call() in a sync chain and acall() in an async one"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # how Django marks its own middleware as a coroutine function,
+            # see MiddlewareMixin._async_check()
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        return self.call(request)
+
+
+class RefDataMiddleware(HybridMiddleware):
+    """Keeps the reference data cached by the process in sync with the
+    changes made by other processes"""
+
+    def call(self, request):
+        refdata.sync()
+        return self.get_response(request)
+
+    async def acall(self, request):
+        # the version is read from the cache, which may be a blocking client
+        await sync_to_async(refdata.sync)()
+        return await self.get_response(request)
+
+
+class QueryStatsMiddleware(HybridMiddleware):
+    """Records the queries and latency of a sample of the requests, see
+    core.querystats"""
+
+    def call(self, request):
+        if not querystats.sampled():
+            return self.get_response(request)
+        return querystats.record(self.get_response, request)
+
+    async def acall(self, request):
+        if not querystats.sampled():
+            return await self.get_response(request)
+        return await querystats.arecord(self.get_response, request)
@@ -0,0 +1,104 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:18
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the price tables are large, build the indexes without blocking writes
+    atomic = False
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='electricityprice',
+            index=models.Index(fields=['city', 'date'], name='elecprice_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='electricityprice',
+            index=models.Index(fields=['country', 'date'], name='elecprice_country_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='foodprice',
+            index=models.Index(fields=['city', 'date'], name='foodprice_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='foodprice',
+            index=models.Index(fields=['country', 'date'], name='foodprice_country_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='foodprice',
+            index=models.Index(fields=['food', 'city', 'date'], name='foodprice_food_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='gasolineprice',
+            index=models.Index(fields=['city', 'date'], name='gasolprice_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='gasolineprice',
+            index=models.Index(fields=['country', 'date'], name='gasolprice_country_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='gasprice',
+            index=models.Index(fields=['city', 'date'], name='gasprice_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='gasprice',
+            index=models.Index(fields=['country', 'date'], name='gasprice_country_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='houseprice',
+            index=models.Index(fields=['city', 'date'], name='houseprice_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='houseprice',
+            index=models.Index(fields=['country', 'date'], name='houseprice_country_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='houseprice',
+            index=models.Index(fields=['house_type', 'city', 'date'], name='houseprice_type_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='internetprice',
+            index=models.Index(fields=['city', 'date'], name='inetprice_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='internetprice',
+            index=models.Index(fields=['country', 'date'], name='inetprice_country_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='medicineprice',
+            index=models.Index(fields=['city', 'date'], name='medprice_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='medicineprice',
+            index=models.Index(fields=['country', 'date'], name='medprice_country_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='medicineprice',
+            index=models.Index(fields=['Medicine', 'city', 'date'], name='medprice_med_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transportprice',
+            index=models.Index(fields=['city', 'date'], name='transprice_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transportprice',
+            index=models.Index(fields=['country', 'date'], name='transprice_country_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='transportprice',
+            index=models.Index(fields=['transport_vendor', 'city', 'date'], name='transprice_vnd_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='waterprice',
+            index=models.Index(fields=['city', 'date'], name='waterprice_city_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='waterprice',
+            index=models.Index(fields=['country', 'date'], name='waterprice_country_date_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_price_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_model', models.CharField(max_length=15)),
+                ('item_id', models.BigIntegerField(default=0)),
+                ('month', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.FloatField(default=0)),
+                ('minimum', models.FloatField(null=True)),
+                ('maximum', models.FloatField(null=True)),
+                ('mean', models.FloatField(null=True)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.city')),
+                ('country', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.country')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='priceaggregate',
+            index=models.Index(fields=['price_model', 'item_id', 'month'], name='price_aggregate_item_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='priceaggregate',
+            constraint=models.UniqueConstraint(fields=('price_model', 'city', 'item_id', 'month'), name='price_aggregate_bucket'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_price_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CostOfLivingIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=15)),
+                ('index', models.FloatField()),
+                ('items', models.IntegerField(default=0)),
+                ('computed_at', models.DateTimeField(db_index=True)),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.city')),
+                ('country', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.country')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='costoflivingindex',
+            index=models.Index(fields=['city', 'category', 'computed_at'], name='col_index_city_idx'),
+        ),
+    ]
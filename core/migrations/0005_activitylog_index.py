@@ -0,0 +1,20 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:31
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # the activity log is large, build the index without blocking writes
+    atomic = False
+
+    dependencies = [
+        ('core', '0004_cost_of_living_index'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='activitylog',
+            index=models.Index(fields=['user', 'activity', 'created_at'], name='activitylog_user_act_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_activitylog_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='country',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='users', to='core.country'),
+        ),
+    ]
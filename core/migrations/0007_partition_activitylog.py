@@ -0,0 +1,81 @@
+from django.db import migrations
+
+# ActivityLog becomes a table partitioned by month of created_at, with the
+# partitions of the months with rows up to 3 months ahead and a default
+# partition. The primary key has to include created_at; the index and
+# constraint names are the ones Django created. New partitions are made by
+# the maintain_partitions command (core.partitions).
+PARTITION_SQL = """
+ALTER TABLE core_activitylog RENAME TO core_activitylog_unpartitioned;
+ALTER TABLE core_activitylog_unpartitioned RENAME CONSTRAINT core_activitylog_pkey TO core_activitylog_unpartitioned_pkey;
+ALTER TABLE core_activitylog_unpartitioned DROP CONSTRAINT core_activitylog_user_id_8705e516_fk_core_user_id;
+DROP INDEX core_activitylog_user_id_8705e516;
+DROP INDEX activitylog_user_act_idx;
+
+CREATE TABLE core_activitylog (
+    id bigint NOT NULL DEFAULT nextval('core_activitylog_id_seq'),
+    activity varchar(30) NOT NULL,
+    points integer NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    user_id bigint NOT NULL,
+    CONSTRAINT core_activitylog_pkey PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+ALTER SEQUENCE core_activitylog_id_seq OWNED BY core_activitylog.id;
+ALTER TABLE core_activitylog ADD CONSTRAINT core_activitylog_user_id_8705e516_fk_core_user_id
+    FOREIGN KEY (user_id) REFERENCES core_user (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX core_activitylog_user_id_8705e516 ON core_activitylog (user_id);
+CREATE INDEX activitylog_user_act_idx ON core_activitylog (user_id, activity, created_at);
+CREATE TABLE core_activitylog_default PARTITION OF core_activitylog DEFAULT;
+
+DO $$
+DECLARE
+    month date;
+BEGIN
+    FOR month IN SELECT m::date FROM generate_series(
+            (SELECT date_trunc('month', coalesce(min(created_at), now()) AT TIME ZONE 'UTC')
+             FROM core_activitylog_unpartitioned),
+            date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months',
+            interval '1 month') AS m
+    LOOP
+        EXECUTE format('CREATE TABLE %I PARTITION OF core_activitylog FOR VALUES FROM (%L) TO (%L)',
+                       'core_activitylog_p' || to_char(month, 'YYYYMM'),
+                       month || ' 00:00:00+00', (month + interval '1 month')::date || ' 00:00:00+00');
+    END LOOP;
+END $$;
+
+INSERT INTO core_activitylog (id, activity, points, created_at, user_id)
+    SELECT id, activity, points, created_at, user_id FROM core_activitylog_unpartitioned;
+DROP TABLE core_activitylog_unpartitioned;
+"""
+
+UNPARTITION_SQL = """
+CREATE TABLE core_activitylog_unpartitioned (
+    id bigint NOT NULL DEFAULT nextval('core_activitylog_id_seq') PRIMARY KEY,
+    activity varchar(30) NOT NULL,
+    points integer NOT NULL,
+    created_at timestamp with time zone NOT NULL,
+    user_id bigint NOT NULL
+);
+INSERT INTO core_activitylog_unpartitioned (id, activity, points, created_at, user_id)
+    SELECT id, activity, points, created_at, user_id FROM core_activitylog;
+ALTER SEQUENCE core_activitylog_id_seq OWNED BY core_activitylog_unpartitioned.id;
+DROP TABLE core_activitylog;
+
+ALTER TABLE core_activitylog_unpartitioned RENAME TO core_activitylog;
+ALTER TABLE core_activitylog RENAME CONSTRAINT core_activitylog_unpartitioned_pkey TO core_activitylog_pkey;
+ALTER TABLE core_activitylog ADD CONSTRAINT core_activitylog_user_id_8705e516_fk_core_user_id
+    FOREIGN KEY (user_id) REFERENCES core_user (id) DEFERRABLE INITIALLY DEFERRED;
+CREATE INDEX core_activitylog_user_id_8705e516 ON core_activitylog (user_id);
+CREATE INDEX activitylog_user_act_idx ON core_activitylog (user_id, activity, created_at);
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_user_country'),
+    ]
+
+    operations = [
+        migrations.RunSQL(PARTITION_SQL, UNPARTITION_SQL),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_partition_activitylog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_model', models.CharField(max_length=15)),
+                ('item_id', models.BigIntegerField(default=0)),
+                ('count', models.IntegerField(default=0)),
+                ('median', models.FloatField(default=0)),
+                ('mad', models.FloatField(default=0)),
+                ('updated_on', models.DateTimeField(auto_now=True)),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.city')),
+                ('country', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.country')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PriceFlag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_model', models.CharField(max_length=15)),
+                ('price_id', models.BigIntegerField()),
+                ('item_id', models.BigIntegerField(default=0)),
+                ('value', models.FloatField()),
+                ('score', models.FloatField()),
+                ('median', models.FloatField()),
+                ('mad', models.FloatField()),
+                ('status', models.CharField(choices=[('flagged', 'Flagged'), ('quarantined', 'Quarantined'), ('accepted', 'Accepted'), ('rejected', 'Rejected')], default='flagged', max_length=12)),
+                ('created_on', models.DateTimeField(auto_now_add=True)),
+                ('reviewed_on', models.DateTimeField(blank=True, null=True)),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.city')),
+                ('reviewed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pricestats',
+            constraint=models.UniqueConstraint(fields=('price_model', 'city', 'item_id'), name='price_stats_key'),
+        ),
+        migrations.AddIndex(
+            model_name='priceflag',
+            index=models.Index(fields=['status', 'created_on'], name='price_flag_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='priceflag',
+            constraint=models.UniqueConstraint(fields=('price_model', 'price_id'), name='price_flag_price'),
+        ),
+    ]
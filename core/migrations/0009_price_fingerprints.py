@@ -0,0 +1,139 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_price_outliers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='electricityprice',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='electricityprice',
+            name='is_duplicate',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='foodprice',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='foodprice',
+            name='is_duplicate',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='gasolineprice',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='gasolineprice',
+            name='is_duplicate',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='gasprice',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='gasprice',
+            name='is_duplicate',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='houseprice',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='houseprice',
+            name='is_duplicate',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='internetprice',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='internetprice',
+            name='is_duplicate',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='medicineprice',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='medicineprice',
+            name='is_duplicate',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='transportprice',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='transportprice',
+            name='is_duplicate',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='waterprice',
+            name='fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True),
+        ),
+        migrations.AddField(
+            model_name='waterprice',
+            name='is_duplicate',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddConstraint(
+            model_name='electricityprice',
+            constraint=models.UniqueConstraint(condition=models.Q(('fingerprint__isnull', False), ('is_duplicate', False)), fields=('fingerprint', 'date'), name='elecprice_fingerprint_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='foodprice',
+            constraint=models.UniqueConstraint(condition=models.Q(('fingerprint__isnull', False), ('is_duplicate', False)), fields=('fingerprint', 'date'), name='foodprice_fingerprint_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='gasolineprice',
+            constraint=models.UniqueConstraint(condition=models.Q(('fingerprint__isnull', False), ('is_duplicate', False)), fields=('fingerprint', 'date'), name='gasolprice_fingerprint_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='gasprice',
+            constraint=models.UniqueConstraint(condition=models.Q(('fingerprint__isnull', False), ('is_duplicate', False)), fields=('fingerprint', 'date'), name='gasprice_fingerprint_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='houseprice',
+            constraint=models.UniqueConstraint(condition=models.Q(('fingerprint__isnull', False), ('is_duplicate', False)), fields=('fingerprint', 'date'), name='houseprice_fingerprint_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='internetprice',
+            constraint=models.UniqueConstraint(condition=models.Q(('fingerprint__isnull', False), ('is_duplicate', False)), fields=('fingerprint', 'date'), name='inetprice_fingerprint_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='medicineprice',
+            constraint=models.UniqueConstraint(condition=models.Q(('fingerprint__isnull', False), ('is_duplicate', False)), fields=('fingerprint', 'date'), name='medprice_fingerprint_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='transportprice',
+            constraint=models.UniqueConstraint(condition=models.Q(('fingerprint__isnull', False), ('is_duplicate', False)), fields=('fingerprint', 'date'), name='transprice_fingerprint_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='waterprice',
+            constraint=models.UniqueConstraint(condition=models.Q(('fingerprint__isnull', False), ('is_duplicate', False)), fields=('fingerprint', 'date'), name='waterprice_fingerprint_uniq'),
+        ),
+    ]
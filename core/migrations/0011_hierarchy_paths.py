@@ -0,0 +1,64 @@
+# Generated by Django 4.0.4 on 2026-10-18 05:17
+
+from django.db import migrations, models
+
+# the paths of core.hierarchy, '<country id>/<state id>/<id>/' for a city
+PATHS_SQL = """
+UPDATE core_city SET path = country_id::text || '/' || state_id::text || '/' || id::text || '/';
+UPDATE core_category SET path = area_id::text || '/' || id::text || '/';
+UPDATE core_food f SET path = c.path || f.id::text || '/' FROM core_category c WHERE c.id = f.category_id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_submission_batches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='food',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='foodprice',
+            name='item_path',
+            field=models.CharField(default='', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='priceaggregate',
+            name='city_path',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='priceaggregate',
+            name='item_path',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['path'], name='category_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='city',
+            index=models.Index(fields=['path'], name='city_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='food',
+            index=models.Index(fields=['path'], name='food_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        # the catalogs are small, the price tables are filled in batches by 0014
+        migrations.RunSQL(PATHS_SQL, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.0.4 on 2026-10-18 05:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_hierarchy_paths'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='costoflivingindex',
+            name='currency',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.RESTRICT, to='core.currency'),
+        ),
+        migrations.AddField(
+            model_name='country',
+            name='currency',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='countries', to='core.currency'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+BATCH = 50000
+# (table, update of the rows of the id range), the paths of the catalogs are set by 0011
+BACKFILL = (
+    ('core_foodprice',
+     "UPDATE core_foodprice p SET item_path = f.path FROM core_food f "
+     "WHERE f.id = p.food_id AND p.item_path <> f.path AND p.id >= %s AND p.id < %s"),
+    ('core_priceaggregate',
+     "UPDATE core_priceaggregate a SET item_path = f.path FROM core_food f "
+     "WHERE a.price_model = 'food' AND f.id = a.item_id AND a.item_path <> f.path "
+     "AND a.id >= %s AND a.id < %s"),
+    ('core_priceaggregate',
+     "UPDATE core_priceaggregate a SET city_path = c.path FROM core_city c "
+     "WHERE c.id = a.city_id AND a.city_path <> c.path AND a.id >= %s AND a.id < %s"),
+)
+
+
+def backfill(apps, schema_editor):
+    """Copies the paths to the price rows and aggregates, BATCH ids per
+    statement. The migration is not atomic, every batch commits and holds
+    its row locks briefly"""
+    with schema_editor.connection.cursor() as cursor:
+        for table, sql in BACKFILL:
+            cursor.execute(f"SELECT min(id), max(id) FROM {table}")
+            low, high = cursor.fetchone()
+            if low is None:
+                continue
+            for start in range(low, high + 1, BATCH):
+                cursor.execute(sql, [start, start + BATCH])
+
+
+class Migration(migrations.Migration):
+    # the price tables are large, fill them in batches and build the indexes
+    # without blocking writes
+    atomic = False
+
+    dependencies = [
+        ('core', '0013_activity_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='foodprice',
+            index=models.Index(fields=['item_path'], name='foodprice_item_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        AddIndexConcurrently(
+            model_name='priceaggregate',
+            index=models.Index(fields=['price_model', 'city_path'], name='price_aggregate_city_path_idx', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']),
+        ),
+        AddIndexConcurrently(
+            model_name='priceaggregate',
+            index=models.Index(fields=['price_model', 'item_path'], name='price_aggregate_item_path_idx', opclasses=['varchar_pattern_ops', 'varchar_pattern_ops']),
+        ),
+    ]
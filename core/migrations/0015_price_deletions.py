@@ -0,0 +1,26 @@
+# Generated by Django 4.0.4 on 2026-10-18 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_hierarchy_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('price_model', models.CharField(max_length=15)),
+                ('price_id', models.BigIntegerField()),
+                ('deleted_on', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pricedeletion',
+            index=models.Index(fields=['price_model', 'deleted_on'], name='price_deletion_idx'),
+        ),
+    ]
@@ -55,6 +55,9 @@ class User(AbstractBaseUser, PermissionsMixin):
     points = models.IntegerField(default=0)
     sex = models.CharField(max_length=1, null=True)
     birth_year = models.IntegerField(null=True)
+    # ranks the user in the leaderboard of the country
+    country = models.ForeignKey('Country', on_delete=models.SET_NULL, null=True, blank=True,
+                                related_name='users')
     created_at = models.DateTimeField(
         auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -67,15 +70,43 @@ class User(AbstractBaseUser, PermissionsMixin):
 
 
 class ActivityLog(models.Model):
+    """Partitioned by month of created_at in the database (see core.partitions),
+    filter on created_at with both bounds to scan only the months needed"""
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     activity = models.CharField(max_length=30)
     points = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # awards count the logs of a user and activity in a day or week
+            models.Index(fields=['user', 'activity', 'created_at'], name='activitylog_user_act_idx'),
+        ]
+
     def __str__(self):
         return f'{self.user.email} Activity Log'
 
 
+class ActivityCounter(models.Model):
+    """ActivityLog rows of a user and activity in one limit window (the UTC
+    day or ISO week starting at start). Maintained by core.awards under the
+    lock of the user row, never edited by hand"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    activity = models.CharField(max_length=30)
+    window = models.CharField(max_length=4)
+    start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'activity', 'window', 'start'],
+                                    name='activity_counter_window'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}:{self.activity}:{self.window}:{self.start}:{self.count}'
+
+
 class Activity(TranslatableModel):
     code = models.CharField(max_length=30)
     translations = TranslatedFields(
@@ -140,6 +171,9 @@ class Country(TranslatableModel):
     name_en = models.CharField(max_length=30, blank=True, default='')
     language = models.ForeignKey(
         AppLanguage, on_delete=models.RESTRICT, related_name='countries')
+    # local currency, the one of the prices without a currency column
+    currency = models.ForeignKey(
+        'Currency', on_delete=models.RESTRICT, related_name='countries', null=True, blank=True)
 
     translations = TranslatedFields(
         name=models.CharField(max_length=30),
@@ -183,6 +217,13 @@ class Category(TranslatableModel):
     translations = TranslatedFields(
         name=models.CharField(max_length=30),
     )
+    # '<area id>/<id>/', see core.hierarchy
+    path = models.CharField(max_length=64, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['path'], opclasses=['varchar_pattern_ops'], name='category_path_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -326,6 +367,8 @@ class Food(TranslatableModel):
     weight_unit = models.ForeignKey('Unit', on_delete=models.RESTRICT)
     weight = models.FloatField(default=0)
     weight_kg = models.FloatField(default=0)
+    # '<area id>/<category id>/<id>/', see core.hierarchy
+    path = models.CharField(max_length=64, default='', editable=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -334,6 +377,11 @@ class Food(TranslatableModel):
     updated_by = models.ForeignKey(
         User, on_delete=models.SET_NULL, related_name='food_changed_by', null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['path'], opclasses=['varchar_pattern_ops'], name='food_path_idx'),
+        ]
+
     def __str__(self):
         return f'{self.name} ({self.food_storage.name})'
 
@@ -420,6 +468,8 @@ class City(TranslatableModel):
     translations = TranslatedFields(
         name=models.CharField(max_length=30),
     )
+    # '<country id>/<state id>/<id>/', see core.hierarchy
+    path = models.CharField(max_length=64, default='', editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey(
@@ -429,6 +479,11 @@ class City(TranslatableModel):
         settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
         related_name='city_changed_by')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['path'], opclasses=['varchar_pattern_ops'], name='city_path_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -541,11 +596,25 @@ class ElectricityPrice(models.Model):
     period_days = models.IntegerField()
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+    # md5 of the content and duplicate flag, see core.fingerprint
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    is_duplicate = models.BooleanField(default=False, editable=False)
     created_by = models.ForeignKey(
         User, related_name='electricity_price_created_by', on_delete=models.RESTRICT, null=True, blank=True)
     updated_by = models.ForeignKey(
         User, related_name='electricity_price_changed_by', on_delete=models.RESTRICT, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'date'], name='elecprice_city_date_idx'),
+            models.Index(fields=['country', 'date'], name='elecprice_country_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'date'],
+                                    condition=models.Q(is_duplicate=False, fingerprint__isnull=False),
+                                    name='elecprice_fingerprint_uniq'),
+        ]
+
     def category(self):
         return 'services'
 
@@ -576,11 +645,25 @@ class gasPrice(models.Model):
 
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+    # md5 of the content and duplicate flag, see core.fingerprint
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    is_duplicate = models.BooleanField(default=False, editable=False)
     created_by = models.ForeignKey(
         User, on_delete=models.RESTRICT, null=True, blank=True, related_name='gas_price_created_by')
     updated_by = models.ForeignKey(
         User, on_delete=models.RESTRICT, null=True, blank=True, related_name='gas_price_changed_by')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'date'], name='gasprice_city_date_idx'),
+            models.Index(fields=['country', 'date'], name='gasprice_country_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'date'],
+                                    condition=models.Q(is_duplicate=False, fingerprint__isnull=False),
+                                    name='gasprice_fingerprint_uniq'),
+        ]
+
     def category(self):
         return 'services'
 
@@ -612,11 +695,25 @@ class InternetPrice(models.Model):
 
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+    # md5 of the content and duplicate flag, see core.fingerprint
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    is_duplicate = models.BooleanField(default=False, editable=False)
     created_by = models.ForeignKey(
         User, related_name='inet_price_created_by', on_delete=models.RESTRICT, null=True, blank=True)
     updated_by = models.ForeignKey(
         User, related_name='inet_price_changed_by', on_delete=models.RESTRICT, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'date'], name='inetprice_city_date_idx'),
+            models.Index(fields=['country', 'date'], name='inetprice_country_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'date'],
+                                    condition=models.Q(is_duplicate=False, fingerprint__isnull=False),
+                                    name='inetprice_fingerprint_uniq'),
+        ]
+
     def category(self):
         return 'services'
 
@@ -654,6 +751,25 @@ class FoodPrice(models.Model):
         related_name='food_price_changed_by')
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+    # md5 of the content and duplicate flag, see core.fingerprint
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    is_duplicate = models.BooleanField(default=False, editable=False)
+    # path of the food, copied by core.hierarchy
+    item_path = models.CharField(max_length=64, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'date'], name='foodprice_city_date_idx'),
+            models.Index(fields=['country', 'date'], name='foodprice_country_date_idx'),
+            models.Index(fields=['food', 'city', 'date'], name='foodprice_food_city_date_idx'),
+            models.Index(fields=['item_path'], opclasses=['varchar_pattern_ops'],
+                         name='foodprice_item_path_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'date'],
+                                    condition=models.Q(is_duplicate=False, fingerprint__isnull=False),
+                                    name='foodprice_fingerprint_uniq'),
+        ]
 
     def category(self):
         return "food"
@@ -701,6 +817,21 @@ class housePrice(models.Model):
         related_name='house_price_changed_by')
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+    # md5 of the content and duplicate flag, see core.fingerprint
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    is_duplicate = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'date'], name='houseprice_city_date_idx'),
+            models.Index(fields=['country', 'date'], name='houseprice_country_date_idx'),
+            models.Index(fields=['house_type', 'city', 'date'], name='houseprice_type_city_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'date'],
+                                    condition=models.Q(is_duplicate=False, fingerprint__isnull=False),
+                                    name='houseprice_fingerprint_uniq'),
+        ]
 
     def category(self):
         return "housing"
@@ -736,6 +867,20 @@ class gasolinePrice(models.Model):
         related_name='gasoline_price_changed_by')
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+    # md5 of the content and duplicate flag, see core.fingerprint
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    is_duplicate = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'date'], name='gasolprice_city_date_idx'),
+            models.Index(fields=['country', 'date'], name='gasolprice_country_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'date'],
+                                    condition=models.Q(is_duplicate=False, fingerprint__isnull=False),
+                                    name='gasolprice_fingerprint_uniq'),
+        ]
 
     def category(self):
         return "transport"
@@ -809,6 +954,21 @@ class TransportPrice(models.Model):
         User, on_delete=models.SET_NULL, null=True, blank=True, related_name='transport_price_changed_by')
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+    # md5 of the content and duplicate flag, see core.fingerprint
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    is_duplicate = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'date'], name='transprice_city_date_idx'),
+            models.Index(fields=['country', 'date'], name='transprice_country_date_idx'),
+            models.Index(fields=['transport_vendor', 'city', 'date'], name='transprice_vnd_city_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'date'],
+                                    condition=models.Q(is_duplicate=False, fingerprint__isnull=False),
+                                    name='transprice_fingerprint_uniq'),
+        ]
 
     def category(self):
         return "transport"
@@ -844,6 +1004,21 @@ class MedicinePrice(models.Model):
         User, on_delete=models.RESTRICT, null=True, blank=True, related_name='medicine_price_changed_by')
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+    # md5 of the content and duplicate flag, see core.fingerprint
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    is_duplicate = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'date'], name='medprice_city_date_idx'),
+            models.Index(fields=['country', 'date'], name='medprice_country_date_idx'),
+            models.Index(fields=['Medicine', 'city', 'date'], name='medprice_med_city_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'date'],
+                                    condition=models.Q(is_duplicate=False, fingerprint__isnull=False),
+                                    name='medprice_fingerprint_uniq'),
+        ]
 
     def category(self):
         return "health"
@@ -878,11 +1053,25 @@ class waterPrice(models.Model):
 
     created_on = models.DateTimeField(auto_now_add=True)
     updated_on = models.DateTimeField(auto_now=True)
+    # md5 of the content and duplicate flag, see core.fingerprint
+    fingerprint = models.CharField(max_length=32, null=True, blank=True, editable=False)
+    is_duplicate = models.BooleanField(default=False, editable=False)
     created_by = models.ForeignKey(
         User, on_delete=models.RESTRICT, null=True, blank=True, related_name='water_price_created_by')
     updated_by = models.ForeignKey(
         User, on_delete=models.RESTRICT, null=True, blank=True, related_name='water_price_changed_by')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'date'], name='waterprice_city_date_idx'),
+            models.Index(fields=['country', 'date'], name='waterprice_country_date_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['fingerprint', 'date'],
+                                    condition=models.Q(is_duplicate=False, fingerprint__isnull=False),
+                                    name='waterprice_fingerprint_uniq'),
+        ]
+
     def category(self):
         return "services"
 
@@ -899,3 +1088,163 @@ class waterPrice(models.Model):
         else:
             obj.updated_by = request.user
             super().save_model(request, obj, form, change)
+
+
+# ===============================================================================
+# Analytics
+# ===============================================================================
+
+
+class PriceAggregate(models.Model):
+    """Monthly statistics of the comparable price of a price model per city
+    and item. Maintained by core.aggregates, never edited by hand"""
+    price_model = models.CharField(max_length=15)
+    country = models.ForeignKey(Country, on_delete=models.CASCADE)
+    city = models.ForeignKey(City, on_delete=models.CASCADE)
+    # 0 for the price models without an item
+    item_id = models.BigIntegerField(default=0)
+    month = models.DateField()
+    count = models.IntegerField(default=0)
+    total = models.FloatField(default=0)
+    minimum = models.FloatField(null=True)
+    maximum = models.FloatField(null=True)
+    mean = models.FloatField(null=True)
+    updated_on = models.DateTimeField(auto_now=True)
+    # paths of the city and of the item, '' for items without one, see core.hierarchy
+    city_path = models.CharField(max_length=64, default='')
+    item_path = models.CharField(max_length=64, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['price_model', 'city', 'item_id', 'month'],
+                                    name='price_aggregate_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['price_model', 'item_id', 'month'], name='price_aggregate_item_idx'),
+            models.Index(fields=['price_model', 'city_path'], opclasses=['varchar_pattern_ops'] * 2,
+                         name='price_aggregate_city_path_idx'),
+            models.Index(fields=['price_model', 'item_path'], opclasses=['varchar_pattern_ops'] * 2,
+                         name='price_aggregate_item_path_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.price_model}:{self.city_id}:{self.item_id}:{self.month}:{self.mean}'
+
+
+class CostOfLivingIndex(models.Model):
+    """Cost of living index of a city, 100 is the median city.
+    category is a price model key or 'all' for the weighted basket of every
+    category, currency the one prices were converted to before comparing.
+    Every run of core.costofliving adds rows with its computed_at"""
+    country = models.ForeignKey(Country, on_delete=models.CASCADE)
+    city = models.ForeignKey(City, on_delete=models.CASCADE)
+    category = models.CharField(max_length=15)
+    currency = models.ForeignKey(Currency, on_delete=models.RESTRICT, null=True)
+    index = models.FloatField()
+    items = models.IntegerField(default=0)
+    computed_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'category', 'computed_at'], name='col_index_city_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.city_id}:{self.category}:{self.index}'
+
+
+class PriceStats(models.Model):
+    """Running median and median absolute deviation of the log comparable
+    price of a price model per city and item, estimated one observation at a
+    time. Maintained by core.outliers, never edited by hand"""
+    price_model = models.CharField(max_length=15)
+    country = models.ForeignKey(Country, on_delete=models.CASCADE)
+    city = models.ForeignKey(City, on_delete=models.CASCADE)
+    # 0 for the price models without an item
+    item_id = models.BigIntegerField(default=0)
+    count = models.IntegerField(default=0)
+    median = models.FloatField(default=0)
+    mad = models.FloatField(default=0)
+    updated_on = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['price_model', 'city', 'item_id'], name='price_stats_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.price_model}:{self.city_id}:{self.item_id}:{self.median}'
+
+
+class PriceFlag(models.Model):
+    """A price row scored outside the bounds of its PriceStats.
+    Quarantined rows are left out of PriceAggregate until accepted"""
+    FLAGGED = 'flagged'
+    QUARANTINED = 'quarantined'
+    ACCEPTED = 'accepted'
+    REJECTED = 'rejected'
+    STATUSES = [(FLAGGED, 'Flagged'), (QUARANTINED, 'Quarantined'),
+                (ACCEPTED, 'Accepted'), (REJECTED, 'Rejected')]
+
+    price_model = models.CharField(max_length=15)
+    price_id = models.BigIntegerField()
+    city = models.ForeignKey(City, on_delete=models.CASCADE)
+    item_id = models.BigIntegerField(default=0)
+    value = models.FloatField()
+    # robust z score of the log value against the statistics at write time
+    score = models.FloatField()
+    median = models.FloatField()
+    mad = models.FloatField()
+    status = models.CharField(max_length=12, choices=STATUSES, default=FLAGGED)
+    created_on = models.DateTimeField(auto_now_add=True)
+    reviewed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    reviewed_on = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['price_model', 'price_id'], name='price_flag_price'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'created_on'], name='price_flag_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.price_model}:{self.price_id}:{self.status}'
+
+
+class PriceDeletion(models.Model):
+    """A deleted price row, so incremental Parquet snapshots (core.snapshot)
+    drop it. Recorded by core.signals for ORM deletes"""
+    price_model = models.CharField(max_length=15)
+    price_id = models.BigIntegerField()
+    deleted_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price_model', 'deleted_on'], name='price_deletion_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.price_model}:{self.price_id}'
+
+
+class SubmissionBatch(models.Model):
+    """A batch of price rows submitted under an idempotency key. A retry with
+    the same key gets the stored response instead of writing the rows again.
+    Maintained by core.submissions"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='submission_batches')
+    key = models.CharField(max_length=64)
+    # md5 of the request body, a key can not be reused for another batch
+    request_hash = models.CharField(max_length=32)
+    rows = models.IntegerField(default=0)
+    created = models.IntegerField(default=0)
+    response = models.JSONField(default=dict)
+    created_on = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='submission_batch_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}:{self.key}:{self.created}/{self.rows}'
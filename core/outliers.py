@@ -0,0 +1,239 @@
+"""Robust outlier screening of submitted prices.
+
+Every (price model, city, item) has a PriceStats row with a running median
+and median absolute deviation (MAD) of the log comparable price. Logs make a
+price 100 times too high as far from the median as one 100 times too low.
+A new row scores |log value - median| / (1.4826 * MAD), a z score that a few
+wild values can not inflate. Rows scoring above OUTLIER_THRESHOLD get a
+PriceFlag and are not folded into the statistics, the others move the
+estimates one bounded step towards them, so screening a row reads and
+writes one PriceStats row whatever the history.
+
+OUTLIER_MODE is 'flag' (the row counts as usual, the flag is for review),
+'quarantine' (the row is left out of PriceAggregate until its flag is
+accepted) or 'off'. OUTLIER_MODELS lists the screened price models.
+
+The signal receivers in core.signals call screen() for ORM writes, bulk
+loaders call screen_rows(), which scores a whole load with numpy per
+(city, item). rebuild() seeds the statistics with the exact median and MAD
+of the rows already stored.
+"""
+import math
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import PriceFlag, PriceStats
+
+FLAG = 'flag'
+QUARANTINE = 'quarantine'
+OFF = 'off'
+DEFAULT_MODELS = ('food', 'medicine')
+DEFAULT_THRESHOLD = 6.0
+DEFAULT_MIN_COUNT = 10
+DEFAULT_RATE = 0.02
+# MAD of a normal distribution is 1 / 1.4826 of its standard deviation
+MAD_SCALE = 1.4826
+# floor of the MAD in log units (about 5%), so identical prices do not make
+# the next slightly different one an outlier
+MIN_MAD = 0.05
+STATS_TABLE = PriceStats._meta.db_table
+FLAG_TABLE = PriceFlag._meta.db_table
+
+
+def mode():
+    return getattr(settings, 'OUTLIER_MODE', FLAG)
+
+
+def threshold():
+    return getattr(settings, 'OUTLIER_THRESHOLD', DEFAULT_THRESHOLD)
+
+
+def min_count():
+    """Observations a key needs before its rows are scored"""
+    return getattr(settings, 'OUTLIER_MIN_COUNT', DEFAULT_MIN_COUNT)
+
+
+def enabled(spec):
+    return mode() != OFF and spec.key in getattr(settings, 'OUTLIER_MODELS', DEFAULT_MODELS)
+
+
+def scores(logs, median, mad):
+    """Robust z scores of log values"""
+    return np.abs(np.asarray(logs, dtype=np.float64) - median) / (MAD_SCALE * max(mad, MIN_MAD))
+
+
+def _towards(estimate, observations, step):
+    """Moves estimate by step per observation above it, minus step per
+    observation below, without passing the median of the observations"""
+    target = float(np.median(observations))
+    moved = estimate + step * float(np.sign(observations - estimate).sum())
+    low, high = sorted((estimate, target))
+    return min(max(moved, low), high)
+
+
+def estimate(count, median, mad, logs):
+    """Folds log values into (count, median, mad) and returns the new triple.
+
+    A key without observations starts from the exact median and MAD of logs.
+    After that both estimates move by a step proportional to the spread,
+    shrinking as 1 / count down to OUTLIER_RATE so they keep following slow
+    price changes"""
+    logs = np.asarray(logs, dtype=np.float64)
+    if not len(logs):
+        return count, median, mad
+    if not count:
+        median = float(np.median(logs))
+        return len(logs), median, float(np.median(np.abs(logs - median)))
+    rate = max(1 / (count + 1), getattr(settings, 'OUTLIER_RATE', DEFAULT_RATE))
+    step = rate * max(mad, MIN_MAD)
+    median = _towards(median, logs, step)
+    mad = _towards(mad, np.abs(logs - median), step)
+    return count + len(logs), median, mad
+
+
+def flag_status():
+    return PriceFlag.QUARANTINED if mode() == QUARANTINE else PriceFlag.FLAGGED
+
+
+def screen(spec, obj):
+    """Scores a new price row against its statistics. Flags it when it is an
+    outlier, folds it into the statistics otherwise. Returns the PriceFlag
+    or None"""
+    if not enabled(spec):
+        return None
+    value = spec.value_of(obj)
+    if value is None or value <= 0 or obj.is_duplicate:
+        return None
+    item_id = getattr(obj, spec.item_column) if spec.item_column else 0
+    log = math.log(value)
+    with transaction.atomic():
+        # the row lock serializes the submissions of a key
+        stats, _ = PriceStats.objects.select_for_update().get_or_create(
+            price_model=spec.key, city_id=obj.city_id, item_id=item_id,
+            defaults={'country_id': obj.country_id})
+        if stats.count >= min_count():
+            score = float(scores(log, stats.median, stats.mad))
+            if score > threshold():
+                return PriceFlag.objects.create(
+                    price_model=spec.key, price_id=obj.pk, city_id=obj.city_id, item_id=item_id,
+                    value=value, score=score, median=stats.median, mad=stats.mad,
+                    status=flag_status())
+        stats.count, stats.median, stats.mad = estimate(stats.count, stats.median, stats.mad, [log])
+        stats.save(update_fields=['count', 'median', 'mad', 'updated_on'])
+    return None
+
+
+def screen_rows(spec, source, where='true', params=()):
+    """Screens the rows of source (a relation with the columns and ids of the
+    price table) matching where, vectorized per (city, item): every row of a
+    key is scored against the statistics as they were before the load, the
+    inliers are then folded in at once. Returns the number of flagged rows"""
+    if not enabled(spec):
+        return 0
+    item = spec.item_sql('p')
+    value = spec.value_sql('p')
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT p.id, p.country_id, p.city_id, {item}, {value} FROM {source} p "
+                       f"WHERE {value} > 0 AND NOT p.is_duplicate AND {where} ORDER BY p.id", params)
+        rows = cursor.fetchall()
+    if not rows:
+        return 0
+    ids, countries, cities, items = (np.array(column, dtype=np.int64) for column in list(zip(*rows))[:4])
+    values = np.array([row[4] for row in rows], dtype=np.float64)
+    logs = np.log(values)
+    keys, inverse = np.unique(np.stack([cities, items], axis=1), axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    order = np.argsort(inverse, kind='stable')
+    groups = np.split(order, np.cumsum(np.bincount(inverse))[:-1])
+
+    stored = PriceStats.objects.select_for_update().filter(
+        price_model=spec.key, city_id__in=np.unique(cities).tolist(), item_id__in=np.unique(items).tolist())
+    stored = {(stats.city_id, stats.item_id): stats for stats in stored}
+    limit, bound, status, now = min_count(), threshold(), flag_status(), timezone.now()
+    created, updated, flags = [], [], []
+    for (city, item_id), group in zip(keys.tolist(), groups):
+        stats = stored.get((city, item_id))
+        if stats is None:
+            stats = PriceStats(price_model=spec.key, country_id=int(countries[group[0]]), city_id=city,
+                               item_id=item_id)
+            created.append(stats)
+        else:
+            updated.append(stats)
+        group_logs = logs[group]
+        if stats.count >= limit:
+            reference = stats.median, stats.mad
+        elif not stats.count and len(group) >= limit:
+            # a new key is screened against the load itself
+            reference = estimate(0, 0.0, 0.0, group_logs)[1:]
+        else:
+            reference = None
+        outliers = np.zeros(len(group), dtype=bool)
+        if reference:
+            row_scores = scores(group_logs, *reference)
+            outliers = row_scores > bound
+            flags.extend(PriceFlag(price_model=spec.key, price_id=int(ids[row]), city_id=city,
+                                   item_id=item_id, value=float(values[row]), score=float(score),
+                                   median=reference[0], mad=reference[1], status=status)
+                         for row, score in zip(group[outliers], row_scores[outliers]))
+        stats.count, stats.median, stats.mad = estimate(
+            stats.count, stats.median, stats.mad, group_logs[~outliers])
+        stats.updated_on = now
+
+    PriceStats.objects.bulk_create(created, ignore_conflicts=True)
+    PriceStats.objects.bulk_update(updated, ['count', 'median', 'mad', 'updated_on'])
+    PriceFlag.objects.bulk_create(flags, ignore_conflicts=True)
+    return len(flags)
+
+
+def quarantined_sql(spec, alias='p'):
+    """SQL condition true for the rows of alias held in quarantine. Has one
+    parameter, spec.key"""
+    return (f"EXISTS (SELECT 1 FROM {FLAG_TABLE} f WHERE f.price_model = %s "
+            f"AND f.price_id = {alias}.id AND f.status = '{PriceFlag.QUARANTINED}')")
+
+
+def rebuild(spec):
+    """Seeds the statistics of a price model with the exact median and MAD of
+    its stored rows, duplicates and flagged rows excluded. Returns the number of keys"""
+    item = spec.item_sql('p')
+    value = spec.value_sql('p')
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {STATS_TABLE} WHERE price_model = %s", [spec.key])
+        cursor.execute(
+            f"WITH logs AS (SELECT p.country_id, p.city_id, {item} AS item_id, ln({value}) AS y "
+            f"FROM {spec.table} p WHERE {value} > 0 AND NOT p.is_duplicate "
+            f"AND NOT EXISTS (SELECT 1 FROM {FLAG_TABLE} f WHERE f.price_model = %s AND f.price_id = p.id AND f.status <> '{PriceFlag.ACCEPTED}')), "
+            f"medians AS (SELECT country_id, city_id, item_id, count(*) AS n, "
+            f"percentile_cont(0.5) WITHIN GROUP (ORDER BY y) AS median FROM logs GROUP BY 1, 2, 3) "
+            f"INSERT INTO {STATS_TABLE} (price_model, country_id, city_id, item_id, count, median, mad, "
+            f"updated_on) SELECT %s, m.country_id, m.city_id, m.item_id, m.n, m.median, "
+            f"percentile_cont(0.5) WITHIN GROUP (ORDER BY abs(l.y - m.median)), now() "
+            f"FROM medians m JOIN logs l ON l.city_id = m.city_id AND l.item_id = m.item_id "
+            f"GROUP BY m.country_id, m.city_id, m.item_id, m.n, m.median",
+            [spec.key, spec.key])
+        return cursor.rowcount
+
+
+def review(flag, status, user=None):
+    """Accepts or rejects a flag. An accepted quarantined row joins its
+    aggregates, a rejected row is deleted"""
+    from core import aggregates
+    from core.prices import get_spec
+
+    spec = get_spec(flag.price_model)
+    with transaction.atomic():
+        was_quarantined = flag.status == PriceFlag.QUARANTINED
+        flag.status = status
+        flag.reviewed_by = user
+        flag.reviewed_on = timezone.now()
+        flag.save(update_fields=['status', 'reviewed_by', 'reviewed_on'])
+        price = spec.model.objects.filter(pk=flag.price_id).first()
+        if price is None:
+            return
+        if status == PriceFlag.REJECTED:
+            price.delete()
+        elif was_quarantined:
+            aggregates.refresh(spec, [aggregates.bucket(spec, price)])
@@ -0,0 +1,74 @@
+"""Keyset pagination for the price API.
+
+Pages are ordered newest first on (date, id) and the cursor carries the
+(date, id) of the last row served, so every page is an index range scan
+of page_size rows no matter how deep the client has paged. OFFSET would
+read and discard all the previous rows.
+"""
+import base64
+from datetime import date
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    page_size = 100
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    date_field = 'date'
+    ordering = ('-date', '-id')
+
+    @classmethod
+    def encode_cursor(cls, row):
+        value = getattr(row, cls.date_field).isoformat()
+        return base64.urlsafe_b64encode(f'{value},{row.id}'.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            value, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split(',')
+            return date.fromisoformat(value), int(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            last_date, last_id = self.decode_cursor(cursor)
+            # date <= last_date is the index condition, the rest a cheap filter
+            field = self.date_field
+            queryset = queryset.filter(Q(**{f'{field}__lt': last_date}) | Q(id__lt=last_id),
+                                       **{f'{field}__lte': last_date})
+        rows = list(queryset[:size + 1])
+        self.next_cursor = self.encode_cursor(rows[size - 1]) if len(rows) > size else None
+        return rows[:size]
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+
+class MonthKeysetPagination(KeysetPagination):
+    """Keyset pagination of the monthly aggregates"""
+    date_field = 'month'
+    ordering = ('-month', '-id')
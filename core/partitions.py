@@ -0,0 +1,338 @@
+"""Range partitions of PostgreSQL tables by month or year.
+
+A partitioned table has one partition per period (calendar month or year,
+UTC) of its partition column, named <table>_pYYYYMM or <table>_pYYYY, and a
+<table>_default partition catching rows of periods without one, so a missing
+partition never fails an insert. Queries filtering on the partition column
+only scan the partitions of the periods they ask for.
+
+The maintain_partitions command creates the partitions of the coming
+periods and detaches or archives the ones older than the retention window
+of each table of partitioned_tables(): ActivityLog and the price models
+opted in with settings.PARTITIONED_PRICES (see partition_prices).
+"""
+import gzip
+import os
+import re
+from datetime import date
+
+from django.conf import settings
+from django.db import connection, transaction
+
+INTERVALS = ('month', 'year')
+
+
+class PartitionedTable:
+    """A table partitioned by month or year on column"""
+
+    def __init__(self, table, column, interval='month', timestamp=True,
+                 retention_setting=None, default_retention=0, prefix=None):
+        if interval not in INTERVALS:
+            raise ValueError(f"interval must be one of {', '.join(INTERVALS)}")
+        self.table = table
+        self.column = column
+        self.interval = interval
+        # timestamp with time zone column, date otherwise
+        self.timestamp = timestamp
+        # months of data kept attached, 0 keeps everything
+        self.retention_setting = retention_setting
+        self.default_retention = default_retention
+        # partitions are named after prefix, the table by default
+        self.prefix = prefix or table
+
+    def __str__(self):
+        return self.table
+
+    @property
+    def retention(self):
+        if self.retention_setting:
+            return getattr(settings, self.retention_setting, self.default_retention)
+        return self.default_retention
+
+    @property
+    def default_partition(self):
+        return f'{self.prefix}_default'
+
+    def period_start(self, day):
+        return day.replace(month=1, day=1) if self.interval == 'year' else day.replace(day=1)
+
+    def add_periods(self, start, periods):
+        return add_months(start, periods * 12 if self.interval == 'year' else periods)
+
+    def partition_name(self, start):
+        if self.interval == 'year':
+            return f'{self.prefix}_p{start:%Y}'
+        return f'{self.prefix}_p{start:%Y%m}'
+
+    def bound(self, start):
+        """Partition bound literal of the first instant of a period in UTC"""
+        if self.timestamp:
+            return f"'{start.isoformat()} 00:00:00+00'"
+        return f"'{start.isoformat()}'"
+
+
+ACTIVITY_LOG = PartitionedTable('core_activitylog', 'created_at',
+                                retention_setting='ACTIVITY_LOG_RETENTION_MONTHS',
+                                default_retention=24)
+
+
+def price_table(spec, interval, **kwargs):
+    """PartitionedTable of a price model partitioned by date"""
+    return PartitionedTable(spec.table, 'date', interval, timestamp=False, **kwargs)
+
+
+def partitioned_tables():
+    """{key: PartitionedTable} of the tables kept partitioned"""
+    from core.prices import get_spec
+    tables = {'activitylog': ACTIVITY_LOG}
+    for key, interval in getattr(settings, 'PARTITIONED_PRICES', {}).items():
+        tables[key] = price_table(get_spec(key), interval)
+    return tables
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+
+def is_partitioned(table):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+        return cursor.fetchone() is not None
+
+
+def partitions(partitioned):
+    """{period start: partition name} of the partitions attached to the table"""
+    pattern = re.compile(rf'^{re.escape(partitioned.prefix)}_p(\d{{4}})(\d{{2}})?$')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass", [partitioned.table])
+        names = [name for name, in cursor.fetchall()]
+    found = {}
+    for name in names:
+        match = pattern.match(name)
+        if match:
+            found[date(int(match.group(1)), int(match.group(2) or 1), 1)] = name
+    return dict(sorted(found.items()))
+
+
+def create(partitioned, day):
+    """Creates the partition of the period of day, moving its rows out of the
+    default partition. Returns False when it already exists"""
+    start = partitioned.period_start(day)
+    if start in partitions(partitioned):
+        return False
+    name = partitioned.partition_name(start)
+    table, column = partitioned.table, partitioned.column
+    lower, upper = partitioned.bound(start), partitioned.bound(partitioned.add_periods(start, 1))
+    with transaction.atomic(), connection.cursor() as cursor:
+        # attaching a filled table instead of CREATE ... PARTITION OF works
+        # even when the default partition has rows of that period
+        cursor.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {partitioned.default_partition} "
+            f"WHERE {column} >= {lower} AND {column} < {upper} RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved")
+        cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} "
+                       f"FOR VALUES FROM ({lower}) TO ({upper})")
+    return True
+
+
+def ensure(partitioned, today, ahead=3):
+    """Creates the partitions of this period and the ahead next ones.
+    Returns the names of the partitions created"""
+    start = partitioned.period_start(today)
+    periods = [partitioned.add_periods(start, offset) for offset in range(ahead + 1)]
+    return [partitioned.partition_name(period) for period in periods if create(partitioned, period)]
+
+
+def expired(partitioned, today, retention=None):
+    """{period start: name} of the partitions ending before the retention
+    window of months"""
+    retention = partitioned.retention if retention is None else retention
+    if not retention:
+        return {}
+    oldest = add_months(today.replace(day=1), -retention)
+    return {start: name for start, name in partitions(partitioned).items()
+            if partitioned.add_periods(start, 1) <= oldest}
+
+
+def detach(partitioned, name):
+    """Detaches a partition, it is kept as a plain table"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {partitioned.table} DETACH PARTITION {name}")
+
+
+def archive(partitioned, name, directory):
+    """Detaches a partition, writes its rows to <directory>/<name>.csv.gz and
+    drops it. Returns (path, rows)"""
+    path = os.path.join(directory, f'{name}.csv.gz')
+    with transaction.atomic():
+        detach(partitioned, name)
+        with connection.cursor() as cursor, gzip.open(path, 'wt', encoding='utf-8') as file:
+            cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", file)
+            rows = cursor.rowcount
+            # deferred foreign key checks of rows written in this transaction
+            # would block the DROP
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(f"DROP TABLE {name}")
+    return path, rows
+
+
+# comment of a partitioned copy: prefix of the last id copied
+COPIED = 'copied up to id '
+
+
+class OnlinePartitioning:
+    """Moves a plain table with an id primary key into a partitioned copy
+    while the application keeps writing to it.
+
+    prepare() creates <table>_partitioned with the columns, constraints and
+    indexes of the table, its partitions and a trigger on the table that
+    mirrors every insert, update and delete into the copy. copy_batch()
+    copies the next range of ids, locking the rows (FOR SHARE) so updates
+    running meanwhile wait for the copy instead of racing it, and records
+    the last id copied in the comment of the copy, so an interrupted
+    conversion resumes from copied_id(). The highest id of the copy can not
+    tell, the trigger adds new and updated rows above and below the copied
+    range. swap() renames
+    the tables in one short transaction; the original is kept as
+    <table>_unpartitioned until it is dropped by hand. TRUNCATE is not
+    mirrored, do not truncate the table while it is converted.
+    """
+
+    def __init__(self, partitioned):
+        self.partitioned = partitioned
+        self.table = partitioned.table
+        self.shadow = f'{self.table}_partitioned'
+        self.old = f'{self.table}_unpartitioned'
+        self.trigger = f'{self.table}_partition_sync'
+
+    @property
+    def shadow_table(self):
+        partitioned = self.partitioned
+        return PartitionedTable(self.shadow, partitioned.column, partitioned.interval,
+                                partitioned.timestamp, prefix=self.table)
+
+    def prepared(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [self.shadow])
+            return cursor.fetchone()[0] is not None
+
+    def indexes(self, cursor, table):
+        """[(name, definition)] of the indexes of table but its primary key.
+        Unique indexes must contain the partition column"""
+        cursor.execute(
+            "SELECT c.relname, pg_get_indexdef(i.indexrelid), i.indisunique AND NOT EXISTS ("
+            "SELECT 1 FROM pg_attribute a WHERE a.attrelid = i.indrelid AND a.attname = %s "
+            "AND a.attnum = ANY(i.indkey::int2[])) FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = %s::regclass AND NOT i.indisprimary ORDER BY 1",
+            [self.partitioned.column, table])
+        rows = cursor.fetchall()
+        unique = [name for name, _, unpartitionable in rows if unpartitionable]
+        if unique:
+            raise ValueError(f"unique indexes {', '.join(unique)} do not contain the partition key")
+        return [(name, definition) for name, definition, _ in rows]
+
+    def prepare(self, today, ahead=3):
+        """Creates the partitioned copy, its partitions and the sync trigger.
+        Returns False when it was already prepared"""
+        if self.prepared():
+            return False
+        table, shadow, column = self.table, self.shadow, self.partitioned.column
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SELECT conrelid::regclass::text FROM pg_constraint "
+                           "WHERE confrelid = %s::regclass AND contype = 'f'", [table])
+            referencing = [name for name, in cursor.fetchall()]
+            if referencing:
+                raise ValueError(f"{', '.join(referencing)} reference {table}, drop those keys first")
+            cursor.execute(
+                f"CREATE TABLE {shadow} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS, "
+                f"PRIMARY KEY (id, {column})) PARTITION BY RANGE ({column})")
+            cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                           "WHERE conrelid = %s::regclass AND contype = 'f'", [table])
+            for name, definition in cursor.fetchall():
+                cursor.execute(f"ALTER TABLE {shadow} ADD CONSTRAINT {name} {definition}")
+            for name, definition in self.indexes(cursor, table):
+                definition = definition.replace(f'INDEX {name} ON ', f'INDEX {name}_p ON ', 1)
+                cursor.execute(re.sub(rf' ON (\S+\.)?{table} USING ', f' ON {shadow} USING ',
+                                      definition, count=1))
+            cursor.execute(f"CREATE TABLE {self.shadow_table.default_partition} "
+                           f"PARTITION OF {shadow} DEFAULT")
+
+            cursor.execute(f"SELECT min({column}), max({column}) FROM {table}")
+            first, last = cursor.fetchone()
+            partitioned = self.shadow_table
+            start = partitioned.period_start(first or today)
+            end = partitioned.add_periods(partitioned.period_start(max(last or today, today)), ahead)
+            while start <= end:
+                create(partitioned, start)
+                start = partitioned.add_periods(start, 1)
+
+            cursor.execute(f"""
+                CREATE FUNCTION {self.trigger}() RETURNS trigger LANGUAGE plpgsql AS $$
+                BEGIN
+                    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                        DELETE FROM {shadow} WHERE id = OLD.id AND {column} = OLD.{column};
+                    END IF;
+                    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                        INSERT INTO {shadow} SELECT NEW.*;
+                    END IF;
+                    RETURN NULL;
+                END $$""")
+            cursor.execute(f"CREATE TRIGGER {self.trigger} AFTER INSERT OR UPDATE OR DELETE ON {table} "
+                           f"FOR EACH ROW EXECUTE FUNCTION {self.trigger}()")
+        return True
+
+    def copied_id(self):
+        """The last id copied by copy_batch(), 0 before the first batch"""
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT obj_description(%s::regclass, 'pg_class')", [self.shadow])
+            comment = cursor.fetchone()[0] or ''
+        return int(comment[len(COPIED):]) if comment.startswith(COPIED) else 0
+
+    def copy_batch(self, after_id, batch_size=50000):
+        """Copies the rows with the batch_size ids following after_id.
+        Returns (last id, rows copied), last id None when done"""
+        table, shadow, column = self.table, self.shadow, self.partitioned.column
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"SELECT max(id) FROM (SELECT id FROM {table} WHERE id > %s "
+                           f"ORDER BY id LIMIT %s) batch", [after_id, batch_size])
+            last_id = cursor.fetchone()[0]
+            if last_id is None:
+                return None, 0
+            cursor.execute(
+                f"INSERT INTO {shadow} SELECT t.* FROM {table} t WHERE t.id > %s AND t.id <= %s "
+                f"FOR SHARE ON CONFLICT (id, {column}) DO NOTHING", [after_id, last_id])
+            copied = cursor.rowcount
+            cursor.execute(f"COMMENT ON TABLE {shadow} IS '{COPIED}{int(last_id)}'")
+            return last_id, copied
+
+    def verify(self):
+        """(rows of the table, rows of the copy), from one snapshot"""
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT (SELECT count(*) FROM {self.table}), (SELECT count(*) FROM {self.shadow})")
+            return cursor.fetchone()
+
+    def swap(self, lock_timeout='10s'):
+        """Puts the partitioned copy in place of the table"""
+        table, shadow, old = self.table, self.shadow, self.old
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"SET LOCAL lock_timeout = '{lock_timeout}'")
+            cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+            sequence = cursor.fetchone()[0]
+            old_indexes = self.indexes(cursor, table)
+            cursor.execute(f"DROP TRIGGER {self.trigger} ON {table}")
+            cursor.execute(f"DROP FUNCTION {self.trigger}()")
+            cursor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+            cursor.execute(f"ALTER TABLE {old} RENAME CONSTRAINT {table}_pkey TO {old}_pkey")
+            for name, _ in old_indexes:
+                cursor.execute(f"ALTER INDEX {name} RENAME TO {name}_u")
+                cursor.execute(f"ALTER INDEX {name}_p RENAME TO {name}")
+            cursor.execute(f"ALTER TABLE {shadow} RENAME TO {table}")
+            cursor.execute(f"ALTER TABLE {table} RENAME CONSTRAINT {shadow}_pkey TO {table}_pkey")
+            if sequence:
+                cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id")
@@ -0,0 +1,362 @@
+"""PostgreSQL COPY loader for the price models.
+
+The file is streamed into a temporary staging table with COPY FROM STDIN,
+the country/state/city/unit/currency codes are resolved to ids with joins,
+quantities are normalized (core.units) and the resolved rows are inserted
+into the price table with a single INSERT ... SELECT, skipping the rows already stored (core.fingerprint),
+which are reported as rejected. The inserted rows are screened for outliers in one batch
+(core.outliers) and folded into the aggregates. Everything runs in one
+transaction.
+
+File format: csv with a header naming the model fields. Foreign keys are
+given by code:
+    country, state, unit and currency fields: iso_code
+    house_type, price_type fields:            code
+    city:                                     name of the city in the state
+    any other foreign key:                    id
+"""
+import csv
+import io
+import math
+import os
+import time
+from datetime import date
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+from core import aggregates, fingerprint, hierarchy, models, outliers, units
+from core.ingest import batched
+from core.prices import AUDIT_FIELDS, CODE_FIELDS, get_spec
+
+TRUE_VALUES = {'t', 'true', 'y', 'yes', '1'}
+FALSE_VALUES = {'f', 'false', 'n', 'no', '0'}
+
+
+def _to_float(value):
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f'{value} is not a finite number')
+    return repr(number)
+
+
+def _to_int(value):
+    return str(int(value))
+
+
+def _to_date(value):
+    return date.fromisoformat(value).isoformat()
+
+
+def _to_bool(value):
+    value = value.lower()
+    if value in TRUE_VALUES:
+        return 't'
+    if value in FALSE_VALUES:
+        return 'f'
+    raise ValueError(f'{value} is not a boolean')
+
+
+def _converter(field):
+    """Returns a function that validates a csv value and returns its COPY text"""
+    if field.is_relation:
+        return str
+    internal_type = field.get_internal_type()
+    if internal_type == 'FloatField':
+        return _to_float
+    if internal_type in ('IntegerField', 'BigIntegerField', 'SmallIntegerField'):
+        return _to_int
+    if internal_type == 'DateField':
+        return _to_date
+    if internal_type == 'BooleanField':
+        return _to_bool
+
+    def to_text(value):
+        if field.max_length and len(value) > field.max_length:
+            raise ValueError(f'longer than {field.max_length} characters')
+        return value
+    return to_text
+
+
+class BatchReport:
+    """Outcome of one COPY batch"""
+
+    def __init__(self, number, first_line, last_line):
+        self.number = number
+        self.first_line = first_line
+        self.last_line = last_line
+        self.copied = 0
+        self.loaded = 0
+        self.errors = []
+
+    def __str__(self):
+        return (f'batch {self.number} lines {self.first_line}-{self.last_line}: '
+                f'{self.loaded} loaded, {len(self.errors)} rejected')
+
+
+class PriceCopyLoader:
+    """Loads a csv file into the price model described by spec"""
+    # columns filled by the loader, never read from the file
+    excluded_fields = AUDIT_FIELDS | set(fingerprint.FIELDS) | set(hierarchy.FIELDS)
+
+    def __init__(self, spec, batch_size=50000, language=None, user=None):
+        self.spec = spec
+        self.model = spec.model
+        self.batch_size = batch_size
+        self.language = language or settings.LANGUAGE_CODE
+        self.user = user
+        self.fields = [field for field in self.model._meta.concrete_fields
+                       if not field.primary_key and field.name not in self.excluded_fields]
+        self.converters = [_converter(field) for field in self.fields]
+        self.stage = f'pt_stage_{spec.key}'
+        self.batches = []
+        self.rows = 0
+        self.loaded = 0
+        self.flagged = 0
+        self.elapsed = 0.0
+
+    @property
+    def errors(self):
+        return [error for batch in self.batches for error in batch.errors]
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def load(self, reader, benchmark=0):
+        """Loads the rows of a csv.reader whose first row is the header.
+        benchmark: number of rows to replay through the ORM for comparison"""
+        header = [name.strip() for name in next(reader, [])]
+        expected = [field.name for field in self.fields]
+        if sorted(header) != sorted(expected):
+            raise ValueError(f"header must name the fields {', '.join(expected)}")
+        order = [header.index(name) for name in expected]
+
+        start = time.perf_counter()
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.create_stage(cursor)
+            line = 1
+            for number, rows in enumerate(batched(reader, self.batch_size), 1):
+                report = BatchReport(number, line + 1, line + len(rows))
+                line += len(rows)
+                self.copy_batch(cursor, rows, order, report)
+                self.batches.append(report)
+            self.resolve(cursor)
+            self.merge(cursor)
+            self.elapsed = time.perf_counter() - start
+            if benchmark:
+                self.orm_rows_per_sec = self.replay_orm(cursor, benchmark)
+        return self
+
+    def create_stage(self, cursor):
+        quote = connection.ops.quote_name
+        columns = ', '.join(f'{quote(field.name)} text' for field in self.fields)
+        cursor.execute(f'CREATE TEMP TABLE {self.stage} (line bigint, {columns}) ON COMMIT DROP')
+
+    def copy_batch(self, cursor, rows, order, report):
+        """Validates the values of a batch in python and COPYs the valid rows"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for line, row in enumerate(rows, report.first_line):
+            self.rows += 1
+            try:
+                values = []
+                for field, convert, index in zip(self.fields, self.converters, order):
+                    value = row[index].strip()
+                    if not value:
+                        raise ValueError(f'empty {field.name}')
+                    values.append(convert(value))
+            except (ValueError, IndexError) as error:
+                report.errors.append((line, str(error) or 'missing column'))
+                continue
+            writer.writerow([line] + values)
+            report.copied += 1
+        if not report.copied:
+            return
+
+        buffer.seek(0)
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(field.name) for field in self.fields)
+        sid = transaction.savepoint()
+        try:
+            with connection.wrap_database_errors:
+                cursor.copy_expert(
+                    f'COPY {self.stage} (line, {columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        except DatabaseError as error:
+            transaction.savepoint_rollback(sid)
+            report.errors.append((report.first_line, f'COPY failed: {error}'))
+            report.copied = 0
+        else:
+            transaction.savepoint_commit(sid)
+
+    def resolve(self, cursor):
+        """Resolves the codes of the staging table into {stage}_resolved"""
+        quote = connection.ops.quote_name
+        selects = ['s.line']
+        joins = []
+        self.relations = []
+        for field in self.fields:
+            column = f's.{quote(field.name)}'
+            if not field.is_relation:
+                selects.append(f'{column}::{field.db_type(connection)} AS {quote(field.column)}')
+                continue
+            related = field.related_model
+            alias = quote(f'j_{field.name}')
+            table = quote(related._meta.db_table)
+            if related in CODE_FIELDS:
+                condition = f'{alias}.{quote(CODE_FIELDS[related])} = {column}'
+            elif related is models.City and field.name == 'city':
+                translations = quote(related._parler_meta.root_model._meta.db_table)
+                table = (f'(SELECT c.id, c.state_id, t.name FROM {table} c JOIN {translations} t '
+                         f'ON t.master_id = c.id AND t.language_code = %(language)s)')
+                condition = f'{alias}.state_id = {quote("j_state")}.id AND {alias}.name = {column}'
+            else:
+                condition = f"{alias}.id = CASE WHEN {column} ~ '^[0-9]+$' THEN {column}::bigint END"
+            joins.append(f'LEFT JOIN {table} {alias} ON {condition}')
+            selects.append(f'{alias}.id AS {quote(field.column)}')
+            self.relations.append(field)
+
+        cursor.execute(
+            f"CREATE TEMP TABLE {self.stage}_resolved ON COMMIT DROP AS "
+            f"SELECT {', '.join(selects)} FROM {self.stage} s {' '.join(joins)}",
+            {'language': self.language})
+
+        unresolved = ', '.join(f"CASE WHEN {quote(field.column)} IS NULL THEN '{field.name}' END"
+                               for field in self.relations)
+        cursor.execute(f'SELECT line, concat_ws(\', \', {unresolved}) '
+                       f'FROM {self.stage}_resolved WHERE NOT ({self.resolved_condition()}) '
+                       f'ORDER BY line')
+        for line, names in cursor.fetchall():
+            self.reject(line, f'unknown {names}')
+
+    def reject(self, line, message):
+        """Records the rejection of a copied line"""
+        report = self.batches[(line - 2) // self.batch_size]
+        report.errors.append((line, message))
+        report.copied -= 1
+
+    def resolved_condition(self):
+        quote = connection.ops.quote_name
+        return ' AND '.join(f'{quote(field.column)} IS NOT NULL' for field in self.relations) or 'true'
+
+    def merge(self, cursor):
+        """Inserts the resolved rows into the price table, but the duplicates
+        of a stored row or of an earlier line"""
+        quote = connection.ops.quote_name
+        table = quote(self.spec.table)
+        columns = ', '.join(quote(field.column) for field in self.fields)
+        units.normalize_table(self.spec, cursor, f'{self.stage}_resolved',
+                              [field.column for field in self.fields])
+        cursor.execute(
+            f'CREATE TEMP TABLE {self.stage}_hashed ON COMMIT DROP AS '
+            f'SELECT r.*, {fingerprint.sql(self.spec, "r")} AS fingerprint, '
+            f'{hierarchy.item_path_sql(self.spec, "r")} AS item_path '
+            f'FROM {self.stage}_resolved r WHERE {self.resolved_condition()}')
+        cursor.execute(
+            f'SELECT line FROM (SELECT h.line, row_number() OVER (PARTITION BY h.fingerprint, h.date '
+            f'ORDER BY h.line) > 1 OR EXISTS (SELECT 1 FROM {table} p WHERE p.fingerprint = h.fingerprint '
+            f'AND p.date = h.date AND NOT p.is_duplicate) AS duplicate FROM {self.stage}_hashed h) d '
+            f'WHERE duplicate ORDER BY line')
+        for (line,) in cursor.fetchall():
+            self.reject(line, 'duplicate of a stored price')
+        cursor.execute(f'CREATE TEMP TABLE {self.stage}_ids (id bigint) ON COMMIT DROP')
+        if hierarchy.has_item_path(self.spec):
+            columns += ', item_path'
+        cursor.execute(
+            f'WITH inserted AS (INSERT INTO {table} '
+            f'({columns}, fingerprint, is_duplicate, created_on, updated_on, created_by_id) '
+            f'SELECT {columns}, fingerprint, false, now(), now(), %s FROM {self.stage}_hashed '
+            f'ORDER BY line ON CONFLICT (fingerprint, date) '
+            f'WHERE NOT is_duplicate AND fingerprint IS NOT NULL DO NOTHING RETURNING id) '
+            f'INSERT INTO {self.stage}_ids SELECT id FROM inserted',
+            [self.user.id if self.user else None])
+        self.loaded = cursor.rowcount
+        inserted = f'p.id IN (SELECT id FROM {self.stage}_ids)'
+        self.flagged = outliers.screen_rows(self.spec, table, inserted)
+        aggregates.add_rows(self.spec, table, inserted)
+        for report in self.batches:
+            report.loaded = report.copied
+
+    def replay_orm(self, cursor, count):
+        """Saves up to count resolved rows one by one through the ORM, as the
+        admin does, and rolls them back. Returns the ORM rows/sec"""
+        quote = connection.ops.quote_name
+        names = [field.attname for field in self.fields]
+        cursor.execute(
+            f"SELECT {', '.join(quote(field.column) for field in self.fields)} "
+            f"FROM {self.stage}_resolved WHERE {self.resolved_condition()} LIMIT %s", [count])
+        rows = cursor.fetchall()
+        if not rows:
+            return 0.0
+        sid = transaction.savepoint()
+        start = time.perf_counter()
+        for row in rows:
+            self.model(created_by=self.user, **dict(zip(names, row))).save()
+        elapsed = time.perf_counter() - start
+        transaction.savepoint_rollback(sid)
+        return len(rows) / elapsed
+
+
+def country_column(path, dialect='excel'):
+    """Returns the set of country codes found in a price file"""
+    with open(path, newline='', encoding='utf-8') as file:
+        reader = csv.reader(file, dialect=dialect)
+        header = [name.strip() for name in next(reader, [])]
+        if 'country' not in header:
+            raise ValueError(f'{path} has no country column')
+        index = header.index('country')
+        return {row[index].strip() for row in reader if len(row) > index}
+
+
+def partition_by_country(paths, directory, dialect='excel'):
+    """Returns {country: [paths]}. Files with rows of several countries are
+    split into one file per country inside directory"""
+    partitions = {}
+    for path in paths:
+        countries = country_column(path, dialect)
+        if len(countries) == 1:
+            partitions.setdefault(countries.pop(), []).append(path)
+            continue
+        with open(path, newline='', encoding='utf-8') as file:
+            reader = csv.reader(file, dialect=dialect)
+            header = next(reader)
+            index = [name.strip() for name in header].index('country')
+            files = {}
+            writers = {}
+            for row in reader:
+                if len(row) <= index:
+                    continue
+                country = row[index].strip()
+                if country not in writers:
+                    name = f'{len(files)}_{country}_{os.path.basename(path)}'
+                    files[country] = open(os.path.join(directory, name), 'w',
+                                          newline='', encoding='utf-8')
+                    writers[country] = csv.writer(files[country], dialect=dialect)
+                    writers[country].writerow(header)
+                    partitions.setdefault(country, []).append(files[country].name)
+                writers[country].writerow(row)
+            for part in files.values():
+                part.close()
+    return partitions
+
+
+def load_file(key, path, batch_size=50000, language=None, user_id=None, dialect='excel'):
+    """Loads one file with its own database connection. Runs in a worker
+    process of backfillprices, so it returns plain data"""
+    from django.contrib.auth import get_user_model
+
+    result = {'path': path, 'rows': 0, 'loaded': 0, 'rejected': 0, 'elapsed': 0.0, 'error': ''}
+    try:
+        user = get_user_model().objects.get(pk=user_id) if user_id else None
+        loader = PriceCopyLoader(get_spec(key), batch_size=batch_size, language=language, user=user)
+        with open(path, newline='', encoding='utf-8') as file:
+            loader.load(csv.reader(file, dialect=dialect))
+        result.update(rows=loader.rows, loaded=loader.loaded,
+                      rejected=len(loader.errors), elapsed=loader.elapsed)
+    except (OSError, ValueError, DatabaseError) as error:
+        result['error'] = str(error)
+    except Exception as error:
+        # any other failure, e.g. a row the converters did not expect, fails
+        # this file only, not the whole backfill
+        result['error'] = f'{type(error).__name__}: {error}'
+    return result
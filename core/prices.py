@@ -0,0 +1,104 @@
+"""Registry of the price models.
+
+Every price model shares the date, country, state and city columns. The
+registry gives each one a short key (its subcategory) so commands, loaders
+and views can address them uniformly: loadprices food prices.csv
+"""
+from django.db import connection
+
+from core import models
+
+# catalogs whose rows are addressed by code in files and in the API
+CODE_FIELDS = {
+    models.Country: 'iso_code',
+    models.State: 'iso_code',
+    models.Unit: 'iso_code',
+    models.Currency: 'iso_code',
+    models.HouseType: 'code',
+    models.PriceType: 'code',
+}
+
+# filled in by the application, not part of the observed price
+AUDIT_FIELDS = {'created_by', 'updated_by', 'created_on', 'updated_on'}
+
+
+class PriceSpec:
+    """Describes one price model"""
+
+    def __init__(self, key, model, item_field=None, value_field='price', per_field=None):
+        self.key = key
+        self.model = model
+        # the catalog foreign key a price is observed for, e.g. food
+        self.item_field = item_field
+        # comparable price: value_field, divided by per_field when given
+        self.value_field = value_field
+        self.per_field = per_field
+
+    def __str__(self):
+        return self.key
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    @property
+    def item_column(self):
+        return f'{self.item_field}_id' if self.item_field else None
+
+    def item_sql(self, alias='p'):
+        """SQL expression of the item id, 0 for models without items. Quoted,
+        MedicinePrice.Medicine_id is mixed case"""
+        if not self.item_column:
+            return '0'
+        return f'{alias}.{connection.ops.quote_name(self.item_column)}'
+
+    def value_sql(self, alias=''):
+        """SQL expression of the comparable price, NULL when it can not be computed"""
+        prefix = f'{alias}.' if alias else ''
+        if self.per_field:
+            return f'{prefix}{self.value_field} / NULLIF({prefix}{self.per_field}, 0)'
+        return f'{prefix}{self.value_field}'
+
+    def value_of(self, obj):
+        """The comparable price of a row, None when it can not be computed"""
+        value = getattr(obj, self.value_field)
+        if value is None or not self.per_field:
+            return value
+        per = getattr(obj, self.per_field)
+        return value / per if per else None
+
+    @property
+    def code_relations(self):
+        """Foreign keys to catalogs in CODE_FIELDS"""
+        return [field for field in self.model._meta.concrete_fields
+                if field.is_relation and field.related_model in CODE_FIELDS]
+
+
+PRICE_SPECS = {spec.key: spec for spec in (
+    PriceSpec('electricity', models.ElectricityPrice, value_field='unit_price'),
+    PriceSpec('gas', models.gasPrice),
+    PriceSpec('internet', models.InternetPrice),
+    PriceSpec('food', models.FoodPrice, item_field='food', per_field='weight_kg'),
+    PriceSpec('housing', models.housePrice, item_field='house_type'),
+    PriceSpec('gasoline', models.gasolinePrice, value_field='price_per_liter'),
+    PriceSpec('transport', models.TransportPrice, item_field='transport_vendor',
+              value_field='price_per_km'),
+    PriceSpec('medicine', models.MedicinePrice, item_field='Medicine'),
+    PriceSpec('water', models.waterPrice, value_field='price_m3'),
+)}
+
+
+def spec_for_model(model):
+    """Returns the PriceSpec of a price model class or None"""
+    for spec in PRICE_SPECS.values():
+        if spec.model is model:
+            return spec
+    return None
+
+
+def get_spec(key):
+    """Returns the PriceSpec for key. Raises KeyError for unknown keys"""
+    try:
+        return PRICE_SPECS[key]
+    except KeyError:
+        raise KeyError(f"unknown price model {key}, use one of {', '.join(PRICE_SPECS)}")
@@ -0,0 +1,181 @@
+"""Per request SQL and latency statistics.
+
+core.middleware.QueryStatsMiddleware records a sample of the requests,
+QUERY_STATS_SAMPLE_RATE of them (default 1%), so it can stay on in
+production: a request not sampled costs one random number. A sampled
+request runs with a connection execute wrapper that times every query and
+counts them by signature, the SQL with IN lists collapsed. A signature
+executed several times in one request is a duplicate, usually an N+1 loop.
+
+A request slower than QUERY_STATS_SLOW_MS (default 500) or running more than
+QUERY_STATS_MAX_QUERIES queries (default 50) is logged on the
+core.querystats logger with its slowest query and its duplicates. The
+wall time, database time and query count of the last QUERY_STATS_WINDOW
+(default 1000) samples of each endpoint are kept in memory for
+snapshot(), served at /api/metrics/. The statistics are per process.
+Streamed responses are measured until the response is returned, the
+queries run while streaming are not recorded.
+"""
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SAMPLE_RATE = 0.01
+DEFAULT_SLOW_MS = 500
+DEFAULT_MAX_QUERIES = 50
+DEFAULT_WINDOW = 1000
+PERCENTILES = (50, 95, 99)
+IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+MAX_SQL = 500
+
+
+def sample_rate():
+    return getattr(settings, 'QUERY_STATS_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+
+
+def sampled():
+    rate = sample_rate()
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def signature(sql):
+    """The SQL of a query with its IN lists collapsed, so the same query for
+    other ids has the same signature"""
+    return IN_LIST.sub('IN (...)', sql)
+
+
+class QueryRecorder:
+    """Execute wrapper timing and counting the queries of a request"""
+
+    def __init__(self):
+        self.count = 0
+        self.db_time = 0.0
+        self.signatures = Counter()
+        self.slowest = (0.0, '')
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.db_time += elapsed
+            self.signatures[signature(sql)] += 1
+            if elapsed > self.slowest[0]:
+                self.slowest = (elapsed, sql)
+
+    def duplicates(self):
+        """[(signature, executions)] of the queries run more than once"""
+        return [(sql, count) for sql, count in self.signatures.most_common() if count > 1]
+
+
+class EndpointStats:
+    """The last samples of an endpoint"""
+
+    def __init__(self, window):
+        self.requests = 0
+        self.with_duplicates = 0
+        self.samples = deque(maxlen=window)
+
+    def add(self, wall_ms, db_ms, queries, duplicates):
+        self.requests += 1
+        self.with_duplicates += bool(duplicates)
+        self.samples.append((wall_ms, db_ms, queries))
+
+    def summary(self):
+        wall, db, queries = np.array(self.samples, dtype=np.float64).T
+        result = {'requests': self.requests, 'with_duplicates': self.with_duplicates}
+        for name, values in (('wall_ms', wall), ('db_ms', db), ('queries', queries)):
+            for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+                result[f'{name}_p{percentile}'] = round(float(value), 3)
+            result[f'{name}_max'] = round(float(values.max()), 3)
+        return result
+
+
+_lock = threading.Lock()
+_endpoints = {}
+
+
+def add(endpoint, wall_ms, recorder):
+    window = getattr(settings, 'QUERY_STATS_WINDOW', DEFAULT_WINDOW)
+    duplicates = recorder.duplicates()
+    with _lock:
+        stats = _endpoints.get(endpoint)
+        if stats is None:
+            stats = _endpoints[endpoint] = EndpointStats(window)
+        stats.add(wall_ms, recorder.db_time * 1000, recorder.count, duplicates)
+    if (wall_ms > getattr(settings, 'QUERY_STATS_SLOW_MS', DEFAULT_SLOW_MS)
+            or recorder.count > getattr(settings, 'QUERY_STATS_MAX_QUERIES', DEFAULT_MAX_QUERIES)):
+        slowest_time, slowest_sql = recorder.slowest
+        logger.warning(
+            "%s: %.1f ms, %d queries in %.1f ms, slowest %.1f ms: %s; duplicates: %s",
+            endpoint, wall_ms, recorder.count, recorder.db_time * 1000, slowest_time * 1000,
+            slowest_sql[:MAX_SQL], '; '.join(f'{count} x {sql[:MAX_SQL]}' for sql, count in duplicates[:3])
+            or 'none')
+
+
+def wrap(recorder):
+    """Installs recorder on the connections of the calling thread. Returns
+    the ExitStack removing it"""
+    stack = ExitStack()
+    for alias in connections:
+        stack.enter_context(connections[alias].execute_wrapper(recorder))
+    return stack
+
+
+def record(get_response, request):
+    """Runs get_response(request) recording its queries. Returns the response"""
+    recorder = QueryRecorder()
+    start = time.perf_counter()
+    with wrap(recorder):
+        response = get_response(request)
+    wall_ms = (time.perf_counter() - start) * 1000
+    add(endpoint(request), wall_ms, recorder)
+    return response
+
+
+async def arecord(get_response, request):
+    """record() for an async get_response. The connections are per thread,
+    the recorder is installed on the ones of the thread running the thread
+    sensitive sync code of the request: sync views and sync_to_async()"""
+    recorder = QueryRecorder()
+    start = time.perf_counter()
+    stack = await sync_to_async(wrap)(recorder)
+    try:
+        response = await get_response(request)
+    finally:
+        await sync_to_async(stack.close)()
+    wall_ms = (time.perf_counter() - start) * 1000
+    add(endpoint(request), wall_ms, recorder)
+    return response
+
+
+def endpoint(request):
+    """METHOD route of the view of a request, e.g. 'GET api/prices/food/'"""
+    match = getattr(request, 'resolver_match', None)
+    # routes of regex patterns, e.g. the routers', keep their anchors
+    route = match.route.replace('^', '').replace('$', '') if match is not None else 'unresolved'
+    return f'{request.method} {route}'
+
+
+def snapshot():
+    """{endpoint: summary} of the samples of this process"""
+    with _lock:
+        return {endpoint: stats.summary() for endpoint, stats in sorted(_endpoints.items())}
+
+
+def reset():
+    with _lock:
+        _endpoints.clear()
@@ -0,0 +1,206 @@
+"""Process local cache of the reference tables.
+
+Countries, states, cities, units, currencies and the small catalogs change
+rarely but are read by every price write and read. Each table is loaded on
+first use with its translations in every PARLER_LANGUAGES language and kept
+for the life of the process:
+
+    refdata.country_by_iso('MX').safe_translation_getter('name', language_code='es')
+    refdata.city(city_id)
+
+Writes to these tables bump a version number in the Django cache (see
+core.signals). core.middleware.RefDataMiddleware compares it once per
+request, so every worker drops its copy on its next request. With the local memory cache
+backend the version is per process, configure REDIS_URL when running
+several workers. Other process local caches built from reference data,
+the unit graph and the currency rates, register with on_change() to be
+dropped with the tables.
+
+The cached instances are shared, treat them as read only.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+from parler import appsettings
+
+from core import models
+
+VERSION_KEY = 'refdata:version'
+
+# table name: (model, code field or None)
+TABLES = {
+    'country': (models.Country, 'iso_code'),
+    'state': (models.State, 'iso_code'),
+    'city': (models.City, None),
+    'unit': (models.Unit, 'iso_code'),
+    'unit_type': (models.UnitType, 'code'),
+    'currency': (models.Currency, 'iso_code'),
+    'category': (models.Category, 'code'),
+    'area': (models.Area, 'code'),
+    'price_type': (models.PriceType, 'code'),
+}
+
+
+class Table:
+    """The rows of one reference table indexed by id and by code"""
+
+    def __init__(self, model, code_field, languages):
+        translations = model._parler_meta.root_model.objects.filter(language_code__in=languages)
+        rows = model.objects.prefetch_related(
+            Prefetch(model._parler_meta.root_rel_name, queryset=translations))
+        self.by_id = {obj.pk: obj for obj in rows}
+        self.by_code = {getattr(obj, code_field): obj for obj in self.by_id.values()} \
+            if code_field else {}
+        self.by_name = {}
+
+    def named(self, name, language):
+        """Rows by lowercase name in language, built on first use"""
+        if language not in self.by_name:
+            names = {}
+            for obj in self.by_id.values():
+                name_in = obj.safe_translation_getter('name', language_code=language)
+                if name_in:
+                    names.setdefault(name_in.lower(), []).append(obj)
+            self.by_name[language] = names
+        return self.by_name[language].get(name.lower(), [])
+
+
+_tables = {}
+_version = None
+# functions dropping the other caches built from reference data, see on_change()
+_listeners = []
+
+
+def languages():
+    return [language['code'] for language in
+            appsettings.PARLER_LANGUAGES.get(getattr(settings, 'SITE_ID', None), ())]
+
+
+def table(name):
+    """Returns the Table of a reference table, loading it on first use"""
+    if name not in _tables:
+        model, code_field = TABLES[name]
+        _tables[name] = Table(model, code_field, languages())
+    return _tables[name]
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def on_change(func):
+    """Registers func, called without arguments whenever the local tables are
+    dropped because this or another process changed reference data"""
+    if func not in _listeners:
+        _listeners.append(func)
+    return func
+
+
+def _clear():
+    _tables.clear()
+    for func in _listeners:
+        func()
+
+
+def sync():
+    """Drops the local tables when another process changed reference data.
+    Called once per request by RefDataMiddleware"""
+    global _version
+    version = current_version()
+    if version != _version:
+        _clear()
+        _version = version
+
+
+def _bump():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+
+
+def invalidate(**kwargs):
+    """Drops the local tables and, once the transaction commits, tells the
+    other processes. Connected to the reference models and translations"""
+    _clear()
+    transaction.on_commit(_bump)
+
+
+def get(name, pk):
+    """Row of a reference table by id or None"""
+    return table(name).by_id.get(pk)
+
+
+def by_code(name, code):
+    """Row of a reference table by its iso_code/code or None"""
+    return table(name).by_code.get(code)
+
+
+def country(pk):
+    return get('country', pk)
+
+
+def country_by_iso(iso_code):
+    return by_code('country', iso_code)
+
+
+def state(pk):
+    return get('state', pk)
+
+
+def state_by_iso(iso_code):
+    return by_code('state', iso_code)
+
+
+def city(pk):
+    return get('city', pk)
+
+
+def city_by_name(state_id, name, language=None):
+    """City of a state by its translated name or None"""
+    for obj in table('city').named(name, language or settings.LANGUAGE_CODE):
+        if obj.state_id == state_id:
+            return obj
+    return None
+
+
+def unit(pk):
+    return get('unit', pk)
+
+
+def unit_by_iso(iso_code):
+    return by_code('unit', iso_code)
+
+
+def unit_type(pk):
+    return get('unit_type', pk)
+
+
+def currency(pk):
+    return get('currency', pk)
+
+
+def currency_by_iso(iso_code):
+    return by_code('currency', iso_code)
+
+
+def category(pk):
+    return get('category', pk)
+
+
+def area(pk):
+    return get('area', pk)
+
+
+def price_type(pk):
+    return get('price_type', pk)
+
+
+def price_type_by_code(code):
+    return by_code('price_type', code)
+
@@ -1,8 +1,16 @@
 # backend/server/apps/accounts/serializers.py
 
-from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth import get_user_model
 from djoser.conf import settings
 from djoser.serializers import TokenCreateSerializer
+from rest_framework import serializers
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core import authentication, hierarchy
+from core.models import CostOfLivingIndex, PriceAggregate
+from core.prices import CODE_FIELDS
 
 User = get_user_model()
 
@@ -10,16 +18,82 @@ User = get_user_model()
 class CustomTokenCreateSerializer(TokenCreateSerializer):
 
     def validate(self, attrs):
+        """Checks the credentials with one user query and one password hash,
+        where authenticate() and a second check_password() took two of each
+        for a failed or inactive login. Inactive users can log in"""
         password = attrs.get("password")
         params = {settings.LOGIN_FIELD: attrs.get(settings.LOGIN_FIELD)}
-        self.user = authenticate(
-            request=self.context.get("request"), **params, password=password
-        )
-        if not self.user:
-            self.user = User.objects.filter(**params).first()
-            if self.user and not self.user.check_password(password):
-                self.fail("invalid_credentials")
-        # We changed only below line
-        if self.user:  # and self.user.is_active:
-            return attrs
-        self.fail("invalid_credentials")
+        self.user = User._default_manager.filter(**params).first()
+        if self.user is None:
+            # hash anyway, an unknown login takes as long as a wrong password
+            User().set_password(password)
+            self.fail("invalid_credentials")
+        if not self.user.check_password(password):
+            self.fail("invalid_credentials")
+        return attrs
+
+
+class JWTCreateSerializer(CustomTokenCreateSerializer):
+    """The same login, returning a refresh and access token pair. Access
+    tokens are not checked against the database, they are only issued to
+    active users"""
+
+    def validate(self, attrs):
+        super().validate(attrs)
+        if not self.user.is_active:
+            self.fail("inactive_account")
+        refresh = authentication.tokens_for(self.user)
+        return {'refresh': str(refresh), 'access': str(refresh.access_token)}
+
+
+class JWTRefreshSerializer(TokenRefreshSerializer):
+    """Rotates the refresh token: the one given is revoked, a second use of
+    it fails"""
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        authentication.check_not_revoked(refresh)
+        data = super().validate(attrs)
+        if not authentication.revoke(refresh):
+            # refreshed concurrently
+            raise TokenError('Token is revoked')
+        return data
+
+
+class JWTRevokeSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+    def validate(self, attrs):
+        refresh = RefreshToken(attrs['refresh'])
+        authentication.revoke(refresh)
+        return {}
+
+
+def price_serializer(spec):
+    """Returns a read serializer for a price model. Catalog foreign keys are
+    rendered by code (country MX, unit kg), the rest by id"""
+    attrs = {field.name: serializers.SlugRelatedField(
+        slug_field=CODE_FIELDS[field.related_model], read_only=True)
+        for field in spec.code_relations}
+    exclude = ['created_by', 'updated_by', 'fingerprint'] + [
+        field.name for field in spec.model._meta.concrete_fields if field.name in hierarchy.FIELDS]
+    attrs['Meta'] = type('Meta', (), {'model': spec.model, 'exclude': exclude})
+    return type(f'{spec.model.__name__}Serializer', (serializers.ModelSerializer,), attrs)
+
+
+class PriceAggregateSerializer(serializers.ModelSerializer):
+    country = serializers.SlugRelatedField(slug_field='iso_code', read_only=True)
+
+    class Meta:
+        model = PriceAggregate
+        fields = ['id', 'price_model', 'country', 'city', 'item_id', 'month',
+                  'count', 'minimum', 'maximum', 'mean']
+
+
+class CostOfLivingIndexSerializer(serializers.ModelSerializer):
+    country = serializers.SlugRelatedField(slug_field='iso_code', read_only=True)
+    currency = serializers.SlugRelatedField(slug_field='iso_code', read_only=True)
+
+    class Meta:
+        model = CostOfLivingIndex
+        fields = ['country', 'city', 'category', 'currency', 'index', 'items', 'computed_at']
@@ -0,0 +1,104 @@
+"""Signal receivers that keep derived data in sync with ORM writes.
+Connected in CoreConfig.ready()"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from rest_framework.authtoken.models import Token
+
+from core import aggregates, authentication, currency, fingerprint, hierarchy, leaderboard, outliers, refdata, units
+from core.models import (Category, City, Currency, CurrencyConv, Food, PriceDeletion, PriceFlag, Unit, UnitConv,
+                         User)
+from core.prices import PRICE_SPECS, spec_for_model
+
+
+def price_pre_save(sender, instance, raw=False, **kwargs):
+    """Normalizes the quantity, fingerprints the row, copies the path of its
+    item and remembers the bucket it leaves when it is updated"""
+    spec = spec_for_model(sender)
+    instance._old_bucket = None
+    if raw:
+        return
+    units.normalize(spec, [instance])
+    fingerprint.mark(spec, instance)
+    hierarchy.mark(spec, instance)
+    if instance.pk is None:
+        return
+    fields = ['city_id', 'date'] + ([spec.item_column] if spec.item_column else [])
+    old = sender.objects.filter(pk=instance.pk).only(*fields).first()
+    if old is not None:
+        instance._old_bucket = aggregates.bucket(spec, old)
+
+
+def price_post_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    spec = spec_for_model(sender)
+    if created:
+        if instance.is_duplicate:
+            return
+        flag = outliers.screen(spec, instance)
+        if flag is None or flag.status != PriceFlag.QUARANTINED:
+            aggregates.add(spec, instance)
+    else:
+        buckets = [aggregates.bucket(spec, instance)]
+        if getattr(instance, '_old_bucket', None):
+            buckets.append(instance._old_bucket)
+        aggregates.refresh(spec, buckets)
+
+
+def price_post_delete(sender, instance, **kwargs):
+    spec = spec_for_model(sender)
+    aggregates.refresh(spec, [aggregates.bucket(spec, instance)])
+    PriceDeletion.objects.create(price_model=spec.key, price_id=instance.pk)
+
+
+def ranking_changed(update_fields):
+    return update_fields is None or bool({'points', 'country'} & set(update_fields))
+
+
+def user_pre_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Remembers the points and country the leaderboards rank a user with"""
+    instance._old_ranking = None
+    if raw or instance.pk is None or not ranking_changed(update_fields):
+        return
+    instance._old_ranking = sender.objects.filter(pk=instance.pk).values_list(
+        'points', 'country_id').first()
+
+
+def user_post_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or not ranking_changed(update_fields):
+        return
+    old_points, old_country = getattr(instance, '_old_ranking', None) or (0, None)
+    if (old_points, old_country) != (instance.points, instance.country_id):
+        leaderboard.move(instance.pk, old_points, old_country, instance.points, instance.country_id)
+
+
+def connect():
+    for spec in PRICE_SPECS.values():
+        uid = f'price_aggregates_{spec.key}'
+        pre_save.connect(price_pre_save, sender=spec.model, dispatch_uid=uid)
+        post_save.connect(price_post_save, sender=spec.model, dispatch_uid=uid)
+        post_delete.connect(price_post_delete, sender=spec.model, dispatch_uid=uid)
+
+    for model in (Unit, UnitConv):
+        post_save.connect(units.invalidate, sender=model, dispatch_uid='units_invalidate')
+        post_delete.connect(units.invalidate, sender=model, dispatch_uid='units_invalidate')
+
+    for model in (Currency, CurrencyConv):
+        post_save.connect(currency.invalidate, sender=model, dispatch_uid='currency_invalidate')
+        post_delete.connect(currency.invalidate, sender=model, dispatch_uid='currency_invalidate')
+
+    for model, _ in refdata.TABLES.values():
+        for sender in (model, model._parler_meta.root_model):
+            post_save.connect(refdata.invalidate, sender=sender, dispatch_uid='refdata_invalidate')
+            post_delete.connect(refdata.invalidate, sender=sender, dispatch_uid='refdata_invalidate')
+
+    post_save.connect(hierarchy.category_saved, sender=Category, dispatch_uid='hierarchy_paths')
+    post_save.connect(hierarchy.food_saved, sender=Food, dispatch_uid='hierarchy_paths')
+    post_save.connect(hierarchy.city_saved, sender=City, dispatch_uid='hierarchy_paths')
+
+    post_save.connect(authentication.invalidate_token, sender=Token, dispatch_uid='auth_token_cache')
+    post_delete.connect(authentication.invalidate_token, sender=Token, dispatch_uid='auth_token_cache')
+    post_save.connect(authentication.invalidate_user, sender=User, dispatch_uid='auth_token_cache')
+    pre_save.connect(authentication.credentials_changed, sender=User, dispatch_uid='auth_jwt_revoke')
+
+    pre_save.connect(user_pre_save, sender=User, dispatch_uid='leaderboard_user')
+    post_save.connect(user_post_save, sender=User, dispatch_uid='leaderboard_user')
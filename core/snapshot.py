@@ -0,0 +1,218 @@
+"""Parquet snapshots of the price models for analytics.
+
+Each price model is written under <root>/<model>/year=<year of date>/ as
+Parquet files, one per snapshot run, so notebooks read prices from local
+disk with pyarrow or any Hive partitioning aware reader instead of querying
+the database. Catalog foreign keys are exported by code as dictionary
+columns, the others by id, which Parquet dictionary encodes on disk as well.
+A float column "value" holds the comparable price of the PriceSpec, e.g.
+price / weight_kg for food. With a currency, models with a currency column
+also get value_<iso_code> converted at the rate of the date.
+
+Snapshots are incremental: a run writes the rows whose updated_on is after
+the previous run, recorded in <root>/_snapshot.json. An edited row is in
+several files then, read() keeps its latest version. The ids of the rows
+deleted through the ORM, e.g. rejected by outlier review, are recorded in
+PriceDeletion and written under <root>/<model>/_deleted/, read() drops
+them. Rows deleted with SQL are only gone after a full=True run. Duplicate
+submissions are kept with is_duplicate set:
+
+    snapshot.write_model(PRICE_SPECS['food'], '/data/prices')
+    table = snapshot.read('/data/prices', 'food', years=[2022])
+"""
+import json
+import os
+import shutil
+from datetime import timedelta
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import models
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core import currency as currencies
+from core import export
+from core.models import PriceDeletion
+
+STATE_FILE = '_snapshot.json'
+# directory of the ids of the deleted rows of a model, ignored by the datasets
+# of the rows as its name starts with _
+DELETED = '_deleted'
+DELETED_SCHEMA = pa.schema([pa.field('id', pa.int64()), pa.field('deleted_on', pa.timestamp('us', tz='UTC'))])
+# rows updated this recently are left to the next run, their transactions may
+# still be open and commit an updated_on before the recorded one
+DEFAULT_LAG = timedelta(minutes=5)
+
+
+def arrow_type(field):
+    if field.is_relation:
+        if field.related_model in export.CODE_FIELDS:
+            return pa.dictionary(pa.int32(), pa.string())
+        return pa.int64()
+    if isinstance(field, models.DateTimeField):
+        return pa.timestamp('us', tz='UTC')
+    if isinstance(field, models.DateField):
+        return pa.date32()
+    if isinstance(field, models.DecimalField):
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    if isinstance(field, models.FloatField):
+        return pa.float64()
+    if isinstance(field, models.BooleanField):
+        return pa.bool_()
+    if isinstance(field, (models.IntegerField, models.AutoField)):
+        return pa.int64()
+    return pa.string()
+
+
+class ModelSnapshot:
+    """Columns and rows of one price model in a snapshot"""
+
+    def __init__(self, spec, to_currency=None):
+        self.spec = spec
+        self.to_currency = None
+        self.fields = [spec.model._meta.get_field(name) for name, _ in export.columns(spec)]
+        names = [field.name for field in self.fields]
+        schema = [pa.field(field.name, arrow_type(field)) for field in self.fields]
+        schema.append(pa.field('value', pa.float64()))
+        if to_currency and 'currency' in names:
+            self.to_currency = currencies.index().currency_id(to_currency)
+            self.currency_column = f'value_{to_currency}'
+            schema.append(pa.field(self.currency_column, pa.float64()))
+        self.schema = pa.schema(schema)
+        self.date_position = names.index('date')
+
+    def queryset(self, since, until):
+        rows = self.spec.model.objects.filter(updated_on__lte=until).order_by('updated_on', 'id')
+        if since:
+            rows = rows.filter(updated_on__gt=since)
+        lookups = [lookup for _, lookup in export.columns(self.spec)]
+        rows = rows.annotate(snapshot_value=RawSQL(self.spec.value_sql(self.spec.table), ()))
+        if self.to_currency:
+            lookups.append('currency_id')
+        return rows.values_list(*lookups, 'snapshot_value')
+
+    def batch(self, rows):
+        """RecordBatch of value_list rows"""
+        columns = list(zip(*rows))
+        arrays = []
+        for field, column, arrow_field in zip(self.fields, columns, self.schema):
+            if pa.types.is_dictionary(arrow_field.type):
+                arrays.append(pa.array(column, arrow_field.type.value_type).dictionary_encode())
+            else:
+                arrays.append(pa.array(column, arrow_field.type))
+        values = np.array([np.nan if value is None else value for value in columns[-1]], dtype=np.float64)
+        arrays.append(pa.array(values, from_pandas=True))
+        if self.to_currency:
+            converted = currencies.convert(values, columns[-2], columns[self.date_position], self.to_currency)
+            arrays.append(pa.array(converted, from_pandas=True))
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+
+def load_state(root):
+    try:
+        with open(os.path.join(root, STATE_FILE)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(root, state):
+    path = os.path.join(root, STATE_FILE)
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(state, file, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+
+def write_model(spec, root, to_currency=None, batch_size=50000, full=False, now=None):
+    """Writes the rows of a price model updated since its last snapshot.
+    Returns the number of rows written. full=True rewrites the whole model"""
+    state = load_state(root)
+    if full:
+        shutil.rmtree(os.path.join(root, spec.key), ignore_errors=True)
+    since = None if full else parse_datetime(state.get(spec.key, {}).get('updated_on') or '')
+    until = (now or timezone.now()) - getattr(settings, 'SNAPSHOT_LAG', DEFAULT_LAG)
+    snapshot = ModelSnapshot(spec, to_currency)
+    run = f'{until:%Y%m%dT%H%M%S}'
+    writers = {}
+    written = 0
+    rows = []
+
+    def flush():
+        # one row group per year in this batch
+        batch = snapshot.batch(rows)
+        years = pc.year(batch.column(snapshot.date_position)).to_numpy(zero_copy_only=False)
+        for year in np.unique(years):
+            if year not in writers:
+                directory = os.path.join(root, spec.key, f'year={year}')
+                os.makedirs(directory, exist_ok=True)
+                writers[year] = pq.ParquetWriter(os.path.join(directory, f'part-{run}.parquet'),
+                                                 snapshot.schema, compression='zstd')
+            writers[year].write_batch(batch.filter(pa.array(years == year)))
+
+    try:
+        for row in snapshot.queryset(since, until).iterator(chunk_size=min(batch_size, 10000)):
+            rows.append(row)
+            if len(rows) == batch_size:
+                flush()
+                written += len(rows)
+                rows = []
+        if rows:
+            flush()
+            written += len(rows)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    if not full:
+        write_deletions(spec, root, since, until, run)
+    previous = 0 if full else state.get(spec.key, {}).get('rows', 0)
+    state[spec.key] = {'updated_on': until.isoformat(), 'rows': previous + written}
+    save_state(root, state)
+    return written
+
+
+def write_deletions(spec, root, since, until, run):
+    """Writes the ids of the rows deleted since the previous run"""
+    deletions = PriceDeletion.objects.filter(price_model=spec.key, deleted_on__lte=until)
+    if since:
+        deletions = deletions.filter(deleted_on__gt=since)
+    rows = list(deletions.values_list('price_id', 'deleted_on'))
+    if not rows:
+        return
+    directory = os.path.join(root, spec.key, DELETED)
+    os.makedirs(directory, exist_ok=True)
+    ids, deleted_on = zip(*rows)
+    table = pa.Table.from_arrays([pa.array(ids, DELETED_SCHEMA.field('id').type),
+                                  pa.array(deleted_on, DELETED_SCHEMA.field('deleted_on').type)],
+                                 schema=DELETED_SCHEMA)
+    pq.write_table(table, os.path.join(directory, f'part-{run}.parquet'), compression='zstd')
+
+
+def latest(table):
+    """Rows of table keeping the latest updated_on of each id"""
+    if not table.num_rows:
+        return table
+    ids = table.column('id').to_numpy()
+    updated = pc.cast(table.column('updated_on'), pa.int64()).to_numpy()
+    order = np.lexsort((updated, ids))
+    last = np.append(ids[order][1:] != ids[order][:-1], True)
+    return table.take(pa.array(order[last]))
+
+
+def read(root, key, years=None, columns=None):
+    """The snapshot of a price model as a pyarrow Table, one row per price"""
+    dataset = ds.dataset(os.path.join(root, key), format='parquet', partitioning='hive')
+    row_filter = ds.field('year').isin(list(years)) if years else None
+    deleted = os.path.join(root, key, DELETED)
+    if os.path.isdir(deleted):
+        ids = ds.dataset(deleted, format='parquet', schema=DELETED_SCHEMA).to_table(columns=['id'])
+        kept = ~ds.field('id').isin(ids.column('id').combine_chunks())
+        row_filter = kept if row_filter is None else row_filter & kept
+    if columns:
+        columns = list(dict.fromkeys([*columns, 'id', 'updated_on']))
+    return latest(dataset.to_table(columns=columns, filter=row_filter))
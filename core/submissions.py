@@ -0,0 +1,223 @@
+"""Batch submission of price rows.
+
+A batch is a list of rows of any price models, each naming its model:
+
+    {"rows": [{"model": "food", "date": "2022-05-01", "country": "MX", ...}, ...]}
+
+Fields are given as the price API renders them: catalog foreign keys by code
+(country MX, unit kg), the others by id. The whole batch is validated with a
+few queries per related model instead of a few per row, then the valid rows
+are written with one bulk_create per model in a single transaction. Their
+fingerprints, outlier screening and aggregates are maintained in bulk, as
+the COPY loader does. Every row gets a result:
+
+    {"index": 0, "model": "food", "status": "created", "id": 12}
+    {"index": 1, "model": "food", "status": "duplicate", "id": 13}
+    {"index": 2, "model": "food", "status": "invalid", "errors": {"city": ["..."]}}
+
+With an idempotency key the response is stored with the batch, under a
+unique (user, key) index, in the same transaction as the rows: a retry of a
+batch gets that response instead of writing it twice, a concurrent retry
+waits for the first one to commit.
+"""
+import hashlib
+import json
+import math
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+
+from core import aggregates, fingerprint, hierarchy, outliers, refdata, units
+from core.models import SubmissionBatch
+from core.prices import CODE_FIELDS, PRICE_SPECS
+
+DEFAULT_MAX_ROWS = 100
+CREATED = 'created'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+
+
+class BatchError(ValueError):
+    """A batch that can not be processed at all"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def max_rows():
+    return getattr(settings, 'SUBMISSION_MAX_ROWS', DEFAULT_MAX_ROWS)
+
+
+def request_hash(payload):
+    return hashlib.md5(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ModelBatch:
+    """The rows of one price model in a batch"""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.fields = fingerprint.fields(spec)
+        self.relations = [field for field in self.fields if field.is_relation]
+        self.rows = []
+
+    def resolve(self):
+        """{field name: {given value: id}} of the foreign keys of the rows,
+        one query per foreign key"""
+        resolved = {}
+        for field in self.relations:
+            lookup = CODE_FIELDS.get(field.related_model, 'pk')
+            values = {row[field.name] for _, row in self.rows if isinstance(row.get(field.name), (str, int))}
+            if lookup == 'pk':
+                values = {value for value in values if str(value).isdigit()}
+            found = field.related_model.objects.filter(**{f'{lookup}__in': values}).values_list(lookup, 'pk')
+            resolved[field.name] = {str(value): pk for value, pk in found}
+        return resolved
+
+    def build(self, row, resolved):
+        """Returns the unsaved instance of a row, raises ValidationError"""
+        values = {}
+        errors = {}
+        unknown = set(row) - {field.name for field in self.fields} - {'model'}
+        for name in sorted(unknown):
+            errors[name] = ['Unknown field.']
+        for field in self.fields:
+            value = row.get(field.name)
+            if value in (None, ''):
+                if not field.null:
+                    errors[field.name] = ['This field is required.']
+                continue
+            if field.is_relation:
+                pk = resolved[field.name].get(str(value))
+                if pk is None:
+                    errors[field.name] = [f'Unknown {field.related_model._meta.verbose_name} {value}.']
+                values[field.attname] = pk
+                continue
+            try:
+                values[field.attname] = field.to_python(value)
+            except ValidationError as error:
+                errors[field.name] = error.messages
+                continue
+            if isinstance(values[field.attname], float) and not math.isfinite(values[field.attname]):
+                errors[field.name] = ['Expected a finite number.']
+        obj = self.spec.model(**values)
+        try:
+            # foreign keys were checked above, in bulk
+            obj.clean_fields(exclude=list(errors) + [field.name for field in self.relations])
+        except ValidationError as error:
+            errors.update(error.message_dict)
+        if not errors:
+            errors = self.check_geography(obj)
+        if errors:
+            raise ValidationError(errors)
+        return obj
+
+    def check_geography(self, obj):
+        city = refdata.city(obj.city_id)
+        state = refdata.state(obj.state_id)
+        if city is None or state is None:
+            return {}
+        if city.state_id != obj.state_id:
+            return {'city': ['The city is not in the state.']}
+        if state.country_id != obj.country_id:
+            return {'state': ['The state is not in the country.']}
+        return {}
+
+    def write(self, objs, user):
+        """Bulk inserts the instances. A row whose content is already stored,
+        or earlier in the batch, is kept as a duplicate"""
+        seen = set()
+        units.normalize(self.spec, objs)
+        for obj in objs:
+            obj.created_by_id = user.pk
+            obj.fingerprint = fingerprint.compute(self.spec, obj)
+        hierarchy.mark_many(self.spec, objs)
+        stored = set(self.spec.model.objects.filter(
+            fingerprint__in=[obj.fingerprint for obj in objs], is_duplicate=False).values_list(
+            'fingerprint', 'date'))
+        for obj in objs:
+            content = (obj.fingerprint, obj.date)
+            obj.is_duplicate = content in stored or content in seen
+            seen.add(content)
+        self.spec.model.objects.bulk_create(objs)
+        ids = [obj.pk for obj in objs if not obj.is_duplicate]
+        if ids:
+            table = self.spec.table
+            outliers.screen_rows(self.spec, table, 'p.id = ANY(%s)', [ids])
+            aggregates.add_rows(self.spec, table, 'p.id = ANY(%s)', [ids])
+
+
+def _rows(payload):
+    rows = payload.get('rows') if isinstance(payload, dict) else None
+    if not isinstance(rows, list) or not rows:
+        raise BatchError('Expected {"rows": [...]} with at least one row.')
+    if len(rows) > max_rows():
+        raise BatchError(f'A batch has at most {max_rows()} rows.')
+    return rows
+
+
+def process(user, rows):
+    """Validates and writes a list of rows. Returns the list of row results"""
+    results = [None] * len(rows)
+    batches = {}
+    for index, row in enumerate(rows):
+        key = row.get('model') if isinstance(row, dict) else None
+        if key not in PRICE_SPECS:
+            results[index] = {'index': index, 'model': key, 'status': INVALID,
+                              'errors': {'model': [f"Expected one of {', '.join(PRICE_SPECS)}."]}}
+            continue
+        batches.setdefault(key, ModelBatch(PRICE_SPECS[key])).rows.append((index, row))
+
+    for key, batch in batches.items():
+        resolved = batch.resolve()
+        objs = []
+        indexes = []
+        for index, row in batch.rows:
+            try:
+                objs.append(batch.build(row, resolved))
+                indexes.append(index)
+            except ValidationError as error:
+                results[index] = {'index': index, 'model': key, 'status': INVALID,
+                                  'errors': error.message_dict}
+        if not objs:
+            continue
+        batch.write(objs, user)
+        for index, obj in zip(indexes, objs):
+            results[index] = {'index': index, 'model': key, 'id': obj.pk,
+                              'status': DUPLICATE if obj.is_duplicate else CREATED}
+    return results
+
+
+def submit(user, payload, key=None):
+    """Processes a batch for user. Returns (response, replayed): replayed is
+    True when key was used before and response is the stored one"""
+    rows = _rows(payload)
+    if key is not None and not 0 < len(key) <= 64:
+        raise BatchError('The idempotency key has 1 to 64 characters.')
+    digest = request_hash(payload)
+    try:
+        with transaction.atomic():
+            stored = None
+            if key is not None:
+                try:
+                    with transaction.atomic():
+                        stored = SubmissionBatch.objects.create(
+                            user_id=user.pk, key=key, request_hash=digest, rows=len(rows))
+                except IntegrityError:
+                    previous = SubmissionBatch.objects.get(user_id=user.pk, key=key)
+                    if previous.request_hash != digest:
+                        raise BatchError('The idempotency key was used for another batch.', status=422)
+                    return previous.response, True
+            results = process(user, rows)
+            created = sum(result['status'] == CREATED for result in results)
+            response = {'rows': len(rows), 'created': created, 'results': results}
+            if stored is not None:
+                stored.created = created
+                stored.response = response
+                stored.save(update_fields=['created', 'response'])
+    except IntegrityError:
+        # a concurrent batch stored the same content first
+        raise BatchError('A row was submitted concurrently by another batch, retry.', status=409)
+    return response, False
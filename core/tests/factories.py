@@ -0,0 +1,50 @@
+"""Small helpers that create the catalog rows price tests depend on"""
+from django.contrib.auth import get_user_model
+
+from core import models
+
+
+def make_user(email='user@example.com'):
+    return get_user_model().objects.create_user(email=email, password='password1')
+
+
+def make_geography(country='MX', state='JAL', city='Guadalajara'):
+    """Returns (country, state, city), creating the language when missing"""
+    language, _ = models.AppLanguage.objects.get_or_create(iso_code='es', defaults={'name_en': 'Spanish'})
+    country = models.Country.objects.create(iso_code=country, name_en=country, name=country,
+                                            language=language)
+    state = models.State.objects.create(iso_code=state, country=country, name=state)
+    city = models.City.objects.create(country=country, state=state, name=city)
+    return country, state, city
+
+
+def make_unit(iso_code='l', unit_type='volume'):
+    unit_type, _ = models.UnitType.objects.get_or_create(code=unit_type, defaults={'name': unit_type})
+    return models.Unit.objects.create(iso_code=iso_code, name_en=iso_code, name=iso_code,
+                                      unit_type=unit_type)
+
+
+def make_currency(iso_code='MXN'):
+    return models.Currency.objects.create(iso_code=iso_code, name_en=iso_code, name=iso_code)
+
+
+def make_vendor(country, name='Vendor'):
+    return models.Vendor.objects.create(country=country, name=name, address='', className='food')
+
+
+def make_food(name='Rice', unit=None):
+    area, _ = models.Area.objects.get_or_create(code='food', defaults={'name': 'Food'})
+    category, _ = models.Category.objects.get_or_create(code='grains', defaults={'name': 'Grains',
+                                                                                 'area': area})
+    storage = models.FoodStorage.objects.first() or models.FoodStorage.objects.create(name='Dry')
+    return models.Food.objects.create(name=name, food_storage=storage, category=category,
+                                      weight_unit=unit or make_unit('kg', 'weight'))
+
+
+def make_medicine(name='Paracetamol'):
+    unit = models.Unit.objects.filter(iso_code='mg').first() or make_unit('mg', 'weight')
+    user = get_user_model().objects.filter(email='medicine@example.com').first() or \
+        make_user('medicine@example.com')
+    substance = models.ActiveSubstance.objects.create(name=name, unit=unit, created_by=user, updated_by=user)
+    return models.Medicine.objects.create(name_en=name, name=name, active_s1=substance, active_s2=substance,
+                                          active_s3=substance, s1_unit=unit, s2_unit=unit, s3_unit=unit)
@@ -4,9 +4,14 @@ from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.core import mail
 from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from core.models import Area, Category, UnitConv
+from core.tests.factories import make_unit
+
 import logging
 
 logger = logging.getLogger('django_test')
@@ -44,6 +49,50 @@ class AdminSiteTests(TestCase):
         self.assertContains(res, self.user.email)
 
 
+class AdminChangelistQueryTests(TestCase):
+    """Changelists cost the same number of queries whatever the row count"""
+
+    def setUp(self):
+        admin_user = get_user_model().objects.create_superuser(
+            email='admin@example.com', password='passwordAdmin1', username='admin')
+        self.client.force_login(admin_user)
+        self.rows = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            n = self.rows = self.rows + 1
+            area = Area.objects.create(code=f'area{n}', name=f'Area {n}')
+            Category.objects.create(code=f'cat{n}', name=f'Category {n}', area=area)
+            unit = make_unit(f'u{n}', f'type{n}')
+            to_unit = make_unit(f'v{n}', f'type{n}')
+            UnitConv.objects.create(unit=unit, to_unit=to_unit, conv_factor=n)
+
+    def changelist_queries(self, name, params=None):
+        url = reverse(f'admin:core_{name}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            res = self.client.get(url, params or {})
+        self.assertEqual(res.status_code, 200)
+        return len(queries), res
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.add_rows(2)
+        names = ['category', 'unit', 'unitconv', 'area', 'unittype']
+        few = {name: self.changelist_queries(name)[0] for name in names}
+        self.add_rows(20)
+        many = {name: self.changelist_queries(name)[0] for name in names}
+        self.assertEqual(few, many)
+
+    def test_computed_columns_are_shown_and_sortable(self):
+        self.add_rows(3)
+        _, res = self.changelist_queries('unit', {'o': '3'})
+        self.assertContains(res, 'type3')
+        _, res = self.changelist_queries('category', {'o': '-1', 'q': 'area2'})
+        self.assertContains(res, 'area2')
+        self.assertNotContains(res, 'area3')
+        _, res = self.changelist_queries('unitconv', {'o': '2', 'q': 'v1'})
+        self.assertContains(res, 'v1')
+
+
 class EmailVerificationTest(APITestCase):
     # djoser user management tests
 
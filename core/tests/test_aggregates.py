@@ -0,0 +1,107 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+from rest_framework.test import APITestCase
+
+from core.models import MedicinePrice, PriceAggregate, gasolinePrice
+from core.tests.factories import make_currency, make_geography, make_medicine, make_unit, make_vendor
+
+
+class PriceAggregateTests(APITestCase):
+
+    def setUp(self):
+        self.country, self.state, self.city = make_geography()
+        self.unit = make_unit('l')
+        self.currency = make_currency('MXN')
+
+    def add(self, day, price_per_liter):
+        return gasolinePrice.objects.create(
+            date=day, country=self.country, state=self.state, city=self.city, price=1,
+            currency=self.currency, volume=1, vol_unit=self.unit, price_per_liter=price_per_liter)
+
+    def bucket(self, month=date(2022, 5, 1)):
+        return PriceAggregate.objects.get(price_model='gasoline', city=self.city, month=month)
+
+    def test_incremental_updates(self):
+        self.add(date(2022, 5, 2), 20)
+        row = self.add(date(2022, 5, 20), 24)
+        self.add(date(2022, 6, 1), 30)
+        bucket = self.bucket()
+        self.assertEqual((bucket.count, bucket.minimum, bucket.maximum, bucket.mean),
+                         (2, 20, 24, 22))
+
+        row.price_per_liter = 18
+        row.save()
+        self.assertEqual((self.bucket().minimum, self.bucket().maximum), (18, 20))
+
+        # moving a row to another month updates both buckets
+        row.date = date(2022, 6, 15)
+        row.save()
+        self.assertEqual(self.bucket().count, 1)
+        self.assertEqual(self.bucket(date(2022, 6, 1)).count, 2)
+
+        row.delete()
+        self.assertEqual(self.bucket(date(2022, 6, 1)).mean, 30)
+
+    def test_rebuild_fixes_drift(self):
+        self.add(date(2022, 5, 2), 20)
+        PriceAggregate.objects.update(count=99, mean=0)
+        call_command('rebuild_aggregates', 'gasoline', stdout=StringIO())
+        self.assertEqual((self.bucket().count, self.bucket().mean), (1, 20))
+
+    def test_analytics_endpoints(self):
+        self.add(date(2022, 5, 2), 20)
+        self.add(date(2022, 6, 2), 30)
+        response = self.client.get(f'/api/analytics/gasoline/?city={self.city.id}')
+        months = [row['month'] for row in response.json()['results']]
+        self.assertEqual(months, ['2022-06-01', '2022-05-01'])
+        response = self.client.get('/api/analytics/gasoline/summary/?country=MX')
+        self.assertEqual(response.json(), [{'city': self.city.id, 'item_id': 0, 'count': 2,
+                                            'minimum': 20.0, 'maximum': 30.0, 'mean': 25.0}])
+
+    def test_mixed_case_item_column(self):
+        # MedicinePrice.Medicine_id must be quoted in the raw SQL
+        medicine = make_medicine()
+        row = MedicinePrice.objects.create(
+            date=date(2022, 5, 2), country=self.country, state=self.state, city=self.city,
+            vendor=make_vendor(self.country), Medicine=medicine, price=12, currency=self.currency)
+        bucket = PriceAggregate.objects.get(price_model='medicine')
+        self.assertEqual((bucket.item_id, bucket.count, bucket.mean), (medicine.pk, 1, 12))
+        row.price = 14
+        row.save()
+        self.assertEqual(PriceAggregate.objects.get(price_model='medicine').mean, 14)
+        call_command('rebuild_aggregates', 'medicine', stdout=StringIO())
+        self.assertEqual(PriceAggregate.objects.get(price_model='medicine').mean, 14)
+
+
+class ConcurrentRefreshTests(TransactionTestCase):
+
+    def test_concurrent_edits_of_one_bucket(self):
+        country, state, city = make_geography()
+        unit, currency = make_unit('l'), make_currency('MXN')
+        rows = [gasolinePrice.objects.create(
+            date=date(2022, 5, day), country=country, state=state, city=city, price=1,
+            currency=currency, volume=1, vol_unit=unit, price_per_liter=20) for day in (1, 2)]
+        barrier = threading.Barrier(2)
+
+        def edit(row):
+            try:
+                barrier.wait()
+                with transaction.atomic():
+                    row.price_per_liter = 30
+                    row.save()
+                    # both transactions are open with the bucket refreshed
+                    time.sleep(0.2)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(2) as pool:
+            list(pool.map(edit, rows))
+        bucket = PriceAggregate.objects.get(price_model='gasoline', city=city)
+        self.assertEqual((bucket.count, bucket.minimum, bucket.maximum), (2, 30, 30))
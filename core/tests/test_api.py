@@ -0,0 +1,66 @@
+from datetime import date, timedelta
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from core.models import gasolinePrice
+from core.tests.factories import make_currency, make_geography, make_unit
+
+
+class PriceApiTests(APITestCase):
+    url = '/api/prices/gasoline/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country, cls.state, cls.city = make_geography()
+        other = make_geography('US', 'TX', 'Austin')
+        unit = make_unit('l')
+        currency = make_currency('MXN')
+        start = date(2022, 1, 1)
+        # two rows per date so the cursor has to break ties on id
+        gasolinePrice.objects.bulk_create([
+            gasolinePrice(date=start + timedelta(days=n // 2), country=c, state=s, city=ct,
+                          price=n, currency=currency, volume=1, vol_unit=unit, price_per_liter=n)
+            for n in range(50)
+            for c, s, ct in [(cls.country, cls.state, cls.city) if n % 5 else other]])
+
+    def walk(self, url):
+        rows = []
+        queries = set()
+        while url:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            queries.add(len(context.captured_queries))
+            rows.extend(response.json()['results'])
+            url = response.json()['next']
+        return rows, queries
+
+    def test_keyset_pages(self):
+        rows, queries = self.walk(self.url + '?page_size=7')
+        self.assertEqual(len(rows), 50)
+        self.assertEqual(len({row['id'] for row in rows}), 50)
+        keys = [(row['date'], row['id']) for row in rows]
+        self.assertEqual(keys, sorted(keys, reverse=True))
+        # every page costs the same single query, foreign keys included
+        self.assertEqual(queries, {1})
+        self.assertEqual(rows[0]['country'], 'MX')
+        self.assertEqual(rows[0]['vol_unit'], 'l')
+        self.assertEqual(rows[0]['currency'], 'MXN')
+
+    def test_filters(self):
+        rows, _ = self.walk(self.url + f'?city={self.city.id}&date_from=2022-01-10&date_to=2022-01-20')
+        self.assertTrue(rows)
+        for row in rows:
+            self.assertEqual(row['city'], self.city.id)
+            self.assertTrue('2022-01-10' <= row['date'] <= '2022-01-20')
+        rows, _ = self.walk(self.url + '?country=US')
+        self.assertEqual(len(rows), 10)
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.client.get(self.url + '?date_from=yesterday').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url + '?cursor=xyz').status_code,
+                         status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,169 @@
+from unittest import mock
+
+from django.contrib.auth.hashers import get_hasher
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory, APITestCase
+
+from core import authentication
+from core.authentication import CachedTokenAuthentication, JWTAuthentication
+from core.tests.factories import make_user
+
+
+class LoginTests(APITestCase):
+    login_url = '/auth/token/login/'
+
+    def setUp(self):
+        self.user = make_user()
+        self.hasher = type(get_hasher())
+
+    def login(self, email, password):
+        with mock.patch.object(self.hasher, 'encode', autospec=True,
+                               side_effect=self.hasher.encode) as encode:
+            response = self.client.post(self.login_url, {'email': email, 'password': password},
+                                        format='json')
+        return response, encode.call_count
+
+    def test_one_hash_per_login(self):
+        for email, password in (('user@example.com', 'wrong'), ('nobody@example.com', 'password1')):
+            with self.assertNumQueries(1):
+                response, hashes = self.login(email, password)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(hashes, 1)
+        # inactive users log in
+        response, hashes = self.login('user@example.com', 'password1')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('auth_token', response.json())
+        self.assertEqual(hashes, 1)
+
+
+@override_settings(AUTH_SHARED_CACHE=True)
+class CachedTokenTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.user.is_active = True
+        self.user.save()
+        self.token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def me(self):
+        return self.client.get('/auth/users/me/')
+
+    def test_token_is_cached(self):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        authentication = CachedTokenAuthentication()
+        with self.assertNumQueries(1):
+            authentication.authenticate(request)
+        with self.assertNumQueries(0):
+            user, token = authentication.authenticate(request)
+        self.assertEqual((user, token), (self.user, self.token))
+
+    @override_settings(AUTH_SHARED_CACHE=None)
+    def test_not_cached_per_process(self):
+        # the test cache is a LocMemCache, other workers would miss invalidations
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        authentication = CachedTokenAuthentication()
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                authentication.authenticate(request)
+
+    def test_logout_and_user_changes_invalidate(self):
+        self.me()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.me().status_code, 401)
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.me().status_code, 200)
+        self.assertEqual(self.client.post('/auth/token/logout/').status_code, 204)
+        self.assertEqual(self.me().status_code, 401)
+
+
+@override_settings(AUTH_MODE='jwt')
+class JWTTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user()
+        self.user.is_active = True
+        self.user.save()
+
+    def login(self):
+        response = self.client.post('/auth/jwt/create/', {'email': 'user@example.com', 'password': 'password1'},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_reads_need_no_auth_query(self):
+        tokens = self.login()
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        with self.assertNumQueries(0):
+            user, _ = JWTAuthentication().authenticate(request)
+        self.assertEqual(user.pk, self.user.pk)
+        # fields the token does not carry load the user
+        self.assertEqual(user.email, self.user.email)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.client.get('/auth/users/me/').json()['email'], self.user.email)
+
+    def test_staff_flags_come_from_the_user(self):
+        self.user.is_staff = True
+        self.user.save()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.login()['access']}")
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 200)
+
+    def test_refresh_rotation_and_logout(self):
+        tokens = self.login()
+        response = self.client.post('/auth/jwt/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        rotated = response.json()
+        self.assertNotEqual(rotated['refresh'], tokens['refresh'])
+        # a refresh token is used once
+        response = self.client.post('/auth/jwt/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.client.post('/auth/jwt/logout/', {'refresh': rotated['refresh']},
+                                          format='json').status_code, 204)
+        response = self.client.post('/auth/jwt/refresh/', {'refresh': rotated['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+
+    def test_password_change_revokes_tokens(self):
+        tokens = self.login()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.client.get('/auth/users/me/').status_code, 200)
+        self.user.set_password('password2')
+        self.user.save()
+        self.assertEqual(self.client.get('/auth/users/me/').status_code, 401)
+        response = self.client.post('/auth/jwt/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 401)
+        # a login in the same second gets tokens of the new generation
+        tokens = self.client.post('/auth/jwt/create/', {'email': 'user@example.com', 'password': 'password2'},
+                                  format='json').json()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        self.assertEqual(self.client.get('/auth/users/me/').status_code, 200)
+        response = self.client.post('/auth/jwt/refresh/', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_inactive_users_get_no_tokens(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post('/auth/jwt/create/', {'email': 'user@example.com', 'password': 'password1'},
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(AUTH_MODE='token')
+    def test_disabled_in_token_mode(self):
+        response = self.client.post('/auth/jwt/create/', {'email': 'user@example.com', 'password': 'password1'},
+                                    format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_needs_a_shared_cache(self):
+        # the test cache is a LocMemCache
+        with self.assertRaises(ImproperlyConfigured):
+            authentication.check_settings()
+        with override_settings(AUTH_SHARED_CACHE=True):
+            authentication.check_settings()
+        with override_settings(AUTH_MODE='token'):
+            authentication.check_settings()
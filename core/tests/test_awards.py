@@ -0,0 +1,100 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from datetime import datetime, timedelta
+
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from core import awards
+from core.models import Activity, ActivityCounter, ActivityLog
+from core.tests.factories import make_user
+
+
+def make_activity(points=5, max_per_day=0, max_per_week=0):
+    return Activity.objects.create(code='submit', name='Submit', points=points,
+                                   max_per_day=max_per_day, max_per_week=max_per_week)
+
+
+class AwardTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user()
+
+    def test_daily_limit(self):
+        make_activity(max_per_day=2)
+        self.assertIsNotNone(awards.award(self.user, 'submit'))
+        self.assertIsNotNone(awards.award(self.user, 'submit'))
+        self.assertIsNone(awards.award(self.user, 'submit'))
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.points, 10)
+        self.assertEqual(ActivityLog.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(awards.remaining(self.user, 'submit'), {'day': 0, 'week': None})
+
+    def test_weekly_limit_and_unlimited(self):
+        make_activity(max_per_day=5, max_per_week=1)
+        self.assertIsNotNone(awards.award(self.user, 'submit'))
+        self.assertIsNone(awards.award(self.user, 'submit'))
+        Activity.objects.update(max_per_week=0, max_per_day=0)
+        for _ in range(3):
+            self.assertIsNotNone(awards.award(self.user, 'submit'))
+
+    def test_decision_uses_the_counters(self):
+        activity = make_activity(max_per_day=10)
+        awards.award(self.user, activity)
+        # savepoint, lock, counters, insert, points update, counters update, release:
+        # no count over the logs
+        with self.assertNumQueries(7):
+            awards.award(self.user, activity)
+
+    def test_missing_counters_are_recounted_from_the_logs(self):
+        make_activity(max_per_day=2)
+        awards.award(self.user, 'submit')
+        awards.award(self.user, 'submit')
+        ActivityCounter.objects.all().delete()
+        self.assertIsNone(awards.award(self.user, 'submit'))
+        self.assertEqual(dict(ActivityCounter.objects.values_list('window', 'count')), {'day': 2, 'week': 2})
+
+    def test_rolled_back_awards_are_not_counted(self):
+        make_activity(max_per_day=1)
+        awards.award(self.user, 'submit')
+        ActivityCounter.objects.all().delete()
+        ActivityLog.objects.all().delete()
+        try:
+            with transaction.atomic():
+                awards.award(self.user, 'submit')
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertIsNotNone(awards.award(self.user, 'submit'))
+
+    def test_ended_windows_are_deleted(self):
+        make_activity()
+        yesterday = timezone.now() - timedelta(days=1)
+        for window in awards.windows(self.user.pk, Activity.objects.get(), yesterday):
+            ActivityCounter.objects.create(user=self.user, activity='submit', window=window.name,
+                                           start=window.start, count=5)
+        awards.award(self.user, 'submit')
+        day = dict(ActivityCounter.objects.values_list('window', 'start'))['day']
+        self.assertEqual(day, datetime.combine(timezone.now().date(), datetime.min.time(), tzinfo=timezone.utc))
+        self.assertEqual(ActivityCounter.objects.filter(window='day').count(), 1)
+
+
+class ConcurrentAwardTests(TransactionTestCase):
+
+    def test_concurrent_awards_respect_the_limit(self):
+        user = make_user()
+        make_activity(points=3, max_per_day=4)
+
+        def submit(_):
+            try:
+                return awards.award(user, 'submit') is not None
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(8) as pool:
+            granted = list(pool.map(submit, range(16)))
+        self.assertEqual(sum(granted), 4)
+        user.refresh_from_db()
+        self.assertEqual(user.points, 12)
+        self.assertEqual(ActivityLog.objects.filter(user=user).count(), 4)
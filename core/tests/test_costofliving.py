@@ -0,0 +1,87 @@
+from datetime import date
+
+import numpy as np
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+
+from core import costofliving, currency
+from core.models import CurrencyConv, PriceAggregate, gasolinePrice
+from core.prices import PRICE_SPECS
+from core.tests.factories import make_currency, make_geography, make_unit
+
+
+class CostOfLivingTests(TestCase):
+
+    def setUp(self):
+        self.mxn = make_currency('MXN')
+        self.usd = make_currency('USD')
+        CurrencyConv.objects.create(currency_from=self.usd, currency_to=self.mxn, rate=20,
+                                    date_from=date(2022, 1, 1), date_to=date(2022, 12, 31))
+        currency.invalidate()
+        self.cheap = make_geography('MX', 'JAL', 'Guadalajara')
+        self.expensive = make_geography('US', 'TX', 'Austin')
+        for (country, _, _), local in [(self.cheap, self.mxn), (self.expensive, self.usd)]:
+            country.currency = local
+            country.save()
+
+    def test_basket_index(self):
+        prices = np.array([[1.0, 10.0, np.nan],
+                           [2.0, 20.0, 5.0],
+                           [4.0, 40.0, 5.0]])
+        index, items = costofliving.basket_index(prices)
+        # relatives to the median city: [.5, .5, -], [1, 1, 1], [2, 2, 1]
+        np.testing.assert_allclose(index, [50, 100, 100 * 4 ** (1 / 3)])
+        self.assertEqual(items.tolist(), [2, 3, 3])
+
+    def test_compute(self):
+        cheap, expensive = self.cheap, self.expensive
+        # no local currency, left out
+        unknown = make_geography('CA', 'ON', 'Toronto')
+        month = date(2022, 5, 1)
+        # Guadalajara prices are in MXN, 20 MXN = 1 USD
+        for (country, state, city), factor in [(cheap, 20), (expensive, 3), (unknown, 1)]:
+            for item_id in (1, 2):
+                PriceAggregate.objects.create(price_model='food', country=country, city=city,
+                                              item_id=item_id, month=month, count=2,
+                                              total=2 * 10 * item_id * factor)
+            PriceAggregate.objects.create(price_model='housing', country=country, city=city,
+                                          item_id=1, month=month, count=1, total=1000 * factor)
+
+        result = costofliving.compute(months=3, today=date(2022, 6, 15))
+        self.assertEqual((result['cities'], result['skipped']), (2, 5))
+        latest = {(row.city_id, row.category): row.index for row in costofliving.latest()}
+        self.assertEqual({row.currency_id for row in costofliving.latest()}, {self.usd.pk})
+        self.assertAlmostEqual(latest[(expensive[2].id, 'food')] /
+                               latest[(cheap[2].id, 'food')], 3)
+        self.assertAlmostEqual(latest[(expensive[2].id, 'all')] /
+                               latest[(cheap[2].id, 'all')], 3)
+
+        response = self.client.get(f'/api/cost-of-living/?city={cheap[2].id}')
+        self.assertEqual([(row['city'], row['currency']) for row in response.json()], [(cheap[2].id, 'USD')])
+
+    def test_prices_with_currency(self):
+        liter = make_unit('l', 'volume')
+
+        def add(geography, price, paid_in):
+            country, state, city = geography
+            gasolinePrice.objects.create(date=date(2022, 5, 3), country=country, state=state, city=city,
+                                         price=price, currency=paid_in, volume=1, vol_unit=liter,
+                                         price_per_liter=price)
+
+        # the same 1 USD per liter paid in both currencies
+        add(self.cheap, 20, self.mxn)
+        add(self.cheap, 1, self.usd)
+        add(self.expensive, 3, self.usd)
+        city_ids, _, prices, skipped = costofliving.price_matrix(PRICE_SPECS['gasoline'], date(2022, 1, 1))
+        self.assertEqual(city_ids.tolist(), [self.cheap[2].id, self.expensive[2].id])
+        np.testing.assert_allclose(prices[:, 0], [1, 3])
+        _, _, prices, _ = costofliving.price_matrix(PRICE_SPECS['gasoline'], date(2022, 1, 1), 'MXN')
+        np.testing.assert_allclose(prices[:, 0], [20, 60])
+        self.assertEqual(skipped, 0)
+
+    def test_command_reports_unknown_currencies(self):
+        with self.assertRaisesMessage(CommandError, 'unknown currency XXX'):
+            call_command('compute_cost_of_living', '--currency', 'XXX')
+        with override_settings(COST_OF_LIVING_CURRENCY='YYY'):
+            with self.assertRaisesMessage(CommandError, 'unknown currency YYY'):
+                call_command('compute_cost_of_living')
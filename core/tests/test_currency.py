@@ -0,0 +1,72 @@
+from datetime import date
+
+import numpy as np
+from django.core.cache import cache
+from django.test import TestCase
+
+from core import currency, refdata
+from core.models import CurrencyConv
+from core.tests.factories import make_currency
+
+
+class CurrencyConversionTests(TestCase):
+
+    def setUp(self):
+        self.mxn = make_currency('MXN')
+        self.usd = make_currency('USD')
+        self.eur = make_currency('EUR')
+        CurrencyConv.objects.create(currency_from=self.usd, currency_to=self.mxn, rate=20,
+                                    date_from=date(2021, 1, 1), date_to=date(2021, 12, 31))
+        CurrencyConv.objects.create(currency_from=self.usd, currency_to=self.mxn, rate=18,
+                                    date_from=date(2022, 1, 1), date_to=date(2022, 6, 30))
+        CurrencyConv.objects.create(currency_from=self.eur, currency_to=self.usd, rate=1.1,
+                                    date_from=date(2022, 1, 1), date_to=date(2022, 12, 31))
+        currency.invalidate()
+
+    def test_rate_lookup_by_interval(self):
+        self.assertEqual(currency.rate('USD', 'MXN', date(2021, 12, 31)), 20)
+        self.assertEqual(currency.rate(self.usd, self.mxn, date(2022, 1, 1)), 18)
+        self.assertAlmostEqual(currency.rate('MXN', 'USD', date(2021, 5, 1)), 0.05)
+        self.assertEqual(currency.rate('EUR', 'EUR', date(1990, 1, 1)), 1)
+        with self.assertRaises(currency.CurrencyConversionError):
+            currency.rate('USD', 'MXN', date(2022, 7, 1))
+        with self.assertRaises(currency.CurrencyConversionError):
+            currency.rate('USD', 'JPY', date(2022, 1, 1))
+
+    def test_overlapping_rates(self):
+        # a March override of the yearly EUR rate
+        CurrencyConv.objects.create(currency_from=self.eur, currency_to=self.usd, rate=1.2,
+                                    date_from=date(2022, 3, 1), date_to=date(2022, 3, 31))
+        self.assertEqual(currency.rate('EUR', 'USD', date(2022, 2, 28)), 1.1)
+        self.assertEqual(currency.rate('EUR', 'USD', date(2022, 3, 15)), 1.2)
+        self.assertEqual(currency.rate('EUR', 'USD', date(2022, 4, 15)), 1.1)
+        self.assertAlmostEqual(currency.rate('USD', 'EUR', date(2022, 3, 31)), 1 / 1.2)
+        self.assertAlmostEqual(currency.rate('USD', 'EUR', date(2022, 12, 31)), 1 / 1.1)
+
+    def test_batch_conversion_without_queries(self):
+        currency.index()
+        with self.assertNumQueries(0):
+            converted = currency.convert(
+                [200, 180, 10, 5, 100, 100],
+                [self.mxn.id, self.mxn.id, self.eur.id, self.usd.id, self.mxn.id, self.eur.id],
+                [date(2021, 3, 1), date(2022, 3, 1), date(2022, 3, 1), date(2019, 1, 1),
+                 date(2020, 1, 1), date(2021, 1, 1)],
+                'USD')
+        np.testing.assert_allclose(converted[:4], [10, 10, 11, 5])
+        self.assertTrue(np.isnan(converted[4:]).all())
+
+    def test_cache_is_invalidated_on_change(self):
+        self.assertEqual(currency.rate('USD', 'MXN', date(2021, 5, 1)), 20)
+        CurrencyConv.objects.create(currency_from=self.usd, currency_to=self.mxn, rate=17,
+                                    date_from=date(2022, 7, 1), date_to=date(2022, 12, 31))
+        self.assertEqual(currency.rate('USD', 'MXN', date(2022, 8, 1)), 17)
+
+    def test_other_process_changes_are_picked_up_on_sync(self):
+        refdata.sync()
+        self.assertEqual(currency.rate('USD', 'MXN', date(2021, 5, 1)), 20)
+        # a change made by another process: no signal here, only the version moves
+        CurrencyConv.objects.filter(rate=20).update(rate=19)
+        self.assertEqual(currency.rate('USD', 'MXN', date(2021, 5, 1)), 20)
+        cache.incr(refdata.VERSION_KEY)
+        refdata.sync()
+        self.assertEqual(currency.rate('USD', 'MXN', date(2021, 5, 1)), 19)
@@ -0,0 +1,87 @@
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+
+from django.core.management import call_command
+from django.test import AsyncClient
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from core.models import gasolinePrice
+from core.tests.factories import make_currency, make_geography, make_unit, make_user
+
+
+class ExportTests(APITestCase):
+    url = '/api/export/gasoline'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country, cls.state, cls.city = make_geography()
+        other = make_geography('US', 'TX', 'Austin')
+        unit = make_unit('l')
+        currency = make_currency('MXN')
+        start = date(2022, 1, 1)
+        gasolinePrice.objects.bulk_create([
+            gasolinePrice(date=start + timedelta(days=n), country=c, state=s, city=ct,
+                          price=n, currency=currency, volume=1, vol_unit=unit, price_per_liter=n)
+            for n in range(25)
+            for c, s, ct in [(cls.country, cls.state, cls.city) if n % 5 else other]])
+        cls.user = make_user()
+        cls.user.is_active = True
+        cls.user.save()
+        cls.token = Token.objects.create(user=cls.user)
+
+    def get(self, path):
+        self.client.force_authenticate(self.user)
+        response = self.client.get(self.url + path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return response
+
+    def test_csv(self):
+        response = self.get('.csv?country=MX&date_from=2022-01-03')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 19)
+        self.assertEqual(rows[0]['country'], 'MX')
+        self.assertEqual(rows[0]['vol_unit'], 'l')
+        self.assertEqual(rows[0]['city'], str(self.city.id))
+        self.assertEqual(rows[0]['date'], '2022-01-03')
+        self.assertNotIn('created_by', rows[0])
+
+    def test_ndjson_gzip(self):
+        response = self.get('.ndjson.gz?date_to=2022-01-10')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="gasoline.ndjson.gz"')
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows[0]['currency'], 'MXN')
+        self.assertEqual(rows[0]['country'], 'US')
+
+    def test_errors(self):
+        self.assertEqual(self.client.get(self.url + '.csv').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(self.url + '.xml').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/api/export/bread.csv').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(self.url + '.csv?date_from=x').status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'gasoline.csv.gz')
+            call_command('exportprices', 'gasoline', output=path, gzip=True, country='US', chunk_size=2)
+            with gzip.open(path, 'rt', newline='') as file:
+                rows = list(csv.DictReader(file))
+        self.assertEqual([row['date'] for row in rows],
+                         ['2022-01-01', '2022-01-06', '2022-01-11', '2022-01-16', '2022-01-21'])
+
+    async def test_refused_under_asgi(self):
+        # the async client of Django 4.0 takes header names as is, not HTTP_*
+        response = await AsyncClient().get(self.url + '.csv', authorization=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+        self.assertFalse(response.streaming)
@@ -0,0 +1,114 @@
+import os
+import tempfile
+from datetime import date
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APITestCase
+
+from core import fingerprint
+from core.models import PriceAggregate, gasolinePrice
+from core.prices import PRICE_SPECS
+from core.tests.factories import make_currency, make_geography, make_unit, make_user
+
+
+class FingerprintTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country, cls.state, cls.city = make_geography()
+        cls.unit = make_unit('l')
+        cls.currency = make_currency('MXN')
+        cls.spec = PRICE_SPECS['gasoline']
+
+    def submit(self, price, day=1, volume=1):
+        return gasolinePrice.objects.create(
+            date=date(2022, 6, day), country=self.country, state=self.state, city=self.city,
+            price=price, currency=self.currency, volume=volume, vol_unit=self.unit,
+            price_per_liter=price / volume)
+
+    def test_python_and_sql_agree(self):
+        rows = [self.submit(price, day) for day, price in
+                enumerate([22.05, 0.1 + 0.2, 1 / 3, 1e12, 19.99995, 0.00001, 1.7e308, -1e300,
+                           float('inf'), 0.12344999999999999, 123456.78904999999], start=1)]
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT p.id, {fingerprint.sql(self.spec)} FROM {self.spec.table} p")
+            stored = dict(cursor.fetchall())
+        for row in rows:
+            self.assertEqual(row.fingerprint, stored[row.pk])
+
+    def test_resubmissions_are_flagged(self):
+        first = self.submit(22.5)
+        again = self.submit(22.50001)
+        other = self.submit(22.5, volume=2)
+        self.assertEqual([first.is_duplicate, again.is_duplicate, other.is_duplicate], [False, True, False])
+        bucket = PriceAggregate.objects.get(price_model='gasoline')
+        self.assertEqual(bucket.count, 2)
+        # editing the original does not make it a duplicate of itself
+        first.save()
+        self.assertFalse(first.is_duplicate)
+
+    def test_lookup_uses_the_unique_index(self):
+        row = self.submit(22.5)
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = gasolinePrice.objects.filter(fingerprint=row.fingerprint, date=row.date,
+                                            is_duplicate=False).explain()
+        self.assertIn('gasolprice_fingerprint_uniq', plan)
+
+    def test_backfill(self):
+        gasolinePrice.objects.bulk_create([
+            gasolinePrice(date=date(2022, 6, 1 + n % 3), country=self.country, state=self.state,
+                          city=self.city, price=20, currency=self.currency, volume=1,
+                          vol_unit=self.unit, price_per_liter=20)
+            for n in range(7)])
+        saved = self.submit(20, day=3)
+        out = StringIO()
+        call_command('backfill_fingerprints', 'gasoline', batch_size=2, stdout=out)
+        self.assertIn('gasoline: 7 rows fingerprinted, 5 new duplicates', out.getvalue())
+        self.assertEqual(gasolinePrice.objects.filter(is_duplicate=False).count(), 3)
+        # the row fingerprinted when it was saved stays the original
+        self.assertFalse(gasolinePrice.objects.get(pk=saved.pk).is_duplicate)
+        self.assertEqual(PriceAggregate.objects.get(price_model='gasoline').count, 3)
+
+
+class DuplicateApiTests(APITestCase):
+
+    def test_api_and_export_columns(self):
+        country, state, city = make_geography()
+        unit, currency = make_unit('l'), make_currency('MXN')
+        for _ in range(2):
+            gasolinePrice.objects.create(date=date(2022, 6, 1), country=country, state=state, city=city,
+                                         price=20, currency=currency, volume=1, vol_unit=unit,
+                                         price_per_liter=20)
+        rows = self.client.get('/api/prices/gasoline/').json()['results']
+        self.assertEqual(sorted(row['is_duplicate'] for row in rows), [False, True])
+        self.assertNotIn('fingerprint', rows[0])
+        self.client.force_authenticate(make_user())
+        response = self.client.get('/api/export/gasoline.ndjson')
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 1)
+
+
+class LoaderDuplicateTests(TransactionTestCase):
+
+    def setUp(self):
+        self.country, self.state, self.city = make_geography()
+        make_unit('l')
+        make_currency('MXN')
+
+    def test_copy_load_skips_duplicates(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write("date,country,state,city,price,currency,volume,vol_unit,price_per_liter\n"
+                       "2022-05-01,MX,JAL,Guadalajara,220.5,MXN,10,l,22.05\n"
+                       "2022-05-02,MX,JAL,Guadalajara,230,MXN,10,l,23\n"
+                       "2022-05-01,MX,JAL,Guadalajara,220.50,MXN,10.0,l,22.05\n")
+        self.addCleanup(os.remove, file.name)
+        call_command('loadprices', 'gasoline', file.name, stdout=StringIO())
+        out = StringIO()
+        call_command('loadprices', 'gasoline', file.name, stdout=out)
+        self.assertIn('3 rows: 0 loaded, 3 rejected', out.getvalue())
+        self.assertIn('duplicate of a stored price', out.getvalue())
+        self.assertEqual(gasolinePrice.objects.count(), 2)
+        self.assertEqual(gasolinePrice.objects.filter(fingerprint__isnull=True).count(), 0)
@@ -0,0 +1,74 @@
+from datetime import date
+
+from rest_framework.test import APITestCase
+
+from core import hierarchy
+from core.models import Area, Category, City, FoodPrice, PriceAggregate
+from core.tests.factories import make_food, make_geography, make_unit, make_vendor
+
+
+class HierarchyTests(APITestCase):
+
+    def setUp(self):
+        self.country, self.state, self.city = make_geography()
+        self.other = City.objects.create(country=self.country, state=self.state, name='Zapopan')
+        self.unit = make_unit('kg', 'weight')
+        self.vendor = make_vendor(self.country)
+        self.food = make_food(unit=self.unit)
+        self.category = self.food.category
+
+    def add(self, price, city=None, food=None):
+        return FoodPrice.objects.create(
+            date=date(2022, 5, 1), country=self.country, state=self.state, city=city or self.city,
+            vendor=self.vendor, food=food or self.food, price=price, weight_unit=self.unit,
+            weight=1, weight_kg=1)
+
+    def test_paths_follow_writes(self):
+        area = self.category.area
+        self.city.refresh_from_db()
+        self.food.refresh_from_db()
+        self.assertEqual(self.city.path, f'{self.country.pk}/{self.state.pk}/{self.city.pk}/')
+        self.assertEqual(self.food.path, f'{area.pk}/{self.category.pk}/{self.food.pk}/')
+        row = self.add(10)
+        self.assertEqual(row.item_path, self.food.path)
+        bucket = PriceAggregate.objects.get(price_model='food', city=self.city)
+        self.assertEqual((bucket.city_path, bucket.item_path), (self.city.path, self.food.path))
+
+        # moving a category moves its foods, their prices and aggregates
+        drinks = Area.objects.create(code='drinks', name='Drinks')
+        self.category.area = drinks
+        self.category.save()
+        moved = f'{drinks.pk}/{self.category.pk}/{self.food.pk}/'
+        self.assertEqual(FoodPrice.objects.get(pk=row.pk).item_path, moved)
+        self.assertEqual(PriceAggregate.objects.get(pk=bucket.pk).item_path, moved)
+
+    def test_rollups(self):
+        self.add(10)
+        self.add(20, city=self.other)
+        fruit = Category.objects.create(code='fruit', name='Fruit', area=Area.objects.create(code='fresh'))
+        apple = make_food('Apple', unit=self.unit)
+        apple.category = fruit
+        apple.save()
+        self.add(90, food=apple)
+
+        response = self.client.get('/api/analytics/food/rollup/', {'state': 'JAL', 'area': 'food'})
+        self.assertEqual(response.json(), {'count': 2, 'minimum': 10.0, 'maximum': 20.0, 'mean': 15.0})
+        response = self.client.get('/api/analytics/food/rollup/', {'country': 'MX'})
+        self.assertEqual(response.json()['count'], 3)
+        response = self.client.get('/api/analytics/food/rollup/', {'area': 'unknown'})
+        self.assertEqual(response.json()['count'], 0)
+        response = self.client.get('/api/analytics/food/', {'category': 'fruit'})
+        self.assertEqual([row['item_id'] for row in response.json()['results']], [apple.pk])
+        response = self.client.get('/api/prices/food/', {'area': 'fresh'})
+        self.assertEqual([row['price'] for row in response.json()['results']], [90.0])
+
+    def test_rebuild(self):
+        row = self.add(10)
+        FoodPrice.objects.update(item_path='')
+        City.objects.update(path='')
+        PriceAggregate.objects.update(city_path='')
+        changed = hierarchy.rebuild()
+        self.assertEqual(changed[hierarchy.CITY_TABLE], 2)
+        self.assertEqual(changed[hierarchy.FOOD_PRICE_TABLE], 1)
+        self.assertEqual(FoodPrice.objects.get(pk=row.pk).item_path, self.food.path)
+        self.assertEqual(PriceAggregate.objects.get().city_path, City.objects.get(pk=self.city.pk).path)
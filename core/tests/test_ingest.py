@@ -0,0 +1,42 @@
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from core.models import AppLanguage, City, Country, State
+
+
+class UploadFileTests(TestCase):
+
+    def upload(self, classname, content, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('uploadfile', classname, file.name, *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def test_geography_load(self):
+        self.upload('Language', "en,English\nes,Spanish\n")
+        self.upload('Country', "MX,Mexico,es\nUS,United States\n")
+        self.upload('State', "MX,JAL,Jalisco\nMX,NLE,Nuevo Leon\nXX,XX-1,Nowhere\n")
+        out = self.upload('City', "JAL,GDL,Guadalajara\nNLE,MTY,Monterrey\n"
+                                  "JAL,GDL,Guadalajara\n", '--batch-size', '1')
+
+        self.assertIn('rows/sec', out)
+        self.assertIn('2 created, 1 skipped', out)
+        self.assertEqual(AppLanguage.objects.count(), 2)
+        mexico = Country.objects.get(iso_code='MX')
+        self.assertEqual(mexico.language.iso_code, 'es')
+        self.assertEqual(mexico.name, 'Mexico')
+        self.assertEqual(State.objects.count(), 2)
+        city = City.objects.get(translations__name='Guadalajara')
+        self.assertEqual(city.state.iso_code, 'JAL')
+        self.assertEqual(city.country_id, mexico.id)
+
+    def test_existing_rows_are_skipped(self):
+        self.upload('Language', "en,English\n")
+        out = self.upload('Language', "en,English\nfr,French\n")
+        self.assertIn('1 created, 1 skipped', out)
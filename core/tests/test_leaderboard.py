@@ -0,0 +1,140 @@
+import random
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+
+from core import awards, leaderboard
+from core.leaderboard import MemoryBoard, SortedKeys
+from core.models import Activity, User
+from core.tests.factories import make_geography, make_user
+
+
+class MemoryBoardTests(SimpleTestCase):
+
+    def test_ranks_by_points_then_id(self):
+        board = MemoryBoard([(1, 10), (2, 30), (3, 10), (4, 20)])
+        self.assertEqual(board.top(3), [(2, 30), (4, 20), (1, 10)])
+        self.assertEqual(board.rank(3), (4, 10))
+        board.add(3, 15)
+        self.assertEqual(board.rank(3), (2, 25))
+        board.remove(2)
+        self.assertEqual(board.top(2, offset=1), [(4, 20), (1, 10)])
+        self.assertIsNone(board.rank(2))
+        self.assertEqual(len(board), 3)
+
+
+class SortedKeysTests(SimpleTestCase):
+
+    @mock.patch('core.leaderboard.BLOCK', 4)
+    def test_matches_a_sorted_list(self):
+        rng = random.Random(7)
+        expected = sorted(rng.sample(range(1000), 30))
+        keys = SortedKeys(expected)
+        for _ in range(500):
+            if expected and rng.random() < 0.45:
+                key = rng.choice(expected)
+                expected.remove(key)
+                keys.remove(key)
+            else:
+                key = rng.randrange(1000)
+                expected.append(key)
+                expected.sort()
+                keys.add(key)
+            self.assertTrue(all(len(block) <= 8 for block in keys.blocks))
+        self.assertEqual(list(keys), expected)
+        self.assertEqual(len(keys), len(expected))
+        self.assertGreater(len(keys.blocks), 1)
+        for key in (-1, *expected, 1000):
+            self.assertEqual(keys.index(key), sum(1 for other in expected if other < key))
+        self.assertEqual(keys.slice(5, 17), expected[5:17])
+        self.assertEqual(keys.slice(len(expected) - 2, len(expected) + 5), expected[-2:])
+
+
+@override_settings(AUTH_SHARED_CACHE=True)
+class LeaderboardTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        leaderboard._boards.clear()
+        leaderboard._version = None
+        self.mx, _, _ = make_geography()
+        self.us, _, _ = make_geography('US', 'TX', 'Austin')
+        self.ana = make_user('ana@example.com')
+        self.bob = make_user('bob@example.com')
+        self.ana.username, self.bob.username = 'ana', 'bob'
+        self.ana.country, self.bob.country = self.mx, self.us
+        self.ana.points, self.bob.points = 50, 40
+        self.ana.save()
+        self.bob.save()
+        Activity.objects.create(code='submit', name='Submit', points=20)
+
+    def test_awards_update_the_boards_in_use(self):
+        self.assertEqual(leaderboard.top(2), [(self.ana.pk, 50), (self.bob.pk, 40)])
+        self.assertEqual(leaderboard.rank(self.bob.pk, country=self.us.pk), (1, 40))
+        with self.captureOnCommitCallbacks(execute=True):
+            awards.award(self.bob, 'submit')
+        with self.assertNumQueries(0):
+            self.assertEqual(leaderboard.top(2), [(self.bob.pk, 60), (self.ana.pk, 50)])
+            self.assertEqual(leaderboard.rank(self.bob.pk, country=self.us.pk), (1, 60))
+        # the weekly board is loaded from the logs
+        self.assertEqual(leaderboard.top(5, weekly=True), [(self.bob.pk, 20)])
+        with self.captureOnCommitCallbacks(execute=True):
+            awards.award(self.ana, 'submit')
+        self.assertEqual(leaderboard.rank(self.ana.pk, weekly=True), (1, 20))
+        self.assertEqual(leaderboard.rank(self.ana.pk), (1, 70))
+
+    def test_user_edits_move_the_user(self):
+        leaderboard.top(country=self.mx.pk)
+        leaderboard.top(country=self.us.pk)
+        self.ana.country = self.us
+        self.ana.save()
+        self.assertIsNone(leaderboard.rank(self.ana.pk, country=self.mx.pk))
+        self.assertEqual(leaderboard.rank(self.ana.pk, country=self.us.pk), (1, 50))
+        self.bob.points = 0
+        self.bob.save()
+        self.assertIsNone(leaderboard.rank(self.bob.pk))
+
+    def test_updates_of_other_processes_reload_the_boards(self):
+        self.assertEqual(leaderboard.rank(self.bob.pk), (2, 40))
+        # another process: the database and the version move, not this process' boards
+        User.objects.filter(pk=self.bob.pk).update(points=90)
+        cache.incr(leaderboard.VERSION_KEY)
+        self.assertEqual(leaderboard.rank(self.bob.pk), (1, 90))
+        # the updates of this process keep its boards
+        with self.captureOnCommitCallbacks(execute=True):
+            awards.award(self.ana, 'submit')
+        with self.assertNumQueries(0):
+            self.assertEqual(leaderboard.rank(self.ana.pk), (2, 70))
+
+    @override_settings(AUTH_SHARED_CACHE=False)
+    def test_per_process_cache_reads_the_database(self):
+        self.assertIsInstance(leaderboard.board(), leaderboard.QueryBoard)
+        self.assertEqual(leaderboard.top(2), [(self.ana.pk, 50), (self.bob.pk, 40)])
+        self.assertEqual(leaderboard.top(1, offset=1, country=self.us.pk), [])
+        self.assertEqual(leaderboard.rank(self.bob.pk), (2, 40))
+        with self.captureOnCommitCallbacks(execute=True):
+            awards.award(self.bob, 'submit')
+        self.assertEqual(leaderboard.rank(self.bob.pk), (1, 60))
+        self.assertEqual(leaderboard.rank(self.bob.pk, weekly=True), (1, 20))
+        self.assertIsNone(leaderboard.rank(self.ana.pk, weekly=True))
+        self.assertEqual(leaderboard.rebuild()['global'], 2)
+
+    def test_rebuild(self):
+        sizes = leaderboard.rebuild()
+        self.assertEqual(sizes['global'], 2)
+        self.assertEqual(sizes[f'country:{self.mx.pk}'], 1)
+
+    def test_endpoints(self):
+        res = self.client.get('/api/leaderboard/', {'country': 'US'})
+        self.assertEqual(res.json()['results'],
+                         [{'rank': 1, 'user': self.bob.pk, 'username': 'bob', 'points': 40}])
+        res = self.client.get('/api/leaderboard/', {'limit': 1, 'offset': 1})
+        self.assertEqual(res.json()['results'][0]['rank'], 2)
+        self.assertEqual(self.client.get('/api/leaderboard/', {'country': 'XX'}).status_code, 404)
+        self.assertEqual(self.client.get('/api/leaderboard/me/').status_code, 401)
+        self.client.force_authenticate(self.bob)
+        self.assertEqual(self.client.get('/api/leaderboard/me/').json(), {'rank': 2, 'points': 40})
+        self.assertEqual(self.client.get('/api/leaderboard/me/', {'weekly': '1'}).json(),
+                         {'rank': None, 'points': 0})
@@ -0,0 +1,102 @@
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TransactionTestCase
+
+from core.models import PriceAggregate, gasolinePrice
+from core.pgcopy import PriceCopyLoader, load_file, partition_by_country
+from core.tests.factories import make_currency, make_geography, make_unit
+
+
+class LoadPricesTests(TransactionTestCase):
+
+    def setUp(self):
+        self.country, self.state, self.city = make_geography()
+        make_unit('l')
+        make_currency('MXN')
+
+    def load(self, content, *args):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('loadprices', 'gasoline', file.name, *args, stdout=out)
+        return out.getvalue()
+
+    def test_copy_load(self):
+        out = self.load(
+            "date,country,state,city,price,currency,volume,vol_unit,price_per_liter\n"
+            "2022-05-01,MX,JAL,Guadalajara,220.5,MXN,10,l,22.05\n"
+            "2022-05-02,MX,JAL,Guadalajara,not-a-number,MXN,10,l,22.05\n"
+            "2022-05-03,MX,JAL,Zapopan,230,MXN,10,l,23\n"
+            "2022-05-04,MX,JAL,Guadalajara,240,USD,10,l,24\n"
+            "2022-05-05,MX,JAL,Guadalajara,250,MXN,10,l,25\n",
+            '--batch-size', '2', '--benchmark', '2')
+
+        self.assertEqual(gasolinePrice.objects.count(), 2)
+        price = gasolinePrice.objects.get(price=220.5)
+        self.assertEqual(price.city_id, self.city.id)
+        self.assertEqual(price.state_id, self.state.id)
+        self.assertEqual(price.vol_unit.iso_code, 'l')
+        self.assertIn('batch 1 lines 2-3: 1 loaded, 1 rejected', out)
+        self.assertIn('unknown city', out)
+        self.assertIn('unknown currency', out)
+        self.assertIn('5 rows: 2 loaded, 3 rejected', out)
+        self.assertIn('ORM save()', out)
+        bucket = PriceAggregate.objects.get(price_model='gasoline', city=self.city)
+        self.assertEqual((bucket.count, bucket.minimum, bucket.maximum), (2, 22.05, 25))
+
+    def test_wrong_header(self):
+        with self.assertRaises(CommandError):
+            self.load("date,country\n2022-05-01,MX\n")
+
+
+class BackfillPricesTests(TransactionTestCase):
+
+    def setUp(self):
+        make_geography()
+        make_geography('US', 'TX', 'Austin')
+        make_unit('l')
+        make_currency('MXN')
+        self.directory = tempfile.mkdtemp()
+        header = "date,country,state,city,price,currency,volume,vol_unit,price_per_liter\n"
+        files = {
+            'mx_2022_01.csv': "2022-01-01,MX,JAL,Guadalajara,220,MXN,10,l,22\n",
+            'mx_2022_02.csv': "2022-02-01,MX,JAL,Guadalajara,230,MXN,10,l,23\n",
+            'mixed.csv': "2022-03-01,MX,JAL,Guadalajara,240,MXN,10,l,24\n"
+                         "2022-03-01,US,TX,Austin,40,MXN,10,l,4\n",
+        }
+        for name, rows in files.items():
+            with open(os.path.join(self.directory, name), 'w') as file:
+                file.write(header + rows)
+
+    def tearDown(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        os.rmdir(self.directory)
+
+    def test_partition_by_country(self):
+        paths = sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory))
+        with tempfile.TemporaryDirectory() as parts:
+            partitions = partition_by_country(paths, parts)
+            self.assertEqual(sorted(partitions), ['MX', 'US'])
+            self.assertEqual(len(partitions['MX']), 3)
+            self.assertEqual(len(partitions['US']), 1)
+
+    def test_parallel_backfill(self):
+        out = StringIO()
+        call_command('backfillprices', 'gasoline', self.directory, '--workers', '2',
+                     stdout=out, stderr=StringIO())
+        self.assertIn('4 files, 0 failed, 4 rows: 4 loaded', out.getvalue())
+        self.assertEqual(gasolinePrice.objects.count(), 4)
+        self.assertEqual(gasolinePrice.objects.filter(country__iso_code='US').count(), 1)
+
+    def test_unexpected_error_fails_one_file(self):
+        path = os.path.join(self.directory, 'mx_2022_01.csv')
+        with mock.patch.object(PriceCopyLoader, 'load', side_effect=KeyError('price')):
+            result = load_file('gasoline', path)
+        self.assertEqual(result['error'], "KeyError: 'price'")
+        self.assertEqual(result['path'], path)
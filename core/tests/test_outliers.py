@@ -0,0 +1,131 @@
+import os
+import tempfile
+from datetime import date
+from io import StringIO
+
+import numpy as np
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from core import outliers
+from core.models import FoodPrice, MedicinePrice, PriceAggregate, PriceFlag, PriceStats
+from core.prices import PRICE_SPECS
+from core.tests.factories import make_currency, make_food, make_geography, make_medicine, make_unit, make_vendor
+
+
+class EstimateTests(SimpleTestCase):
+
+    def test_streaming_estimate_follows_the_sample(self):
+        rng = np.random.default_rng(7)
+        logs = rng.normal(3.0, 0.2, 2000)
+        count, median, mad = 0, 0.0, 0.0
+        for log in logs:
+            count, median, mad = outliers.estimate(count, median, mad, [log])
+        self.assertEqual(count, 2000)
+        self.assertAlmostEqual(median, 3.0, delta=0.05)
+        # MAD of a normal distribution is 0.6745 sigma
+        self.assertAlmostEqual(mad, 0.2 * 0.6745, delta=0.04)
+
+    def test_batches_start_exact(self):
+        self.assertEqual(outliers.estimate(0, 0.0, 0.0, [1.0, 2.0, 4.0]), (3, 2.0, 1.0))
+        count, median, _ = outliers.estimate(3, 2.0, 1.0, [9.0] * 100)
+        self.assertEqual(count, 103)
+        self.assertLessEqual(median, 9.0)
+
+
+class ScreenTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country, cls.state, cls.city = make_geography()
+        cls.vendor = make_vendor(cls.country)
+        cls.food = make_food()
+
+    def submit(self, price, day=1):
+        return FoodPrice.objects.create(
+            date=date(2022, 3, day), country=self.country, state=self.state, city=self.city,
+            vendor=self.vendor, food=self.food, price=price, weight_unit=self.food.weight_unit,
+            weight=1, weight_kg=1)
+
+    def submit_usual(self):
+        for day, price in enumerate([20, 21, 19, 20, 22, 18, 20, 21, 19, 20], start=1):
+            self.submit(price, day)
+
+    def test_flags_typos(self):
+        self.submit_usual()
+        typo = self.submit(2000)
+        self.submit(23)
+        flag = PriceFlag.objects.get()
+        self.assertEqual((flag.price_id, flag.status), (typo.pk, PriceFlag.FLAGGED))
+        self.assertGreater(flag.score, outliers.DEFAULT_THRESHOLD)
+        stats = PriceStats.objects.get(price_model='food', city=self.city, item_id=self.food.pk)
+        self.assertEqual(stats.count, 11)
+        self.assertAlmostEqual(np.exp(stats.median), 20, delta=1)
+        # flagged rows still count in flag mode
+        self.assertEqual(PriceAggregate.objects.get(price_model='food').maximum, 2000)
+
+    @override_settings(OUTLIER_MODE='quarantine')
+    def test_quarantine_until_accepted(self):
+        self.submit_usual()
+        typo = self.submit(2000)
+        bucket = PriceAggregate.objects.get(price_model='food')
+        self.assertEqual((bucket.count, bucket.maximum), (10, 22))
+        typo.price = 1900
+        typo.save()
+        self.assertEqual(PriceAggregate.objects.get(price_model='food').count, 10)
+        outliers.review(PriceFlag.objects.get(), PriceFlag.ACCEPTED)
+        self.assertEqual(PriceAggregate.objects.get(price_model='food').maximum, 1900)
+        # the seeded statistics leave out the rows still flagged
+        self.submit(2100)
+        outliers.rebuild(PRICE_SPECS['food'])
+        self.assertEqual(PriceStats.objects.get().count, 11)
+
+    def test_medicine_prices(self):
+        # MedicinePrice.Medicine_id must be quoted in the raw SQL
+        spec = PRICE_SPECS['medicine']
+        medicine, currency = make_medicine(), make_currency('MXN')
+        rows = [MedicinePrice(date=date(2022, 3, day), country=self.country, state=self.state,
+                              city=self.city, vendor=self.vendor, Medicine=medicine, price=price,
+                              currency=currency)
+                for day, price in enumerate([20, 21, 19, 20, 22, 18, 20, 21, 19, 20, 2000], start=1)]
+        for row in rows[:10]:
+            row.save()
+        self.assertEqual(outliers.rebuild(spec), 1)
+        typo = MedicinePrice.objects.bulk_create(rows[10:])[0]
+        self.assertEqual(outliers.screen_rows(spec, spec.table, 'p.id = %s', [typo.pk]), 1)
+        flag = PriceFlag.objects.get()
+        self.assertEqual((flag.price_model, flag.price_id), ('medicine', typo.pk))
+
+    @override_settings(OUTLIER_MODE='off')
+    def test_off(self):
+        self.submit(20)
+        self.assertFalse(PriceStats.objects.exists())
+
+
+@override_settings(OUTLIER_MODELS=('gasoline',), OUTLIER_MIN_COUNT=5)
+class ScreenRowsTests(TransactionTestCase):
+
+    def setUp(self):
+        self.country, self.state, self.city = make_geography()
+        make_unit('l')
+        make_currency('MXN')
+
+    def load(self, prices):
+        lines = ["date,country,state,city,price,currency,volume,vol_unit,price_per_liter"]
+        lines += [f"2022-05-{day:02d},MX,JAL,Guadalajara,{price * 10},MXN,10,l,{price}"
+                  for day, price in enumerate(prices, start=1)]
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('\n'.join(lines) + '\n')
+        self.addCleanup(os.remove, file.name)
+        out = StringIO()
+        call_command('loadprices', 'gasoline', file.name, stdout=out)
+        return out.getvalue()
+
+    def test_bulk_load_is_screened_in_batch(self):
+        self.assertIn('1 flagged', self.load([22, 23, 21, 22, 2200, 22, 24]))
+        stats = PriceStats.objects.get(price_model='gasoline')
+        self.assertEqual(stats.count, 6)
+        self.assertAlmostEqual(np.exp(stats.median), 22)
+        self.assertEqual(PriceFlag.objects.get().value, 2200)
+        self.assertIn('2 flagged', self.load([23, 0.2, 300]))
+        self.assertEqual(PriceStats.objects.get(price_model='gasoline').count, 7)
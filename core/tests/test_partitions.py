@@ -0,0 +1,82 @@
+import gzip
+import os
+import re
+import tempfile
+from datetime import date, datetime, timedelta, timezone
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+
+from core import awards, partitions
+from core.models import Activity, ActivityLog
+from core.partitions import ACTIVITY_LOG, add_months
+from core.tests.factories import make_user
+
+
+def utc(day):
+    return datetime(day.year, day.month, day.day, 12, tzinfo=timezone.utc)
+
+
+class ActivityLogPartitionTests(TestCase):
+
+    def setUp(self):
+        self.user = make_user()
+        self.this_month = date.today().replace(day=1)
+
+    def log(self, day):
+        log = ActivityLog.objects.create(user=self.user, activity='submit', points=1)
+        ActivityLog.objects.filter(pk=log.pk).update(created_at=utc(day))
+        return log
+
+    def partition_of(self, log):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tableoid::regclass::text FROM core_activitylog WHERE id = %s",
+                           [log.pk])
+            return cursor.fetchone()[0]
+
+    def test_rows_go_to_their_month(self):
+        self.assertTrue(partitions.is_partitioned('core_activitylog'))
+        log = ActivityLog.objects.create(user=self.user, activity='submit', points=1)
+        self.assertEqual(self.partition_of(log), ACTIVITY_LOG.partition_name(self.this_month))
+        far = self.log(add_months(self.this_month, 12))
+        self.assertEqual(self.partition_of(far), 'core_activitylog_default')
+
+    def test_week_queries_prune_partitions(self):
+        Activity.objects.create(code='submit', name='Submit', points=1, max_per_day=5)
+        window = awards.windows(self.user.pk, Activity.objects.get())[1]
+        plan = ActivityLog.objects.filter(user=self.user, activity='submit',
+                                          created_at__gte=window.start,
+                                          created_at__lt=window.end).explain()
+        scanned = set(re.findall(r' on (core_activitylog_\w+)', plan))
+        self.assertTrue(scanned)
+        self.assertLessEqual(len(scanned), 2, plan)
+
+    def test_new_partitions_take_their_rows_from_default(self):
+        month = add_months(self.this_month, 8)
+        log = self.log(month)
+        self.assertTrue(partitions.create(ACTIVITY_LOG, month))
+        self.assertFalse(partitions.create(ACTIVITY_LOG, month))
+        self.assertEqual(self.partition_of(log), ACTIVITY_LOG.partition_name(month))
+        out = StringIO()
+        call_command('maintain_partitions', '--ahead', '5', stdout=out)
+        self.assertIn(ACTIVITY_LOG.partition_name(add_months(self.this_month, 5)), out.getvalue())
+
+    def test_expired_partitions_are_archived(self):
+        old = add_months(self.this_month, -30)
+        partitions.create(ACTIVITY_LOG, old)
+        self.log(old + timedelta(days=3))
+        self.log(date.today())
+        with tempfile.TemporaryDirectory() as directory:
+            out = StringIO()
+            call_command('maintain_partitions', 'activitylog', '--retention', '24',
+                         '--archive-dir', directory, stdout=out)
+            name = ACTIVITY_LOG.partition_name(old)
+            self.assertIn(f'archived {name}, 1 rows', out.getvalue())
+            with gzip.open(os.path.join(directory, f'{name}.csv.gz'), 'rt') as file:
+                lines = file.read().splitlines()
+            self.assertEqual(lines[0], 'id,activity,points,created_at,user_id')
+            self.assertEqual(len(lines), 2)
+        self.assertNotIn(old, partitions.partitions(ACTIVITY_LOG))
+        self.assertEqual(ActivityLog.objects.count(), 1)
@@ -0,0 +1,89 @@
+from datetime import date, timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from core import partitions
+from core.models import PriceAggregate, gasolinePrice
+from core.partitions import OnlinePartitioning
+from core.prices import PRICE_SPECS
+from core.tests.factories import make_currency, make_geography, make_unit
+
+GASOLINE = PRICE_SPECS['gasoline']
+
+
+@override_settings(PARTITIONED_PRICES={'gasoline': 'year'})
+class PricePartitionTests(TestCase):
+
+    def setUp(self):
+        self.country, self.state, self.city = make_geography()
+        self.unit = make_unit('l')
+        self.currency = make_currency('MXN')
+        for offset in range(0, 900, 30):
+            self.add(date(2020, 1, 1) + timedelta(days=offset))
+
+    def add(self, day, price_per_liter=20):
+        return gasolinePrice.objects.create(
+            date=day, country=self.country, state=self.state, city=self.city, price=1,
+            currency=self.currency, volume=1, vol_unit=self.unit, price_per_liter=price_per_liter)
+
+    def test_writes_during_the_copy_are_kept(self):
+        conversion = OnlinePartitioning(partitions.price_table(GASOLINE, 'year'))
+        self.assertTrue(conversion.prepare(date(2022, 6, 1), ahead=1))
+        last_id, copied = conversion.copy_batch(0, batch_size=10)
+        self.assertEqual(copied, 10)
+        # rows changed on both sides of the copied range, while copying
+        first = gasolinePrice.objects.order_by('id').first()
+        first.date = date(2023, 2, 1)
+        first.save()
+        newest = gasolinePrice.objects.order_by('id').last()
+        newest.delete()
+        added = self.add(date(2022, 12, 31))
+        while last_id is not None:
+            last_id, _ = conversion.copy_batch(last_id, batch_size=10)
+        rows, partitioned_rows = conversion.verify()
+        self.assertEqual(rows, partitioned_rows)
+        conversion.swap()
+
+        self.assertTrue(partitions.is_partitioned(GASOLINE.table))
+        self.assertEqual(list(partitions.partitions(partitions.partitioned_tables()['gasoline'])),
+                         [date(2020, 1, 1), date(2021, 1, 1), date(2022, 1, 1), date(2023, 1, 1)])
+        self.assertEqual(gasolinePrice.objects.get(pk=first.pk).date, date(2023, 2, 1))
+        self.assertFalse(gasolinePrice.objects.filter(pk=newest.pk).exists())
+        self.assertTrue(gasolinePrice.objects.filter(pk=added.pk).exists())
+        # the ORM, the sequence and the aggregates keep working
+        row = self.add(date(2022, 7, 1), 30)
+        self.assertGreater(row.pk, added.pk)
+        self.assertEqual(PriceAggregate.objects.get(price_model='gasoline', month=date(2022, 7, 1)).maximum, 30)
+        plan = gasolinePrice.objects.filter(date__gte=date(2022, 6, 1), date__lt=date(2022, 7, 1)).explain()
+        self.assertIn('core_gasolineprice_p2022', plan)
+        self.assertNotIn('core_gasolineprice_p2021', plan)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('partition_prices', 'gasoline', '--batch-size', '7', stdout=out)
+        self.assertIn('core_gasolineprice is partitioned by year', out.getvalue())
+        self.assertEqual(gasolinePrice.objects.count(), 30)
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM core_gasolineprice_unpartitioned")
+            self.assertEqual(cursor.fetchone()[0], 30)
+        call_command('maintain_partitions', 'gasoline', stdout=out)
+        out = StringIO()
+        call_command('partition_prices', 'gasoline', stdout=out)
+        self.assertIn('already partitioned', out.getvalue())
+
+    def test_command_resumes_after_the_copied_ids(self):
+        conversion = OnlinePartitioning(partitions.price_table(GASOLINE, 'year'))
+        conversion.prepare(date(2022, 6, 1), ahead=1)
+        self.assertEqual(conversion.copied_id(), 0)
+        last_id, _ = conversion.copy_batch(0, batch_size=10)
+        # a new row reaches the copy through the trigger, above the uncopied ids
+        self.add(date(2022, 6, 2))
+        self.assertEqual(conversion.copied_id(), last_id)
+        out = StringIO()
+        call_command('partition_prices', 'gasoline', '--no-swap', stdout=out)
+        self.assertIn(f'resuming the copy to {conversion.shadow} after id {last_id}', out.getvalue())
+        self.assertIn('copied 20 rows in', out.getvalue())
+        self.assertIn('31 rows in sync', out.getvalue())
@@ -0,0 +1,74 @@
+from datetime import date, timedelta
+
+from django.db import connection
+from django.test import TestCase
+
+from core.models import FoodPrice
+from core.prices import PRICE_SPECS
+from core.tests.factories import make_food, make_geography, make_unit, make_vendor
+
+
+class PriceQueryPlanTests(TestCase):
+    """The canonical price queries must be answered from the composite
+    (city, date), (country, date) and (item, city, date) indexes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        country, state, cls.city = make_geography()
+        other_country, other_state, other_city = make_geography('US', 'TX', 'Austin')
+        unit = make_unit('kg', 'weight')
+        vendor = make_vendor(country)
+        foods = [make_food(f'food {n}', unit) for n in range(20)]
+        cls.food = foods[0]
+        start = date(2020, 1, 1)
+        FoodPrice.objects.bulk_create([
+            FoodPrice(date=start + timedelta(days=n % 700), country=c, state=s, city=ct,
+                      vendor=vendor, food=foods[n % len(foods)], price=n % 50 + 1,
+                      weight_unit=unit, weight=1, weight_kg=1)
+            for n in range(5000)
+            for c, s, ct in [(country, state, cls.city) if n % 3 else
+                             (other_country, other_state, other_city)]])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE core_foodprice')
+
+    def plan(self, queryset):
+        # the test tables are small enough to prefer sequential scans,
+        # so only ask whether a usable index exists. Bitmap scans are off
+        # too, they make the single column foreign key indexes a near tie
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_bitmapscan = off')
+        return queryset.explain()
+
+    def index_name(self, model, fields):
+        for index in model._meta.indexes:
+            if index.fields == fields:
+                return index.name
+        self.fail(f'{model.__name__} has no index on {fields}')
+
+    def test_latest_prices_in_city(self):
+        for spec in PRICE_SPECS.values():
+            queryset = spec.model.objects.filter(city_id=self.city.id).order_by('-date')[:50]
+            self.assertIn(self.index_name(spec.model, ['city', 'date']), self.plan(queryset))
+
+    def test_prices_in_country_since(self):
+        for spec in PRICE_SPECS.values():
+            queryset = spec.model.objects.filter(
+                country_id=self.city.country_id, date__gte=date(2021, 1, 1))
+            self.assertIn(self.index_name(spec.model, ['country', 'date']), self.plan(queryset))
+
+    def test_item_history(self):
+        for spec in PRICE_SPECS.values():
+            if not spec.item_field:
+                continue
+            queryset = spec.model.objects.filter(
+                **{f'{spec.item_field}_id': self.food.id, 'city_id': self.city.id}).order_by('date')
+            self.assertIn(self.index_name(spec.model, [spec.item_field, 'city', 'date']),
+                          self.plan(queryset))
+
+    def test_index_scan_on_loaded_data(self):
+        # planner left free to choose: the loaded data is selective enough
+        queryset = FoodPrice.objects.filter(food=self.food, city=self.city).order_by('-date')[:20]
+        plan = queryset.explain()
+        self.assertIn('Index Scan', plan)
+        self.assertNotIn('Seq Scan', plan)
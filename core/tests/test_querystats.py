@@ -0,0 +1,70 @@
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework.test import APITestCase
+
+from core import querystats
+from core.models import Country
+from core.tests.factories import make_geography, make_user
+
+
+class RecorderTests(TestCase):
+
+    def test_duplicates_by_signature(self):
+        make_geography()
+        recorder = querystats.QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for pk in (1, 2, 3):
+                Country.objects.filter(pk=pk).first()
+            list(Country.objects.filter(pk__in=[1, 2]))
+            list(Country.objects.filter(pk__in=[1, 2, 3]))
+            Country.objects.count()
+        self.assertEqual(recorder.count, 6)
+        self.assertEqual([count for _, count in recorder.duplicates()], [3, 2])
+        self.assertIn('IN (...)', recorder.duplicates()[1][0])
+        self.assertGreater(recorder.db_time, 0)
+
+
+@override_settings(QUERY_STATS_SAMPLE_RATE=1.0)
+class MiddlewareTests(APITestCase):
+
+    def setUp(self):
+        querystats.reset()
+        self.addCleanup(querystats.reset)
+
+    def test_endpoint_percentiles(self):
+        for _ in range(3):
+            self.client.get('/api/prices/food/')
+        stats = querystats.snapshot()['GET api/prices/food/']
+        self.assertEqual(stats['requests'], 3)
+        self.assertLessEqual(stats['wall_ms_p50'], stats['wall_ms_p99'])
+        self.assertGreaterEqual(stats['queries_max'], 1)
+
+    async def test_async_chain(self):
+        # the middleware stays async, the sync view queries from a thread
+        await self.async_client.get('/api/prices/food/')
+        stats = querystats.snapshot()['GET api/prices/food/']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreaterEqual(stats['queries_max'], 1)
+
+    @override_settings(QUERY_STATS_MAX_QUERIES=0)
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs('core.querystats', 'WARNING') as logs:
+            self.client.get('/api/prices/food/')
+        self.assertIn('GET api/prices/food/', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(QUERY_STATS_SAMPLE_RATE=0)
+    def test_unsampled(self):
+        self.client.get('/api/prices/food/')
+        self.assertEqual(querystats.snapshot(), {})
+
+    def test_metrics_are_for_staff(self):
+        user = make_user()
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+        user.is_staff = True
+        user.save()
+        self.client.get('/api/prices/food/')
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('GET api/prices/food/', response.json()['endpoints'])
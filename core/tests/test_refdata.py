@@ -0,0 +1,60 @@
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.test import TestCase
+
+from core import refdata
+from core.models import Country
+from core.tests.factories import make_geography
+
+
+class RefDataTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.country, self.state, self.city = make_geography()
+        city = self.city
+        city.set_current_language('es')
+        city.name = 'Guadalajara ES'
+        city.save()
+        refdata.sync()
+
+    def test_lookups_are_cached_with_translations(self):
+        for name in ('country', 'state', 'city'):
+            refdata.table(name)
+        with self.assertNumQueries(0):
+            self.assertEqual(refdata.country_by_iso('MX').pk, self.country.pk)
+            self.assertEqual(refdata.state_by_iso('JAL').pk, self.state.pk)
+            city = refdata.city(self.city.id)
+            self.assertEqual(city.safe_translation_getter('name', language_code='en'), 'Guadalajara')
+            self.assertEqual(city.safe_translation_getter('name', language_code='es'),
+                             'Guadalajara ES')
+            self.assertEqual(refdata.city_by_name(self.state.id, 'guadalajara es', 'es'), city)
+            self.assertIsNone(refdata.city_by_name(self.state.id, 'Monterrey'))
+            self.assertIsNone(refdata.country_by_iso('XX'))
+
+    def test_writes_bump_the_version(self):
+        version = refdata.current_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Country.objects.create(iso_code='US', name_en='US', name='United States',
+                                   language=self.country.language)
+        self.assertGreater(refdata.current_version(), version)
+        self.assertEqual(refdata.country_by_iso('US').name, 'United States')
+
+    def test_other_process_changes_are_picked_up_on_sync(self):
+        self.assertEqual(refdata.country_by_iso('MX').name_en, 'MX')
+        # a change made by another process: no signal here, only the version moves
+        Country.objects.filter(pk=self.country.pk).update(name_en='Mexico')
+        refdata.sync()
+        self.assertEqual(refdata.country_by_iso('MX').name_en, 'MX')
+        cache.incr(refdata.VERSION_KEY)
+        refdata.sync()
+        self.assertEqual(refdata.country_by_iso('MX').name_en, 'Mexico')
+
+    def test_middleware_syncs_once_per_request(self):
+        self.client.get('/api/')
+        self.assertEqual(refdata._version, refdata.current_version())
+
+    async def test_middleware_syncs_in_an_async_chain(self):
+        await sync_to_async(cache.incr)(refdata.VERSION_KEY)
+        await self.async_client.get('/api/')
+        self.assertEqual(refdata._version, await sync_to_async(refdata.current_version)())
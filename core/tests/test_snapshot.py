@@ -0,0 +1,78 @@
+import glob
+import shutil
+import tempfile
+from datetime import date, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import snapshot
+from core.models import CurrencyConv, gasolinePrice
+from core.prices import PRICE_SPECS
+from core.tests.factories import make_currency, make_geography, make_unit
+
+
+@override_settings(SNAPSHOT_LAG=timedelta(0))
+class SnapshotTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country, cls.state, cls.city = make_geography()
+        cls.unit = make_unit('l')
+        cls.mxn = make_currency('MXN')
+        cls.usd = make_currency('USD')
+        CurrencyConv.objects.create(date_from=date(2021, 1, 1), date_to=date(2022, 12, 31),
+                                    currency_from=cls.usd, currency_to=cls.mxn, rate=20)
+        gasolinePrice.objects.bulk_create([
+            gasolinePrice(date=date(2021, 12, 25) + timedelta(days=n), country=cls.country,
+                          state=cls.state, city=cls.city, price=n, currency=cls.mxn, volume=1,
+                          vol_unit=cls.unit, price_per_liter=20 * n)
+            for n in range(10)])
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.spec = PRICE_SPECS['gasoline']
+
+    def test_year_partitions_and_columns(self):
+        self.assertEqual(snapshot.write_model(self.spec, self.root, to_currency='USD'), 10)
+        table = snapshot.read(self.root, 'gasoline', years=[2022])
+        self.assertEqual(table.num_rows, 3)
+        self.assertTrue(pa.types.is_dictionary(table.schema.field('country').type))
+        metadata = pq.ParquetFile(glob.glob(f'{self.root}/gasoline/year=2022/*.parquet')[0]).metadata
+        city = metadata.row_group(0).column(metadata.schema.names.index('city'))
+        self.assertIn('RLE_DICTIONARY', city.encodings)
+        self.assertEqual(set(table.column('country').to_pylist()), {'MX'})
+        row = snapshot.read(self.root, 'gasoline').sort_by('date').to_pylist()[9]
+        self.assertEqual(row['value'], 180)
+        self.assertEqual(row['value_USD'], 9)
+
+    def test_incremental(self):
+        snapshot.write_model(self.spec, self.root)
+        self.assertEqual(snapshot.write_model(self.spec, self.root), 0)
+        price = gasolinePrice.objects.order_by('date').first()
+        price.price_per_liter = 5
+        price.save()
+        self.assertEqual(snapshot.write_model(self.spec, self.root, now=timezone.now() + timedelta(seconds=1)), 1)
+        table = snapshot.read(self.root, 'gasoline', columns=['price_per_liter'])
+        self.assertEqual(table.num_rows, 10)
+        self.assertEqual(dict(zip(table.column('id').to_pylist(), table.column('price_per_liter').to_pylist()))[
+            price.pk], 5)
+
+    def test_deleted_rows_are_dropped(self):
+        snapshot.write_model(self.spec, self.root)
+        price = gasolinePrice.objects.order_by('date').first()
+        price.delete()
+        self.assertEqual(snapshot.write_model(self.spec, self.root, now=timezone.now() + timedelta(seconds=1)), 0)
+        ids = snapshot.read(self.root, 'gasoline').column('id').to_pylist()
+        self.assertEqual(len(ids), 9)
+        self.assertNotIn(price.pk, ids)
+        self.assertEqual(snapshot.read(self.root, 'gasoline', years=[2021]).num_rows, 6)
+
+    def test_command(self):
+        call_command('snapshot_prices', self.root, 'gasoline', 'food', stdout=open('/dev/null', 'w'))
+        self.assertEqual(snapshot.load_state(self.root)['gasoline']['rows'], 10)
+        self.assertEqual(snapshot.load_state(self.root)['food']['rows'], 0)
@@ -0,0 +1,116 @@
+import json
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from core import refdata, units
+from core.models import FoodPrice, PriceAggregate, SubmissionBatch, gasolinePrice
+from core.tests.factories import make_currency, make_food, make_geography, make_unit, make_user, make_vendor
+
+
+class BatchSubmissionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country, cls.state, cls.city = make_geography()
+        make_unit('l')
+        make_currency('MXN')
+        cls.kg = make_unit('kg', 'weight')
+        cls.food = make_food(unit=cls.kg)
+        cls.vendor = make_vendor(cls.country)
+        cls.user = make_user()
+        cls.user.is_active = True
+        cls.user.save()
+        cls.token = Token.objects.create(user=cls.user)
+
+    def gasoline(self, price=22.5, day=1):
+        return {'model': 'gasoline', 'date': f'2022-06-{day:02}', 'country': 'MX', 'state': 'JAL',
+                'city': self.city.pk, 'price': price, 'currency': 'MXN', 'volume': 1, 'vol_unit': 'l',
+                'price_per_liter': price}
+
+    def food_row(self, price=30):
+        return {'model': 'food', 'date': '2022-06-01', 'country': 'MX', 'state': 'JAL', 'city': self.city.pk,
+                'vendor': self.vendor.pk, 'food': self.food.pk, 'price': price, 'weight_unit': 'kg',
+                'weight': 1, 'weight_kg': 1}
+
+    def post(self, rows, key=None, **headers):
+        headers.setdefault('HTTP_AUTHORIZATION', f'Token {self.token.key}')
+        if key:
+            headers['HTTP_IDEMPOTENCY_KEY'] = key
+        return self.client.post('/api/submissions/', json.dumps({'rows': rows}),
+                                content_type='application/json', **headers)
+
+    def test_mixed_models_in_one_batch(self):
+        # the process wide caches are loaded once, not per batch
+        refdata.table('city'), refdata.table('state'), units.graph()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post([self.gasoline(), self.food_row(), self.gasoline(23, day=2)])
+        self.assertEqual(response.status_code, 201)
+        body = response.json()
+        self.assertEqual(body['created'], 3)
+        self.assertEqual([row['model'] for row in body['results']], ['gasoline', 'food', 'gasoline'])
+        self.assertEqual(gasolinePrice.objects.filter(created_by=self.user).count(), 2)
+        self.assertEqual(FoodPrice.objects.get().pk, body['results'][1]['id'])
+        self.assertEqual(PriceAggregate.objects.get(price_model='gasoline').count, 2)
+        # the queries of a batch do not depend on its number of rows
+        with CaptureQueriesContext(connection) as more:
+            self.post([self.gasoline(20 + day, day) for day in range(3, 23)] + [self.food_row(31)])
+        self.assertEqual(len(more), len(queries))
+
+    def test_invalid_rows_are_reported(self):
+        other_state = dict(self.gasoline(), state='XX')
+        rows = [self.gasoline(), {'model': 'nope'}, dict(self.gasoline(), price='abc'), other_state,
+                dict(self.gasoline(), volume=None, colour='red')]
+        results = self.post(rows).json()['results']
+        self.assertEqual([row['status'] for row in results],
+                         ['created', 'invalid', 'invalid', 'invalid', 'invalid'])
+        self.assertIn('model', results[1]['errors'])
+        self.assertIn('price', results[2]['errors'])
+        self.assertIn('state', results[3]['errors'])
+        self.assertEqual(set(results[4]['errors']), {'volume', 'colour'})
+        self.assertEqual(gasolinePrice.objects.count(), 1)
+
+    def test_duplicates(self):
+        self.post([self.gasoline()])
+        results = self.post([self.gasoline(), self.gasoline(22.6), self.gasoline(22.6)]).json()['results']
+        self.assertEqual([row['status'] for row in results], ['duplicate', 'created', 'duplicate'])
+        self.assertEqual(gasolinePrice.objects.filter(is_duplicate=False).count(), 2)
+        self.assertEqual(PriceAggregate.objects.get(price_model='gasoline').count, 2)
+
+    def test_idempotent_retry(self):
+        first = self.post([self.gasoline()], key='batch-1')
+        retry = self.post([self.gasoline()], key='batch-1')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(gasolinePrice.objects.count(), 1)
+        self.assertEqual(SubmissionBatch.objects.get().created, 1)
+        reused = self.post([self.gasoline(25)], key='batch-1')
+        self.assertEqual(reused.status_code, 422)
+        # keys are per user
+        other = make_user('other@example.com')
+        other.is_active = True
+        other.save()
+        other = Token.objects.create(user=other)
+        response = self.post([self.gasoline(25)], key='batch-1', HTTP_AUTHORIZATION=f'Token {other.key}')
+        self.assertEqual(response.status_code, 201)
+
+    @override_settings(SUBMISSION_MAX_ROWS=2)
+    def test_rejected_batches(self):
+        self.assertEqual(self.post([self.gasoline()], HTTP_AUTHORIZATION='').status_code, 401)
+        self.assertEqual(self.post([self.gasoline(day=day) for day in (1, 2, 3)]).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+        response = self.client.get('/api/submissions/', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(gasolinePrice.objects.count(), 0)
+
+    def test_numbers_out_of_range(self):
+        rows = [self.gasoline(1e300), self.gasoline(float('inf'), day=2),
+                dict(self.gasoline(day=3), volume=float('nan'))]
+        results = self.post(rows).json()['results']
+        self.assertEqual([row['status'] for row in results], ['created', 'invalid', 'invalid'])
+        self.assertEqual(results[1]['errors'], {'price': ['Expected a finite number.'],
+                                                'price_per_liter': ['Expected a finite number.']})
+        self.assertIn('volume', results[2]['errors'])
@@ -0,0 +1,78 @@
+import csv
+import os
+import tempfile
+
+from django.db.models import F, Sum
+from django.test import SimpleTestCase, TestCase
+
+from core import synthetic
+from core.benchmarks import compare
+from core.models import City, FoodPrice, PriceAggregate, Vendor, gasolinePrice
+from core.pgcopy import PriceCopyLoader
+from core.prices import PRICE_SPECS
+
+
+class SyntheticTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reference = synthetic.create_reference(countries=2, states=2, cities=2, vendors=2, foods=3,
+                                                   medicines=2, transport_vendors=2)
+
+    def test_reference(self):
+        self.assertEqual(len(self.reference.country_codes), 2)
+        self.assertEqual(len(self.reference.cities), 8)
+        self.assertEqual(len(self.reference.vendors), 4)
+        # a second call reuses the world
+        self.assertEqual(len(synthetic.create_reference(countries=5).cities), 8)
+
+    def test_insert_rows(self):
+        for key, spec in PRICE_SPECS.items():
+            result = synthetic.insert_rows(spec, self.reference, 200, batch_size=150, duplicates=0.1)
+            self.assertEqual(result['rows'], 200)
+            rows = spec.model.objects.all()
+            self.assertEqual(rows.count(), 200, key)
+            self.assertFalse(rows.filter(fingerprint__isnull=True).exists(), key)
+            self.assertEqual(rows.filter(is_duplicate=True).count(), result['duplicates'])
+            self.assertGreater(result['duplicates'], 0, key)
+            # every row is in the state and country of its city
+            self.assertFalse(rows.exclude(state_id=F('city__state_id')).exists(), key)
+            self.assertFalse(rows.exclude(country_id=F('city__country_id')).exists(), key)
+            counted = PriceAggregate.objects.filter(price_model=key).aggregate(Sum('count'))['count__sum']
+            self.assertEqual(counted, 200 - result['duplicates'], key)
+        for price in gasolinePrice.objects.all():
+            self.assertAlmostEqual(price.price, price.volume * price.price_per_liter, places=6)
+        vendors = dict(Vendor.objects.values_list('id', 'country_id'))
+        for vendor_id, country_id in FoodPrice.objects.values_list('vendor_id', 'country_id'):
+            self.assertEqual(vendors[vendor_id], country_id)
+
+    def test_write_csv_loads(self):
+        spec = PRICE_SPECS['food']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'food.csv')
+            synthetic.write_csv(spec, self.reference, path, 50)
+            with open(path, newline='', encoding='utf-8') as file:
+                loader = PriceCopyLoader(spec).load(csv.reader(file))
+        self.assertEqual(loader.errors, [])
+        self.assertEqual(FoodPrice.objects.count(), 50)
+        self.assertFalse(FoodPrice.objects.filter(item_path='').exists())
+
+    def test_clear(self):
+        synthetic.insert_rows(PRICE_SPECS['water'], self.reference, 20)
+        self.assertEqual(synthetic.clear(), 20)
+        self.assertFalse(City.objects.exists())
+        self.assertFalse(PriceAggregate.objects.exists())
+        with self.assertRaises(ValueError):
+            synthetic.Reference()
+
+
+class CompareTests(SimpleTestCase):
+
+    def test_regressions(self):
+        baseline = {'reads': {'page_ms': 10.0, 'page_queries': 1, 'model': 'food'},
+                    'ingest': {'copy_rows_per_s': 1000.0}}
+        self.assertEqual(compare({'reads': {'page_ms': 11.5, 'page_queries': 3, 'model': 'gas'},
+                                  'ingest': {'copy_rows_per_s': 850.0}}, baseline), [])
+        self.assertEqual(compare({'reads': {'page_ms': 12.5}, 'ingest': {'copy_rows_per_s': 700.0},
+                                  'new': {'other_ms': 1.0}}, baseline),
+                         [('reads', 'page_ms', 10.0, 12.5), ('ingest', 'copy_rows_per_s', 1000.0, 700.0)])
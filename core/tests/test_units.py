@@ -0,0 +1,97 @@
+import csv
+from datetime import date
+from io import StringIO
+
+import numpy as np
+from django.core.cache import cache
+from django.test import TestCase
+
+from core import refdata, units
+from core.models import FoodPrice, UnitConv
+from core.pgcopy import PriceCopyLoader
+from core.prices import PRICE_SPECS
+from core.tests.factories import make_food, make_geography, make_unit, make_vendor
+
+
+class UnitConversionTests(TestCase):
+
+    def setUp(self):
+        self.kg = make_unit('kg', 'weight')
+        self.g = make_unit('g', 'weight')
+        self.oz = make_unit('oz', 'weight')
+        self.lb = make_unit('lb', 'weight')
+        self.l = make_unit('l', 'volume')
+        UnitConv.objects.create(unit=self.kg, to_unit=self.g, conv_factor=1000)
+        UnitConv.objects.create(unit=self.lb, to_unit=self.oz, conv_factor=16)
+        UnitConv.objects.create(unit=self.oz, to_unit=self.g, conv_factor=28.349523125)
+        units.invalidate()
+
+    def test_transitive_conversions(self):
+        self.assertAlmostEqual(units.convert(1, 'lb', 'kg'), 0.45359237)
+        self.assertAlmostEqual(units.factor(self.g, self.lb), 1 / 453.59237)
+        self.assertEqual(units.factor('kg', 'kg'), 1)
+        with self.assertRaises(units.UnitConversionError):
+            units.convert(1, 'kg', 'l')
+        with self.assertRaises(units.UnitConversionError):
+            units.convert(1, 'kg', 'ton')
+
+    def test_batch_conversion_without_queries(self):
+        units.graph()
+        with self.assertNumQueries(0):
+            converted = units.convert_array([1, 500, 2, 3, 4], [self.kg.id, self.g.id, self.lb.id,
+                                                                 self.l.id, 0], 'kg')
+        np.testing.assert_allclose(converted[:3], [1, 0.5, 0.90718474])
+        self.assertTrue(np.isnan(converted[3:]).all())
+
+    def test_cache_is_invalidated_on_change(self):
+        self.assertAlmostEqual(units.convert(1, 'kg', 'g'), 1000)
+        UnitConv.objects.filter(unit=self.kg).update(conv_factor=999)
+        self.assertAlmostEqual(units.convert(1, 'kg', 'g'), 1000)
+        UnitConv.objects.get(unit=self.kg).save()
+        self.assertAlmostEqual(units.convert(1, 'kg', 'g'), 999)
+
+    def test_other_process_changes_are_picked_up_on_sync(self):
+        refdata.sync()
+        self.assertAlmostEqual(units.convert(1, 'kg', 'g'), 1000)
+        # a change made by another process: no signal here, only the version moves
+        UnitConv.objects.filter(unit=self.kg).update(conv_factor=999)
+        cache.incr(refdata.VERSION_KEY)
+        refdata.sync()
+        self.assertAlmostEqual(units.convert(1, 'kg', 'g'), 999)
+
+
+class NormalizeTests(TestCase):
+
+    def setUp(self):
+        self.country, self.state, self.city = make_geography()
+        self.kg = make_unit('kg', 'weight')
+        self.g = make_unit('g', 'weight')
+        self.oz = make_unit('oz', 'weight')
+        UnitConv.objects.create(unit=self.kg, to_unit=self.g, conv_factor=1000)
+        self.vendor = make_vendor(self.country)
+        self.food = make_food(unit=self.kg)
+
+    def test_saved_rows(self):
+        row = FoodPrice.objects.create(
+            date=date(2022, 5, 1), country=self.country, state=self.state, city=self.city,
+            vendor=self.vendor, food=self.food, price=10, weight_unit=self.g, weight=500, weight_kg=500)
+        self.assertEqual(FoodPrice.objects.get(pk=row.pk).weight_kg, 0.5)
+        # no conversion to kg, the given value is kept
+        row.weight_unit = self.oz
+        row.weight_kg = 0.25
+        row.save()
+        self.assertEqual(FoodPrice.objects.get(pk=row.pk).weight_kg, 0.25)
+
+    def test_copied_rows(self):
+        content = ("date,country,state,city,vendor,food,price,weight_unit,weight,weight_kg\n"
+                   f"2022-05-01,MX,JAL,Guadalajara,{self.vendor.pk},{self.food.pk},10,g,250,1\n"
+                   f"2022-05-02,MX,JAL,Guadalajara,{self.vendor.pk},{self.food.pk},10,oz,8,0.2\n")
+        loader = PriceCopyLoader(PRICE_SPECS['food']).load(csv.reader(StringIO(content)))
+        self.assertEqual(loader.errors, [])
+        self.assertEqual(sorted(FoodPrice.objects.values_list('weight_kg', flat=True)), [0.2, 0.25])
+        # the same row saved through the ORM gets the same fingerprint
+        copied = FoodPrice.objects.get(weight=250)
+        saved = FoodPrice.objects.create(
+            date=copied.date, country=self.country, state=self.state, city=self.city, vendor=self.vendor,
+            food=self.food, price=10, weight_unit=self.g, weight=250, weight_kg=1)
+        self.assertTrue(saved.is_duplicate)
@@ -0,0 +1,193 @@
+"""Unit conversions without database lookups.
+
+UnitConv rows say 1 unit = conv_factor to_unit. They are loaded once per
+process, read in both directions and closed transitively per UnitType, so
+lb -> g works with only lb -> oz and oz -> g rows. The closure is cached
+until a Unit or UnitConv row changes, in this process or another one: the
+change bumps the core.refdata version and every process drops its graph
+with its reference tables.
+
+    units.convert(2, 'lb', 'kg')
+    units.convert_array(weights, weight_unit_ids, 'kg')
+
+Units are given by id, iso_code or Unit instance.
+
+Price rows are normalized when they are written: the quantity of a row is
+converted to the unit of its QUANTITIES entry, e.g. FoodPrice.weight_kg
+from weight and weight_unit, which the comparable price is divided by.
+normalize() does it for instances (ORM saves, submissions),
+normalize_table() for a staging table (COPY loads).
+"""
+import math
+from collections import deque, namedtuple
+
+import numpy as np
+from django.db import connection
+
+from core import refdata
+from core.models import Unit, UnitConv
+
+
+class UnitConversionError(ValueError):
+    """The units are unknown or have no conversion path"""
+
+
+class UnitGraph:
+    """Conversion factors between every pair of connected units"""
+
+    def __init__(self, units, conversions):
+        """units: (id, iso_code, unit_type_id) rows
+        conversions: (unit_id, to_unit_id, conv_factor) rows"""
+        self.iso_codes = {iso_code: pk for pk, iso_code, _ in units}
+        self.ids = np.array(sorted(pk for pk, _, _ in units), dtype=np.int64)
+        types = {pk: unit_type for pk, _, unit_type in units}
+        edges = {pk: [] for pk in types}
+        for unit, to_unit, factor in conversions:
+            # a conversion between unit types (kg -> l) is a data error, skip it
+            if unit in types and types[unit] == types.get(to_unit) and factor:
+                edges[unit].append((to_unit, factor))
+                edges[to_unit].append((unit, 1.0 / factor))
+
+        # factors[i, j] converts self.ids[i] into self.ids[j], NaN without a path
+        position = {pk: i for i, pk in enumerate(self.ids.tolist())}
+        self.factors = np.full((len(self.ids), len(self.ids)), np.nan)
+        for start in position:
+            self.factors[position[start], position[start]] = 1.0
+            seen = {start: 1.0}
+            queue = deque([start])
+            while queue:
+                unit = queue.popleft()
+                for to_unit, factor in edges[unit]:
+                    if to_unit not in seen:
+                        seen[to_unit] = seen[unit] * factor
+                        self.factors[position[start], position[to_unit]] = seen[to_unit]
+                        queue.append(to_unit)
+        self.position = position
+
+    @classmethod
+    def load(cls):
+        return cls(list(Unit.objects.values_list('id', 'iso_code', 'unit_type_id')),
+                   list(UnitConv.objects.values_list('unit_id', 'to_unit_id', 'conv_factor')))
+
+    def unit_id(self, unit):
+        if isinstance(unit, Unit):
+            unit = unit.pk
+        if isinstance(unit, str):
+            if unit not in self.iso_codes:
+                raise UnitConversionError(f'unknown unit {unit}')
+            unit = self.iso_codes[unit]
+        if unit not in self.position:
+            raise UnitConversionError(f'unknown unit {unit}')
+        return unit
+
+    def factor(self, from_unit, to_unit):
+        """Returns f so that value from_unit = value * f to_unit"""
+        source, target = self.unit_id(from_unit), self.unit_id(to_unit)
+        factor = self.factors[self.position[source], self.position[target]]
+        if np.isnan(factor):
+            raise UnitConversionError(f'no conversion from {from_unit} to {to_unit}')
+        return float(factor)
+
+    def convert(self, value, from_unit, to_unit):
+        return value * self.factor(from_unit, to_unit)
+
+    def convert_array(self, values, from_units, to_unit):
+        """Converts values[k] given in from_units[k] (unit ids) to to_unit.
+        Returns a float array, NaN where a unit is unknown or not convertible"""
+        values = np.asarray(values, dtype=np.float64)
+        from_units = np.asarray(from_units, dtype=np.int64)
+        column = self.factors[:, self.position[self.unit_id(to_unit)]]
+        rows = np.searchsorted(self.ids, from_units)
+        rows = np.minimum(rows, len(self.ids) - 1)
+        known = self.ids[rows] == from_units
+        factors = np.where(known, column[rows], np.nan)
+        return values * factors
+
+
+_graph = None
+
+
+def graph():
+    """Returns the process wide UnitGraph, loading it on first use"""
+    global _graph
+    if _graph is None:
+        _graph = UnitGraph.load()
+    return _graph
+
+
+@refdata.on_change
+def _drop():
+    global _graph
+    _graph = None
+
+
+def invalidate(**kwargs):
+    """Drops the cached graph here and, once the transaction commits, in the
+    other processes. Connected to Unit and UnitConv changes"""
+    refdata.invalidate()
+
+
+def factor(from_unit, to_unit):
+    return graph().factor(from_unit, to_unit)
+
+
+def convert(value, from_unit, to_unit):
+    return graph().convert(value, from_unit, to_unit)
+
+
+def convert_array(values, from_units, to_unit):
+    return graph().convert_array(values, from_units, to_unit)
+
+
+# quantity: field and unit field of the observed quantity, unit it is
+# normalized to and field storing the normalized quantity
+Quantity = namedtuple('Quantity', 'field unit_field unit normalized')
+
+QUANTITIES = {
+    'food': Quantity('weight', 'weight_unit', 'kg', 'weight_kg'),
+    'water': Quantity('consumption', 'volume_unit', 'm3', 'volume_m3'),
+}
+
+
+def _factors(quantity):
+    """(unit ids, factors) of the units convertible to the unit of quantity,
+    None when that unit is not in the catalog"""
+    units = graph()
+    try:
+        column = units.factors[:, units.position[units.unit_id(quantity.unit)]]
+    except UnitConversionError:
+        return None
+    known = np.isfinite(column)
+    return units.ids[known], column[known]
+
+
+def normalize(spec, objs):
+    """Sets the normalized quantity of price instances about to be saved.
+    Rows in a unit without a conversion keep the given value"""
+    quantity = QUANTITIES.get(spec.key)
+    if quantity is None or not objs or _factors(quantity) is None:
+        return
+    amounts = [getattr(obj, quantity.field) for obj in objs]
+    converted = graph().convert_array(
+        [np.nan if amount is None else amount for amount in amounts],
+        [getattr(obj, f'{quantity.unit_field}_id') or 0 for obj in objs], quantity.unit)
+    for obj, amount in zip(objs, converted.tolist()):
+        if math.isfinite(amount):
+            setattr(obj, quantity.normalized, amount)
+
+
+def normalize_table(spec, cursor, table, columns):
+    """normalize() for the rows of a table with the given columns of the
+    price table, in one UPDATE"""
+    quantity = QUANTITIES.get(spec.key)
+    unit_column = quantity and f'{quantity.unit_field}_id'
+    if quantity is None or not {quantity.field, unit_column, quantity.normalized} <= set(columns):
+        return
+    factors = _factors(quantity)
+    if factors is None:
+        return
+    ids, values = factors
+    cursor.execute(
+        f"UPDATE {connection.ops.quote_name(table)} t SET {quantity.normalized} = t.{quantity.field} * u.factor "
+        f"FROM unnest(%s::bigint[], %s::float8[]) AS u (id, factor) WHERE u.id = t.{unit_column}",
+        [ids.tolist(), values.tolist()])
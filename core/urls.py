@@ -0,0 +1,23 @@
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+
+from core.views import (AGGREGATE_VIEWSETS, PRICE_VIEWSETS, CostOfLivingView, LeaderboardRankView,
+                        LeaderboardView, MetricsView, PriceExportView, batch_submission)
+
+router = DefaultRouter()
+for key, viewset in PRICE_VIEWSETS.items():
+    router.register(f'prices/{key}', viewset, basename=f'{key}-price')
+for key, viewset in AGGREGATE_VIEWSETS.items():
+    router.register(f'analytics/{key}', viewset, basename=f'{key}-aggregate')
+
+urlpatterns = [
+    path('cost-of-living/', CostOfLivingView.as_view(), name='cost-of-living'),
+    path('leaderboard/', LeaderboardView.as_view(), name='leaderboard'),
+    path('leaderboard/me/', LeaderboardRankView.as_view(), name='leaderboard-rank'),
+    path('export/<str:key>.<str:output>.gz', PriceExportView.as_view(), {'compress': True},
+         name='price-export-gzip'),
+    path('export/<str:key>.<str:output>', PriceExportView.as_view(), name='price-export'),
+    path('submissions/', batch_submission, name='price-submissions'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('', include(router.urls)),
+]
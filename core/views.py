@@ -1,3 +1,367 @@
-from django.shortcuts import render
+import json
+from datetime import date
 
-# Create your views here.
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Max, Min, Sum
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework import generics, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, NotFound, ValidationError
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+from rest_framework_simplejwt.views import TokenViewBase
+
+from core import authentication, costofliving, export, hierarchy, leaderboard, querystats, refdata, submissions
+from core.models import PriceAggregate, User
+from core.pagination import KeysetPagination, MonthKeysetPagination
+from core.prices import PRICE_SPECS, get_spec
+from core.serializers import CostOfLivingIndexSerializer, PriceAggregateSerializer, price_serializer
+
+
+def date_param(request, name):
+    """Returns the date query parameter name or None"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValidationError({name: 'Expected a date as YYYY-MM-DD'})
+
+
+def path_prefixes(request):
+    """(geography, items) path prefixes of the country, state, area and
+    category query parameters, see core.hierarchy. None for an unknown code"""
+    params = request.query_params
+    geography = items = ''
+    if params.get('state'):
+        state = refdata.state_by_iso(params['state'])
+        if state is None:
+            return None
+        geography = hierarchy.state_prefix(state)
+    elif params.get('country'):
+        country = refdata.country_by_iso(params['country'])
+        if country is None:
+            return None
+        geography = hierarchy.country_prefix(country)
+    if params.get('category'):
+        category = refdata.by_code('category', params['category'])
+        if category is None:
+            return None
+        items = hierarchy.category_path(category)
+    elif params.get('area'):
+        area = refdata.by_code('area', params['area'])
+        if area is None:
+            return None
+        items = hierarchy.area_prefix(area)
+    return geography, items
+
+
+class PriceViewSet(viewsets.ReadOnlyModelViewSet):
+    """Read only price observations, newest first.
+
+    Filters: country and state (iso_code), city and item (id),
+    date_from and date_to (YYYY-MM-DD), and for food area and category (code)
+    """
+    spec = None
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        related = [field.name for field in self.spec.code_relations]
+        queryset = self.spec.model.objects.select_related(*related)
+        filters = {}
+        if params.get('country'):
+            filters['country__iso_code'] = params['country']
+        if params.get('state'):
+            filters['state__iso_code'] = params['state']
+        if params.get('city'):
+            filters['city_id'] = params['city']
+        if params.get('item') and self.spec.item_field:
+            filters[f'{self.spec.item_field}_id'] = params['item']
+        if hierarchy.has_item_path(self.spec) and (params.get('area') or params.get('category')):
+            prefixes = path_prefixes(self.request)
+            if prefixes is None:
+                return queryset.none()
+            filters['item_path__startswith'] = prefixes[1]
+        date_from = date_param(self.request, 'date_from')
+        if date_from:
+            filters['date__gte'] = date_from
+        date_to = date_param(self.request, 'date_to')
+        if date_to:
+            filters['date__lte'] = date_to
+        try:
+            return queryset.filter(**filters)
+        except ValueError:
+            raise ValidationError('city and item must be ids')
+
+
+PRICE_VIEWSETS = {
+    spec.key: type(f'{spec.model.__name__}ViewSet', (PriceViewSet,),
+                   {'spec': spec, 'serializer_class': price_serializer(spec)})
+    for spec in PRICE_SPECS.values()
+}
+
+
+class PriceAggregateViewSet(viewsets.ReadOnlyModelViewSet):
+    """Monthly count/min/max/mean of the comparable price of a price model
+    per city and item, read from PriceAggregate instead of the raw rows.
+
+    Filters: country and state (iso_code), city and item (id),
+    month_from and month_to (YYYY-MM-DD), area and category (code). Areas,
+    categories, states and countries are matched on the paths of
+    core.hierarchy, without joins
+    """
+    spec = None
+    serializer_class = PriceAggregateSerializer
+    pagination_class = MonthKeysetPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        queryset = PriceAggregate.objects.select_related('country').filter(
+            price_model=self.spec.key)
+        prefixes = path_prefixes(self.request)
+        if prefixes is None:
+            return queryset.none()
+        filters = {}
+        geography, items = prefixes
+        if geography:
+            filters['city_path__startswith'] = geography
+        if items:
+            filters['item_path__startswith'] = items
+        if params.get('city'):
+            filters['city_id'] = params['city']
+        if params.get('item'):
+            filters['item_id'] = params['item']
+        month_from = date_param(self.request, 'month_from')
+        if month_from:
+            filters['month__gte'] = month_from.replace(day=1)
+        month_to = date_param(self.request, 'month_to')
+        if month_to:
+            filters['month__lte'] = month_to
+        try:
+            return queryset.filter(**filters)
+        except ValueError:
+            raise ValidationError('city and item must be ids')
+
+    @action(detail=False)
+    def summary(self, request, **kwargs):
+        """Statistics over the whole month range per city and item"""
+        rows = (self.get_queryset().order_by()
+                .values('city_id', 'item_id')
+                .annotate(count=Sum('count'), total=Sum('total'),
+                          minimum=Min('minimum'), maximum=Max('maximum'))
+                .order_by('city_id', 'item_id'))
+        return Response([
+            {'city': row['city_id'], 'item_id': row['item_id'], 'count': row['count'],
+             'minimum': row['minimum'], 'maximum': row['maximum'],
+             'mean': row['total'] / row['count'] if row['count'] else None}
+            for row in rows])
+
+    @action(detail=False)
+    def rollup(self, request, **kwargs):
+        """count/minimum/maximum/mean over every city and item matching the filters"""
+        prefixes = path_prefixes(request)
+        if prefixes is None:
+            return Response({'count': 0, 'minimum': None, 'maximum': None, 'mean': None})
+        return Response(hierarchy.rollup(self.spec, *prefixes, month_from=date_param(request, 'month_from'),
+                                         month_to=date_param(request, 'month_to')))
+
+
+AGGREGATE_VIEWSETS = {
+    spec.key: type(f'{spec.model.__name__}AggregateViewSet', (PriceAggregateViewSet,),
+                   {'spec': spec})
+    for spec in PRICE_SPECS.values()
+}
+
+
+class CostOfLivingView(generics.ListAPIView):
+    """Latest cost of living index per city, 100 is the median city.
+
+    Filters: city (ids separated by commas), country (iso_code),
+    category (a price model or all, the default)
+    """
+    serializer_class = CostOfLivingIndexSerializer
+
+    def get_queryset(self):
+        params = self.request.query_params
+        queryset = costofliving.latest().select_related('country', 'currency').filter(
+            category=params.get('category', 'all')).order_by('-index')
+        if params.get('country'):
+            queryset = queryset.filter(country__iso_code=params['country'])
+        if params.get('city'):
+            try:
+                queryset = queryset.filter(city_id__in=[int(pk) for pk in params['city'].split(',')])
+            except ValueError:
+                raise ValidationError('city must be ids separated by commas')
+        return queryset
+
+
+class PriceExportView(APIView):
+    """Whole price history of a price model, streamed as a file.
+
+    GET /api/export/<model>.<csv|ndjson>[.gz]
+    Filters: country (iso_code), date_from and date_to (YYYY-MM-DD)
+
+    Served under WSGI only. Django 4.0's ASGI handler iterates a streaming
+    response in the event loop, where the queries of the server side cursor
+    raise SynchronousOnlyOperation and cut the file short; under ASGI the
+    view answers 501 instead. Route /api/export/ to WSGI workers, or use
+    the exportprices command.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, key, output, compress=False):
+        if isinstance(request._request, ASGIRequest):
+            return Response({'detail': 'Exports are served by the WSGI application only.'},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+        try:
+            spec = get_spec(key)
+        except KeyError as e:
+            raise NotFound(e.args[0])
+        if output not in export.FORMATS:
+            raise NotFound(f"unknown format {output}, use one of {', '.join(export.FORMATS)}")
+        chunks = export.stream(spec, output, compress=compress,
+                               country=request.query_params.get('country'),
+                               date_from=date_param(request, 'date_from'),
+                               date_to=date_param(request, 'date_to'))
+        filename = f"{key}.{output}{'.gz' if compress else ''}"
+        response = StreamingHttpResponse(
+            chunks, content_type='application/gzip' if compress else export.FORMATS[output])
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+def authenticated_user(request):
+    """User of the API authentication classes of a plain django request, or None"""
+    authenticators = [authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    try:
+        user = Request(request, authenticators=authenticators).user
+    except AuthenticationFailed:
+        return None
+    return user if user.is_authenticated else None
+
+
+async def batch_submission(request):
+    """Submits up to SUBMISSION_MAX_ROWS price rows of any models at once.
+
+    POST /api/submissions/ {"rows": [{"model": "food", ...}, ...]}
+    Returns the result of every row (see core.submissions). With an
+    Idempotency-Key header a retry returns the first response, with the
+    Idempotent-Replayed header set.
+
+    An async view: under ASGI the middleware chain is async (see
+    core.middleware) and a thread is only taken for the sync steps, the
+    hooks of Django's middleware, the authentication and
+    submissions.submit(). The ASGI handler reads the whole body before the
+    middleware runs, so a slow upload holds no thread, but it is buffered,
+    in a temporary file beyond FILE_UPLOAD_MAX_MEMORY_SIZE.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    user = await sync_to_async(authenticated_user)(request)
+    if user is None:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'detail': 'The body is not valid JSON.'}, status=400)
+    try:
+        response, replayed = await sync_to_async(submissions.submit)(
+            user, payload, request.headers.get('Idempotency-Key'))
+    except submissions.BatchError as e:
+        return JsonResponse({'detail': str(e)}, status=e.status)
+    response = JsonResponse(response, status=200 if replayed else 201)
+    if replayed:
+        response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+# csrf_exempt() would wrap the coroutine in a sync function, the API
+# authenticates with tokens, not cookies
+batch_submission.csrf_exempt = True
+
+
+class JWTView(TokenViewBase):
+    """The JSON web token endpoints under /auth/jwt/, served when AUTH_MODE
+    is 'jwt'. The serializer_class is given by the URL"""
+
+    def post(self, request, *args, **kwargs):
+        if authentication.mode() != authentication.JWT:
+            raise NotFound('JSON web tokens are not enabled.')
+        return super().post(request, *args, **kwargs)
+
+
+class JWTLogoutView(JWTView):
+    """Revokes a refresh token. Its access tokens stay valid until they
+    expire, 5 minutes at most"""
+
+    def post(self, request, *args, **kwargs):
+        super().post(request, *args, **kwargs)
+        return Response(status=204)
+
+
+class MetricsView(APIView):
+    """Query and latency percentiles per endpoint of this process, from the
+    requests sampled by QueryStatsMiddleware. Staff only.
+
+    GET /api/metrics/
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({'sample_rate': querystats.sample_rate(), 'endpoints': querystats.snapshot()})
+
+
+def leaderboard_params(request):
+    """Returns (country id, weekly) of the leaderboard query parameters"""
+    params = request.query_params
+    country = None
+    if params.get('country'):
+        found = refdata.country_by_iso(params['country'])
+        if found is None:
+            raise NotFound(f"unknown country {params['country']}")
+        country = found.pk
+    return country, params.get('weekly', '').lower() in ('1', 'true', 'yes')
+
+
+def int_param(request, name, default, maximum):
+    try:
+        return min(max(int(request.query_params.get(name, default)), 0), maximum)
+    except ValueError:
+        raise ValidationError({name: 'Expected an integer'})
+
+
+class LeaderboardView(APIView):
+    """Contributors ranked by points.
+
+    Filters: country (iso_code), weekly (points of this week),
+    limit (default 10, at most 100) and offset
+    """
+
+    def get(self, request):
+        country, weekly = leaderboard_params(request)
+        limit = int_param(request, 'limit', 10, 100)
+        offset = int_param(request, 'offset', 0, 10 ** 9)
+        ranked = leaderboard.top(limit, offset, country=country, weekly=weekly)
+        names = dict(User.objects.filter(pk__in=[user_id for user_id, _ in ranked])
+                     .values_list('id', 'username'))
+        return Response({'results': [
+            {'rank': offset + position, 'user': user_id, 'username': names.get(user_id, ''),
+             'points': points}
+            for position, (user_id, points) in enumerate(ranked, start=1)]})
+
+
+class LeaderboardRankView(APIView):
+    """Rank of the authenticated user, same filters as the leaderboard"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        country, weekly = leaderboard_params(request)
+        found = leaderboard.rank(request.user.pk, country=country, weekly=weekly)
+        rank, points = found or (None, 0)
+        return Response({'rank': rank, 'points': points})
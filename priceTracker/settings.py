@@ -16,6 +16,7 @@ import sys
 import dj_database_url
 import socket
 
+from datetime import timedelta
 from pathlib import Path
 from django.core.management.utils import get_random_secret_key
 
@@ -74,6 +75,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.QueryStatsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,6 +83,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.RefDataMiddleware',
 ]
 
 ROOT_URLCONF = 'priceTracker.urls'
@@ -156,6 +159,23 @@ elif len(sys.argv) > 0 and sys.argv[1] == "collectstatic":
 else:
     print("upps")
 
+# Cache
+# Shared by all workers when REDIS_URL is set, per process otherwise
+
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
 
@@ -228,8 +248,22 @@ EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 SITE_NAME = "pricetracker"
 
 
+# 'token' (DRF tokens) or 'jwt' (JSON web tokens as well, see core.authentication).
+# 'jwt' needs a cache shared by the workers, REDIS_URL
+AUTH_MODE = os.getenv("AUTH_MODE", "token")
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.JWTAuthentication',
+        'core.authentication.CachedTokenAuthentication',
     ),
 }
+
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    'ROTATE_REFRESH_TOKENS': True,
+    # rotated tokens are revoked in the cache, not in the blacklist app tables
+    'BLACKLIST_AFTER_ROTATION': False,
+    'TOKEN_USER_CLASS': 'core.authentication.JWTUser',
+}
@@ -16,9 +16,16 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include, re_path
 
+from core.serializers import JWTCreateSerializer, JWTRefreshSerializer, JWTRevokeSerializer
+from core.views import JWTLogoutView, JWTView
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls')),
     re_path(r'^auth/', include('djoser.urls')),
     re_path(r'^auth/', include('djoser.urls.authtoken')),
+    path('auth/jwt/create/', JWTView.as_view(serializer_class=JWTCreateSerializer), name='jwt-create'),
+    path('auth/jwt/refresh/', JWTView.as_view(serializer_class=JWTRefreshSerializer), name='jwt-refresh'),
+    path('auth/jwt/logout/', JWTLogoutView.as_view(serializer_class=JWTRevokeSerializer), name='jwt-logout'),
+    path('api/', include('core.urls')),
 ]